@@ -13,9 +13,9 @@ if errorlevel 1 (
 )
 
 REM Check/install required packages
-python -c "import pandas, openpyxl" 2>nul || (
+python -c "import numpy, pandas, openpyxl, pyarrow" 2>nul || (
     echo Installing required packages...
-    pip install pandas openpyxl --quiet
+    pip install numpy pandas openpyxl pyarrow --quiet
 )
 
 REM Run the tool
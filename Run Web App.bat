@@ -13,9 +13,9 @@ if errorlevel 1 (
 )
 
 REM Check/install required packages
-python -c "import flask, pandas, openpyxl" 2>nul || (
+python -c "import flask, numpy, pandas, openpyxl, pyarrow" 2>nul || (
     echo Installing required packages...
-    python -m pip install flask pandas openpyxl --quiet
+    python -m pip install flask numpy pandas openpyxl pyarrow --quiet
 )
 
 REM Run the web app
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Persisted per-listing statement aggregates.
+Each ingested statement file is parsed once and only its yearly/monthly sums
+are kept in SQLite, together with the file's size, mtime and SHA-256. When a
+listing's monthly statement arrives, only that file is read; the listing's
+totals are re-summed from the stored rows, and valuations are regenerated
+from them without touching the earlier history again.
+
+Statements are assumed to cover separate periods (one file per month or
+quarter, say); two files holding the same rows would be counted twice.
+"""
+
+from datetime import datetime
+import hashlib
+import os
+import sqlite3
+import pandas as pd
+import statement_reader
+
+HASH_CHUNK = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS statements (
+    id INTEGER PRIMARY KEY,
+    listing TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    has_months INTEGER NOT NULL,
+    ingested_at TEXT NOT NULL,
+    UNIQUE (listing, path)
+);
+CREATE TABLE IF NOT EXISTS sums (
+    statement_id INTEGER NOT NULL REFERENCES statements (id) ON DELETE CASCADE,
+    period TEXT NOT NULL,
+    key TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (statement_id, period, key)
+);
+"""
+
+# Outcomes of AggregateStore.ingest()
+ADDED, UPDATED, UNCHANGED, DUPLICATE = 'added', 'updated', 'unchanged', 'duplicate'
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_statement_totals(path):
+    """(yearly, monthly or None) for a statement on disk (any of statement_reader.STATEMENT_FORMATS)."""
+    return statement_reader.read_totals(path)
+
+
+class AggregateStore:
+    """SQLite-backed yearly/monthly sums per listing, one set of rows per statement file."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def ingest(self, path, listing=None):
+        """Record a statement's sums unless this exact file was already ingested.
+
+        listing defaults to statement_reader.listing_name(path). Returns one of
+        ADDED, UPDATED (the file at this path changed), UNCHANGED or DUPLICATE
+        (the same contents were already ingested for the listing under another path).
+        """
+        listing = listing or statement_reader.listing_name(path)
+        path = os.path.abspath(path)
+        st = os.stat(path)
+
+        with self._connect() as conn:
+            existing = conn.execute("SELECT * FROM statements WHERE listing=? AND path=?",
+                                    (listing, path)).fetchone()
+        # Same size and mtime: trust it without re-reading the file
+        if existing and (existing['size'], existing['mtime_ns']) == (st.st_size, st.st_mtime_ns):
+            return UNCHANGED
+
+        sha256 = _file_sha256(path)
+        with self._connect() as conn:
+            if existing and existing['sha256'] == sha256:
+                conn.execute("UPDATE statements SET mtime_ns=? WHERE id=?", (st.st_mtime_ns, existing['id']))
+                return UNCHANGED
+            duplicate = conn.execute("SELECT 1 FROM statements WHERE listing=? AND sha256=? AND path!=?",
+                                     (listing, sha256, path)).fetchone()
+        if duplicate:
+            return DUPLICATE
+
+        # Only the new or changed statement is parsed
+        yearly, monthly = read_statement_totals(path)
+        rows = [('year', str(int(year)), float(amount)) for year, amount in yearly.items()]
+        if monthly is not None:
+            rows += [('month', str(month), float(amount)) for month, amount in monthly.items()]
+
+        with self._connect() as conn:
+            if existing:
+                conn.execute("DELETE FROM statements WHERE id=?", (existing['id'],))
+            cursor = conn.execute(
+                "INSERT INTO statements (listing, path, sha256, size, mtime_ns, has_months, ingested_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (listing, path, sha256, st.st_size, st.st_mtime_ns, int(monthly is not None),
+                 datetime.now().isoformat(timespec='seconds')))
+            conn.executemany("INSERT INTO sums (statement_id, period, key, amount) VALUES (?, ?, ?, ?)",
+                             [(cursor.lastrowid, *row) for row in rows])
+        return UPDATED if existing else ADDED
+
+    def totals(self, listing):
+        """(yearly, monthly or None) summed over every statement ingested for a listing.
+
+        Monthly totals are only returned when every statement had a date column,
+        since a statement with yearly sums alone would leave months missing.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT period, key, SUM(amount) AS amount FROM sums "
+                "JOIN statements ON statements.id = sums.statement_id "
+                "WHERE listing=? GROUP BY period, key", (listing,)).fetchall()
+            all_months = conn.execute("SELECT MIN(has_months) FROM statements WHERE listing=?",
+                                      (listing,)).fetchone()[0]
+
+        years = {int(r['key']): r['amount'] for r in rows if r['period'] == 'year'}
+        yearly = pd.Series(years, dtype='float64').sort_index()
+        monthly = None
+        if all_months:
+            months = {pd.Period(r['key'], freq='M'): r['amount'] for r in rows if r['period'] == 'month'}
+            monthly = pd.Series(months, dtype='float64').sort_index()
+        return yearly, monthly
+
+    def listings(self):
+        """Every listing with at least one ingested statement."""
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute("SELECT DISTINCT listing FROM statements ORDER BY listing")]
+
+    def statements(self, listing):
+        """The ingested statement records for a listing, oldest first."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM statements WHERE listing=? ORDER BY id", (listing,)).fetchall()
+        return [dict(r) for r in rows]
+
+    def remove(self, listing, path=None):
+        """Forget one statement (by path) or every statement of a listing."""
+        with self._connect() as conn:
+            if path is None:
+                conn.execute("DELETE FROM statements WHERE listing=?", (listing,))
+            else:
+                conn.execute("DELETE FROM statements WHERE listing=? AND path=?",
+                             (listing, os.path.abspath(path)))
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the statement → valuation pipeline.
+Synthetic statements are generated deterministically (same rows, seed and
+column naming give the same file) and cached in a data folder, then each
+stage is timed on them:
+
+    parse      reading the amount and year columns of the CSV, chunk by chunk
+    detect     reading the header and detecting the amount/year columns
+    aggregate  statement_reader.statement_totals (parse + sum by year/month)
+    workbook   writing the valuation workbook, per backend
+    process    POST /process end to end, through Flask's test client
+
+Run the default sizes (1k, 100k, 1M rows) and compare with the stored baseline;
+the exit status is 1 when a stage got slower than the threshold allows:
+    python benchmark.py
+    python benchmark.py --rows 1k,10M --naming earnings --stages parse,aggregate
+    python benchmark.py --rows 50M --stages aggregate --repeat 1
+
+Timings depend on the machine, so record the baseline on the one the
+comparisons will run on (timings of other sizes and stages already stored are kept):
+    python benchmark.py --save-baseline
+
+Just write a synthetic statement:
+    python benchmark.py --generate statement.csv --rows 5M --naming earnings
+"""
+
+import argparse
+from datetime import date
+import functools
+import io
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import statement_reader
+import valuation_workbook
+
+# Statement layouts as different platforms export them: columns in file order,
+# and which hold the amount and the year/date
+NAMINGS = {
+    'royalty_exchange': {
+        'columns': ['Song Title', 'Income Type', 'Territory', 'distribution_year', 'payable_amount'],
+        'amount': 'payable_amount', 'year': 'distribution_year',
+    },
+    'earnings': {
+        'columns': ['Date', 'Song', 'Store', 'Country', 'Quantity', 'Earnings'],
+        'amount': 'Earnings', 'year': 'Date',
+    },
+    'simple': {
+        'columns': ['Year', 'Amount'],
+        'amount': 'Amount', 'year': 'Year',
+    },
+}
+
+STAGES = ('parse', 'detect', 'aggregate', 'workbook', 'process')
+WORKBOOK_BACKENDS = ('template', *valuation_workbook.BACKENDS)
+
+DEFAULT_ROWS = '1k,100k,1M'
+DEFAULT_YEARS = 6
+# Statements end in a fixed year so the same seed always gives the same file
+LAST_YEAR = 2025
+
+# Bumped whenever the generator's output changes, so cached files are rebuilt
+GENERATOR_VERSION = 1
+GENERATE_CHUNK = 500_000
+
+# Uploads bigger than this are left out of the process stage
+PROCESS_MAX_ROWS = 5_000_000
+DETECT_LOOPS = 50
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DEFAULT_THRESHOLD = 0.25
+# Slowdowns smaller than this many seconds are noise, whatever the ratio
+ABS_TOLERANCE = 0.002
+
+_TITLES = np.array([f'Track {i:03d}' for i in range(1, 241)])
+_INCOME_TYPES = np.array(['Performance', 'Mechanical', 'Sync', 'Digital Performance', 'Neighbouring Rights'])
+_STORES = np.array(['Spotify', 'Apple Music', 'YouTube', 'Amazon Music', 'Deezer', 'Tidal', 'Pandora'])
+_COUNTRIES = np.array(['US', 'GB', 'DE', 'FR', 'CA', 'AU', 'BR', 'JP', 'SE', 'MX'])
+
+
+def parse_rows(text):
+    """Row count from '5000', '100k', '50M' or '1.5M'."""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([kKmM]?)\s*', text)
+    if match is None:
+        raise ValueError(f"Can't read a row count from '{text}'")
+    scale = {'': 1, 'k': 1_000, 'm': 1_000_000}[match.group(2).lower()]
+    return int(float(match.group(1)) * scale)
+
+
+def rows_label(rows):
+    for scale, suffix in ((1_000_000, 'M'), (1_000, 'k')):
+        if rows >= scale and rows % scale == 0:
+            return f'{rows // scale}{suffix}'
+    return str(rows)
+
+
+# ============================================================================
+# SYNTHETIC STATEMENTS
+# ============================================================================
+def _statement_chunk(rng, rows, naming, years):
+    """One DataFrame of statement rows: many small per-stream amounts, more recent years busier."""
+    spec = NAMINGS[naming]
+    first_year = LAST_YEAR - years + 1
+    # Catalogues grow: later years get proportionally more rows
+    weights = np.arange(1, years + 1, dtype='float64')
+    year = first_year + rng.choice(years, size=rows, p=weights / weights.sum())
+    amount = np.round(rng.lognormal(mean=-4.0, sigma=1.6, size=rows), 6)
+
+    data = {}
+    for column in spec['columns']:
+        if column == spec['amount']:
+            data[column] = amount
+        elif column == spec['year'] and column.lower() == 'date':
+            # US-style dates, looked up from every (year, month, day) so no per-row formatting
+            days = [date(y, m, d).strftime('%m/%d/%Y')
+                    for y in range(first_year, LAST_YEAR + 1) for m in range(1, 13) for d in range(1, 29)]
+            index = (year - first_year) * 336 + rng.integers(0, 12, rows) * 28 + rng.integers(0, 28, rows)
+            data[column] = np.array(days)[index]
+        elif column == spec['year']:
+            data[column] = year
+        elif column == 'Quantity':
+            data[column] = rng.integers(1, 500, rows)
+        else:
+            pool = {'Song Title': _TITLES, 'Song': _TITLES, 'Income Type': _INCOME_TYPES,
+                    'Store': _STORES, 'Country': _COUNTRIES, 'Territory': _COUNTRIES}[column]
+            data[column] = pool[rng.integers(0, len(pool), rows)]
+    return pd.DataFrame(data, columns=spec['columns'])
+
+
+def generate_statement(path, rows, naming='royalty_exchange', years=DEFAULT_YEARS, seed=0):
+    """Write a synthetic CSV statement of the given size and column naming (see NAMINGS).
+
+    Rows are generated and written GENERATE_CHUNK at a time, so any size fits
+    in memory; each chunk has its own seed, so the output only depends on the
+    arguments.
+    """
+    if naming not in NAMINGS:
+        raise ValueError(f"Unknown naming '{naming}' (choose from {', '.join(NAMINGS)})")
+    partial = f'{path}.partial'
+    with open(partial, 'w', newline='') as f:
+        for index, start in enumerate(range(0, max(rows, 1), GENERATE_CHUNK)):
+            rng = np.random.default_rng([seed, index])
+            chunk = _statement_chunk(rng, min(GENERATE_CHUNK, rows - start), naming, years)
+            chunk.to_csv(f, header=index == 0, index=False)
+    os.replace(partial, path)
+    return path
+
+
+def cached_statement(data_dir, rows, naming, years=DEFAULT_YEARS, seed=0):
+    """Path of a generated statement in data_dir, generating it on first use."""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f'listing-{rows}-{naming}-y{years}-s{seed}-v{GENERATOR_VERSION}.csv')
+    if not os.path.exists(path):
+        print(f'Generating {rows_label(rows)} {naming} rows -> {path}', flush=True)
+        generate_statement(path, rows, naming, years, seed)
+    return path
+
+
+# ============================================================================
+# STAGES
+# ============================================================================
+def best_time(fn, repeat, loops=1, warmup=False):
+    """Fastest of repeat runs of fn() (seconds per call, averaged over loops calls)."""
+    if warmup:
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        times.append((time.perf_counter() - start) / loops)
+    return min(times)
+
+
+def _parse(path, csv_engine):
+    amount_col, year_col = statement_reader.detect_columns(statement_reader.read_csv_header(path))
+    is_date = year_col.lower() == 'date'
+    if csv_engine == 'pyarrow':
+        for _ in statement_reader._pyarrow_csv_chunks(path, amount_col, year_col, is_date):
+            pass
+        return
+    for _ in pd.read_csv(path, usecols=[amount_col, year_col],
+                         dtype={amount_col: 'float64', year_col: 'str' if is_date else 'float64'},
+                         chunksize=statement_reader.CHUNK_ROWS, memory_map=True):
+        pass
+
+
+def _write_workbook(inputs, backend):
+    return valuation_workbook.write_valuation_workbook(io.BytesIO(), 'Listing 1', **inputs, backend=backend)
+
+
+def _detect(path):
+    return statement_reader.detect_columns(statement_reader.read_csv_header(path))
+
+
+class _ProcessClient:
+    """POSTs statements to /process through Flask's test client, never hitting the result cache."""
+
+    def __init__(self, data_dir, csv_engine):
+        # web_app reads its settings at import; keep its index and cache out of the way
+        index_path = os.path.join(data_dir, 'benchmark-index.sqlite3')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(index_path + suffix):
+                os.remove(index_path + suffix)
+        os.environ.update(VALUATION_INDEX_DB=index_path, RESULT_CACHE_DIR='', RESULT_CACHE_ITEMS='1',
+                          CSV_ENGINE=csv_engine, MAX_UPLOAD_MB='0')
+        import web_app
+        self.client = web_app.app.test_client()
+        self.uploads = 0
+
+    def post(self, path):
+        # A new filename each time gives a new cache key
+        self.uploads += 1
+        with open(path, 'rb') as f:
+            response = self.client.post('/process', content_type='multipart/form-data',
+                                        data={'file': (f, f'listing-{self.uploads}.csv')})
+            body = response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"/process failed ({response.status_code}): {body[:200]!r}")
+        return body
+
+
+def benchmark_plan(sizes, namings, stages=STAGES, years=DEFAULT_YEARS, seed=0, csv_engine='c',
+                   data_dir=None, process_max_rows=PROCESS_MAX_ROWS):
+    """[(key, fn, loops, warmup)] for every stage to time, generating statements as needed.
+
+    Keys are 'stage/naming/rows/engine' ('workbook/backend' for the workbook
+    stage, which doesn't depend on the statement).
+    """
+    data_dir = data_dir or os.path.join(tempfile.gettempdir(), 'royalty-benchmark-data')
+    plan = []
+    if 'workbook' in stages:
+        inputs = {'year_minus_3': 41_250.0, 'year_minus_2': 48_930.5, 'year_minus_1': 55_120.25,
+                  'ytd': 31_004.0, 'base_year': 55_120.25}
+        for backend in WORKBOOK_BACKENDS:
+            write = functools.partial(_write_workbook, inputs, backend)
+            plan.append((f'workbook/{backend}', write, 1, True))
+
+    client = None
+    for rows in sizes:
+        for naming in namings:
+            path = cached_statement(data_dir, rows, naming, years, seed)
+            label = f'{naming}/{rows_label(rows)}'
+            if 'parse' in stages:
+                plan.append((f'parse/{label}/{csv_engine}', functools.partial(_parse, path, csv_engine), 1, False))
+            if 'detect' in stages:
+                plan.append((f'detect/{label}', functools.partial(_detect, path), DETECT_LOOPS, True))
+            if 'aggregate' in stages:
+                aggregate = functools.partial(statement_reader.statement_totals, path, csv_engine=csv_engine)
+                plan.append((f'aggregate/{label}/{csv_engine}', aggregate, 1, False))
+            if 'process' in stages and rows <= process_max_rows:
+                if client is None:
+                    client = _ProcessClient(data_dir, csv_engine)
+                    # Warm up imports and the compiled template
+                    client.post(cached_statement(data_dir, 1000, naming, years, seed))
+                plan.append((f'process/{label}/{csv_engine}', functools.partial(client.post, path), 1, False))
+    return plan
+
+
+def run_benchmarks(plan, repeat=5, report=print):
+    """Time each entry of a benchmark_plan; returns {key: seconds}."""
+    results = {}
+    for key, fn, loops, warmup in plan:
+        results[key] = best_time(fn, repeat, loops, warmup)
+        report(f'{key:<45} {results[key] * 1000:>12.3f} ms')
+    return results
+
+
+# ============================================================================
+# BASELINES
+# ============================================================================
+def machine_info():
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(), 'cpus': os.cpu_count()}
+
+
+def load_baseline(path=BASELINE_PATH):
+    """The stored baseline ({'machine': ..., 'results': {key: seconds}}, plus optional 'notes'), or None."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    """Merge results into the baseline at path (keys not measured this run are kept)."""
+    baseline = load_baseline(path) or {'results': {}}
+    baseline['machine'] = machine_info()
+    baseline['results'].update({key: round(seconds, 6) for key, seconds in results.items()})
+    baseline['results'] = dict(sorted(baseline['results'].items()))
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+        f.write('\n')
+    return baseline
+
+
+def find_regressions(results, baseline, threshold=DEFAULT_THRESHOLD, tolerance=ABS_TOLERANCE):
+    """[(key, baseline seconds, seconds, ratio)] for stages slower than baseline * (1 + threshold).
+
+    Slowdowns under tolerance seconds are ignored, since tiny stages are noisy.
+    """
+    regressions = []
+    for key, seconds in results.items():
+        before = baseline['results'].get(key)
+        if before is None:
+            continue
+        if seconds > before * (1 + threshold) and seconds - before > tolerance:
+            regressions.append((key, before, seconds, seconds / before if before else float('inf')))
+    return regressions
+
+
+# ============================================================================
+# COMMAND LINE
+# ============================================================================
+def _choices(text, allowed, what):
+    chosen = [c.strip() for c in text.split(',') if c.strip()]
+    if chosen == ['all']:
+        return list(allowed)
+    unknown = [c for c in chosen if c not in allowed]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown {what} {', '.join(unknown)} (choose from {', '.join(allowed)})")
+    return chosen
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Royalty valuation benchmarks")
+    parser.add_argument('--rows', default=DEFAULT_ROWS,
+                        help=f'comma-separated statement sizes, e.g. 1k,100k,50M (default: {DEFAULT_ROWS})')
+    parser.add_argument('--naming', default='all', type=lambda t: _choices(t, NAMINGS, 'naming'),
+                        help=f"comma-separated column namings: {', '.join(NAMINGS)} (default: all)")
+    parser.add_argument('--stages', default='all', type=lambda t: _choices(t, STAGES, 'stage'),
+                        help=f"comma-separated stages: {', '.join(STAGES)} (default: all)")
+    parser.add_argument('--repeat', type=int, default=5, help='runs per stage; the fastest counts (default: 5)')
+    parser.add_argument('--years', type=int, default=DEFAULT_YEARS,
+                        help=f'years of history in generated statements (default: {DEFAULT_YEARS})')
+    parser.add_argument('--seed', type=int, default=0, help='generator seed (default: 0)')
+    parser.add_argument('--csv-engine', default='c', choices=statement_reader.CSV_ENGINES,
+                        help='CSV parser for the parse, aggregate and process stages (default: c)')
+    parser.add_argument('--data-dir', default=None, help='where generated statements are cached '
+                                                         '(default: royalty-benchmark-data in the temp folder)')
+    parser.add_argument('--process-max-rows', default=rows_label(PROCESS_MAX_ROWS),
+                        help='largest statement uploaded in the process stage (default: %(default)s)')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline JSON (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true', help='store these timings as the baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown over the baseline, as a fraction (default: %(default)s)')
+    parser.add_argument('--generate', metavar='CSV',
+                        help='just write one synthetic statement (of the first --rows size and --naming)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [parse_rows(r) for r in args.rows.split(',') if r.strip()]
+
+    if args.generate:
+        generate_statement(args.generate, sizes[0], args.naming[0], args.years, args.seed)
+        print(f'Wrote {rows_label(sizes[0])} {args.naming[0]} rows to {args.generate}')
+        return 0
+
+    plan = benchmark_plan(sizes, args.naming, args.stages, args.years, args.seed, args.csv_engine,
+                          args.data_dir, parse_rows(args.process_max_rows))
+    results = run_benchmarks(plan, args.repeat)
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f'Saved {len(results)} timings to {args.baseline}')
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f'No baseline at {args.baseline}; run with --save-baseline to create one')
+        return 0
+    if baseline.get('machine', {}).get('platform') != machine_info()['platform']:
+        print('Note: the baseline was recorded on a different machine; ratios may not mean much')
+
+    regressions = find_regressions(results, baseline, args.threshold)
+    if regressions:
+        # Timings are noisy: a stage only counts as slower if a second round agrees
+        slower = {key for key, *_ in regressions}
+        print(f'Re-measuring {len(slower)} slower stage(s)')
+        again = run_benchmarks([entry for entry in plan if entry[0] in slower], args.repeat)
+        results.update({key: min(results[key], seconds) for key, seconds in again.items()})
+        regressions = find_regressions(results, baseline, args.threshold)
+    compared = sum(key in baseline['results'] for key in results)
+    for key, before, seconds, ratio in regressions:
+        print(f'REGRESSION {key}: {before * 1000:.3f} ms -> {seconds * 1000:.3f} ms ({ratio:.2f}x)')
+    print(f'{compared} of {len(results)} timings compared with the baseline, '
+          f'{len(regressions)} slower than {1 + args.threshold:.2f}x')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Background job queue for valuations.
+Uploads are spooled to disk and handed to a local process pool, and every job
+is recorded in a SQLite table so any web worker can answer status/download
+requests. Large statements run in their own lane so they never hold up the
+small ones queued behind them.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+
+QUEUED, RUNNING, DONE, ERROR = 'queued', 'running', 'done', 'error'
+
+# Each web process's queue refreshes a heartbeat this often; jobs queued by an
+# instance whose heartbeat is older than INSTANCE_STALE_SECONDS are orphans
+HEARTBEAT_SECONDS = 30
+INSTANCE_STALE_SECONDS = 120
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    lane TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    input_size INTEGER NOT NULL,
+    input_path TEXT NOT NULL,
+    output_filename TEXT,
+    output_path TEXT,
+    error TEXT,
+    pid INTEGER,
+    instance TEXT,
+    options TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at);
+CREATE TABLE IF NOT EXISTS instances (
+    token TEXT PRIMARY KEY,
+    heartbeat TEXT NOT NULL
+);
+"""
+
+
+class QueueFull(Exception):
+    """Raised when a lane already has its maximum number of pending jobs."""
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _run_job(db_path, job_id, process, input_path, filename, output_dir, options=None):
+    """Pool worker: process one spooled upload (with the job's options) and record the outcome."""
+    with _connect(db_path) as conn:
+        conn.execute("UPDATE jobs SET status=?, pid=?, started_at=? WHERE id=?",
+                     (RUNNING, os.getpid(), _now(), job_id))
+    try:
+        excel_bytes, output_filename = process(input_path, filename, **(options or {}))
+        output_path = os.path.join(output_dir, 'result.xlsx')
+        with open(output_path, 'wb') as f:
+            f.write(excel_bytes)
+        with _connect(db_path) as conn:
+            conn.execute("UPDATE jobs SET status=?, output_filename=?, output_path=?, finished_at=? "
+                         "WHERE id=?", (DONE, output_filename, output_path, _now(), job_id))
+    except Exception as e:
+        with _connect(db_path) as conn:
+            conn.execute("UPDATE jobs SET status=?, error=?, finished_at=? WHERE id=?",
+                         (ERROR, str(e), _now(), job_id))
+    finally:
+        # The upload is no longer needed once the job has finished either way
+        if os.path.exists(input_path):
+            os.remove(input_path)
+
+
+class JobQueue:
+    """Submit/poll/download valuations backed by a bounded process pool per lane.
+
+    process(input_path, filename, **options) must be a picklable top-level
+    function that returns (xlsx bytes, output filename).
+    """
+
+    def __init__(self, process, job_dir, small_workers=None, large_workers=1,
+                 large_bytes=50 * 1024 * 1024, max_pending=1000, retention_hours=24):
+        self.process = process
+        self.job_dir = job_dir
+        self.db_path = os.path.join(job_dir, 'jobs.sqlite3')
+        self.large_bytes = large_bytes
+        self.max_pending = max_pending
+        self.retention = timedelta(hours=retention_hours)
+        self.workers = {
+            'small': small_workers or max(1, (os.cpu_count() or 2) - large_workers),
+            'large': large_workers,
+        }
+
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._pending = {'small': 0, 'large': 0}
+        self._token = self._token_pid = None
+        self._stopped = threading.Event()
+
+        os.makedirs(job_dir, exist_ok=True)
+        with _connect(self.db_path) as conn:
+            conn.executescript(_SCHEMA)
+            # Tables created before jobs recorded the queue instance that owns them
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'instance' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN instance TEXT")
+            if 'options' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN options TEXT")
+        self._fail_orphans()
+
+    def _pool(self, lane):
+        # Pools are started on first use so forking servers don't inherit them
+        with self._lock:
+            if lane not in self._pools:
+                self._pools[lane] = ProcessPoolExecutor(max_workers=self.workers[lane])
+            return self._pools[lane]
+
+    def _instance(self):
+        """This process's instance token, registered with a heartbeat thread on first use.
+
+        Jobs are owned by a random token per process rather than a pid: pids
+        can't be probed portably (os.kill terminates the process on Windows)
+        and a restarted container reuses them. A forked child gets its own token.
+        """
+        with self._lock:
+            if self._token_pid != os.getpid():
+                self._token, self._token_pid = uuid.uuid4().hex, os.getpid()
+                self._beat(self._token)
+                threading.Thread(target=self._heartbeat, args=(self._token,), daemon=True).start()
+            return self._token
+
+    def _beat(self, token):
+        with _connect(self.db_path) as conn:
+            conn.execute("INSERT OR REPLACE INTO instances (token, heartbeat) VALUES (?, ?)", (token, _now()))
+
+    def _heartbeat(self, token):
+        while not self._stopped.wait(HEARTBEAT_SECONDS):
+            try:
+                self._beat(token)
+            except sqlite3.Error:
+                # A busy database just delays this beat; the next one catches up
+                pass
+
+    def _fail_orphans(self):
+        """Fail jobs no live process will finish, instead of leaving them queued or running forever.
+
+        A job is orphaned when the queue instance it was submitted to has
+        stopped its heartbeat, since its pool (and any worker running the job)
+        went with it. Their spooled uploads are removed; purge_expired()
+        deletes the rows once they are past the retention period.
+        """
+        cutoff = (datetime.now() - timedelta(seconds=INSTANCE_STALE_SECONDS)).isoformat(timespec='seconds')
+        with _connect(self.db_path) as conn:
+            conn.execute("DELETE FROM instances WHERE heartbeat < ?", (cutoff,))
+            rows = conn.execute("SELECT id, status, input_path FROM jobs WHERE status IN (?, ?) AND "
+                                "(instance IS NULL OR instance NOT IN (SELECT token FROM instances))",
+                                (QUEUED, RUNNING)).fetchall()
+            for row in rows:
+                if row['status'] == RUNNING:
+                    error = "Worker stopped before the job finished"
+                else:
+                    error = "The server restarted before the job started, please submit it again"
+                failed = conn.execute("UPDATE jobs SET status=?, error=?, finished_at=? WHERE id=? AND status=?",
+                                      (ERROR, error, _now(), row['id'], row['status'])).rowcount
+                if failed and os.path.exists(row['input_path']):
+                    os.remove(row['input_path'])
+
+    def submit(self, file_storage, options=None):
+        """Spool an upload to disk and queue it; returns the job as a dict.
+
+        options are keyword arguments for process(), JSON-serializable so they
+        can be kept on the job row.
+        """
+        self.purge_expired()
+
+        job_id = uuid.uuid4().hex
+        job_path = os.path.join(self.job_dir, job_id)
+        os.makedirs(job_path)
+        input_path = os.path.join(job_path, 'upload')
+        file_storage.save(input_path)
+        size = os.path.getsize(input_path)
+        lane = 'large' if size >= self.large_bytes else 'small'
+
+        with self._lock:
+            if self._pending[lane] >= self.max_pending:
+                shutil.rmtree(job_path, ignore_errors=True)
+                raise QueueFull(f"Too many {lane} jobs queued, try again shortly")
+            self._pending[lane] += 1
+
+        with _connect(self.db_path) as conn:
+            conn.execute("INSERT INTO jobs (id, status, lane, filename, input_size, input_path, instance, options, "
+                         "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (job_id, QUEUED, lane, file_storage.filename, size, input_path, self._instance(),
+                          json.dumps(options or {}, sort_keys=True), _now()))
+
+        future = self._pool(lane).submit(_run_job, self.db_path, job_id, self.process,
+                                         input_path, file_storage.filename, job_path, options)
+        future.add_done_callback(lambda f, lane=lane: self._finished(job_id, lane, f))
+        return self.get(job_id)
+
+    def _finished(self, job_id, lane, future):
+        with self._lock:
+            self._pending[lane] -= 1
+        # A crashed worker process never got to record its own failure
+        if future.exception() is not None:
+            with _connect(self.db_path) as conn:
+                conn.execute("UPDATE jobs SET status=?, error=?, finished_at=? WHERE id=? AND status!=?",
+                             (ERROR, str(future.exception()), _now(), job_id, DONE))
+
+    def get(self, job_id):
+        """The job's row as a dict, or None if it doesn't exist."""
+        with _connect(self.db_path) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def purge_expired(self):
+        """Delete finished jobs (and their files) older than the retention period.
+
+        Orphaned queued/running jobs are failed first, so they expire too.
+        """
+        self._fail_orphans()
+        cutoff = (datetime.now() - self.retention).isoformat(timespec='seconds')
+        with _connect(self.db_path) as conn:
+            expired = conn.execute("SELECT id FROM jobs WHERE created_at < ? AND status IN (?, ?)",
+                                   (cutoff, DONE, ERROR)).fetchall()
+            for row in expired:
+                shutil.rmtree(os.path.join(self.job_dir, row['id']), ignore_errors=True)
+            conn.execute("DELETE FROM jobs WHERE created_at < ? AND status IN (?, ?)",
+                         (cutoff, DONE, ERROR))
+
+    def shutdown(self, wait=True):
+        self._stopped.set()
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.shutdown(wait=wait)
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Load test for the web app's /process endpoint.
+Starts web_app locally under gunicorn (or Flask's threaded server), uploads a
+weighted mix of small and large synthetic statements (see benchmark.py) from
+a number of concurrent clients, and reports throughput, latency percentiles,
+errors and the server processes' memory:
+
+    python load_test.py --workers 4 --concurrency 8 --duration 60
+    python load_test.py --mix 10k:9,1M:1 --concurrency 16 --requests 500
+    python load_test.py --server flask --concurrency 4
+    python load_test.py --url http://staging:8000 --concurrency 8
+
+Every upload gets its own filename, so the result cache never answers; pass
+--allow-cache to measure cache hits instead. --max-error-rate and --max-p95-ms
+make the exit status 1 when the run is worse, for use as a regression check.
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+import uuid
+import benchmark
+
+DEFAULT_MIX = '10k:9,1M:1'
+SERVERS = ('gunicorn', 'flask')
+STARTUP_TIMEOUT = 60
+MEMORY_SAMPLE_SECONDS = 0.5
+
+
+def parse_mix(text):
+    """[(rows, weight)] from 'rows:weight,...' (e.g. '10k:9,1M:1'); weights default to 1."""
+    mix = []
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        rows, _, weight = item.partition(':')
+        mix.append((benchmark.parse_rows(rows), float(weight or 1)))
+    if not mix:
+        raise ValueError("The upload mix is empty")
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return float('nan')
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+# ============================================================================
+# SERVER
+# ============================================================================
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(server='gunicorn', workers=2, threads=1, port=None, env=None, log_path=None):
+    """Start web_app on 127.0.0.1 in a subprocess; returns (process, base URL)."""
+    port = port or _free_port()
+    here = os.path.dirname(os.path.abspath(__file__))
+    if server == 'gunicorn':
+        if shutil.which('gunicorn') is None:
+            raise ValueError("gunicorn isn't installed (pip install gunicorn), or use --server flask")
+        command = ['gunicorn', '--workers', str(workers), '--threads', str(threads),
+                   '--bind', f'127.0.0.1:{port}', '--timeout', '600', 'web_app:app']
+    elif server == 'flask':
+        command = [sys.executable, '-m', 'flask', '--app', 'web_app', 'run', '--port', str(port), '--with-threads']
+    else:
+        raise ValueError(f"Unknown server '{server}' (choose from {', '.join(SERVERS)})")
+
+    log = open(log_path, 'ab') if log_path else subprocess.DEVNULL
+    process = subprocess.Popen(command, cwd=here, env={**os.environ, **(env or {})},
+                               stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The {server} server exited with status {process.returncode}"
+                               + (f" (see {log_path})" if log_path else ""))
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/')
+            if connection.getresponse().status == 200:
+                return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"The {server} server didn't answer within {STARTUP_TIMEOUT}s")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def _process_tree(pid):
+    """pid and all its descendants (Linux /proc)."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The ppid follows the parenthesised command name, which may contain spaces
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class MemorySampler(threading.Thread):
+    """Samples the resident memory of a server process and its workers until stopped."""
+
+    def __init__(self, pid, interval=MEMORY_SAMPLE_SECONDS):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_process = 0
+        self.peak_total = 0
+        self.processes = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            sizes = [size for size in map(_rss_bytes, _process_tree(self.pid)) if size is not None]
+            if sizes:
+                self.peak_process = max(self.peak_process, max(sizes))
+                self.peak_total = max(self.peak_total, sum(sizes))
+                self.processes = max(self.processes, len(sizes))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+# ============================================================================
+# CLIENTS
+# ============================================================================
+# Bytes read from the statement file per socket write
+SEND_BLOCK = 1024 * 1024
+
+
+class Upload:
+    """A statement file sent as a multipart /process upload, streamed from disk."""
+
+    def __init__(self, path, rows):
+        self.path = path
+        self.rows = rows
+        self.size = os.path.getsize(path)
+
+    def send(self, base_url, filename, timeout):
+        """POST the statement under filename; returns (status, response bytes)."""
+        boundary = uuid.uuid4().hex
+        head = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                f'Content-Type: text/csv\r\n\r\n').encode()
+        tail = f'\r\n--{boundary}--\r\n'.encode()
+
+        target = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if target.scheme == 'https' else http.client.HTTPConnection
+        connection = connection_class(target.netloc, timeout=timeout, blocksize=SEND_BLOCK)
+        try:
+            connection.putrequest('POST', target.path.rstrip('/') + '/process')
+            connection.putheader('Content-Type', f'multipart/form-data; boundary={boundary}')
+            connection.putheader('Content-Length', str(len(head) + self.size + len(tail)))
+            connection.endheaders()
+            connection.send(head)
+            with open(self.path, 'rb') as f:
+                connection.send(f)
+            connection.send(tail)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+
+def run_load(base_url, uploads, weights, concurrency=4, duration=None, requests=None, seed=0,
+             allow_cache=False, timeout=600):
+    """Send uploads from concurrent clients until duration seconds pass or requests are sent.
+
+    Returns [(rows, status, seconds, bytes sent)], one per request; status is
+    None for requests that failed without a response.
+    """
+    results = []
+    lock = threading.Lock()
+    counter = iter(range(requests)) if requests is not None else None
+    deadline = time.monotonic() + duration if duration is not None else None
+    run_id = uuid.uuid4().hex[:8]
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        sent = 0
+        while deadline is None or time.monotonic() < deadline:
+            if counter is not None:
+                with lock:
+                    if next(counter, None) is None:
+                        return
+            upload = rng.choices(uploads, weights)[0]
+            sent += 1
+            name = (f'listing-{upload.rows}.csv' if allow_cache
+                    else f'listing-{upload.rows}-{run_id}-{index}-{sent}.csv')
+            start = time.perf_counter()
+            try:
+                status, body = upload.send(base_url, name, timeout)
+            except (OSError, http.client.HTTPException):
+                status = None
+            elapsed = time.perf_counter() - start
+            with lock:
+                results.append((upload.rows, status, elapsed, upload.size))
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+# ============================================================================
+# REPORT
+# ============================================================================
+def summarize(results, elapsed, memory=None):
+    """Throughput, latency percentiles and errors, overall and per statement size."""
+    def stats(rows):
+        latencies = sorted(r[2] for r in rows)
+        errors = [r for r in rows if r[1] != 200]
+        statuses = {}
+        for r in errors:
+            statuses[str(r[1])] = statuses.get(str(r[1]), 0) + 1
+        return {
+            'requests': len(rows),
+            'errors': len(errors),
+            'error_rate': len(errors) / len(rows) if rows else 0.0,
+            'error_statuses': statuses,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': latencies[-1] * 1000 if latencies else float('nan'),
+        }
+
+    summary = stats(results)
+    summary.update({
+        'seconds': elapsed,
+        'requests_per_second': len(results) / elapsed if elapsed else 0.0,
+        'upload_mb_per_second': sum(r[3] for r in results) / elapsed / 1e6 if elapsed else 0.0,
+        'by_rows': {benchmark.rows_label(rows): stats([r for r in results if r[0] == rows])
+                    for rows in sorted({r[0] for r in results})},
+    })
+    if memory is not None:
+        summary.update({'server_processes': memory.processes,
+                        'peak_process_rss_mb': memory.peak_process / 1e6,
+                        'peak_total_rss_mb': memory.peak_total / 1e6})
+    return summary
+
+
+def print_summary(summary):
+    print(f"\n{summary['requests']} requests in {summary['seconds']:.1f}s: "
+          f"{summary['requests_per_second']:.2f} req/s, {summary['upload_mb_per_second']:.1f} MB/s uploaded")
+    print(f"{'rows':>8} {'requests':>9} {'errors':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for label, stats in [*summary['by_rows'].items(), ('all', summary)]:
+        print(f"{label:>8} {stats['requests']:>9} {stats['errors']:>7} {stats['p50_ms']:>10.1f} "
+              f"{stats['p95_ms']:>10.1f} {stats['p99_ms']:>10.1f} {stats['max_ms']:>10.1f}")
+    if summary['error_statuses']:
+        print('Errors by status:', ', '.join(f'{s}: {n}' for s, n in summary['error_statuses'].items()))
+    if 'peak_total_rss_mb' in summary:
+        print(f"Server memory: {summary['server_processes']} processes, peak {summary['peak_total_rss_mb']:.0f} MB "
+              f"in total, {summary['peak_process_rss_mb']:.0f} MB in the largest")
+
+
+# ============================================================================
+# COMMAND LINE
+# ============================================================================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the royalty valuation web app")
+    target = parser.add_argument_group('server')
+    target.add_argument('--url', help='test a running server instead of starting one')
+    target.add_argument('--server', default='gunicorn', choices=SERVERS, help='server to start (default: gunicorn)')
+    target.add_argument('--workers', type=int, default=2, help='gunicorn worker processes (default: 2)')
+    target.add_argument('--threads', type=int, default=1, help='threads per gunicorn worker (default: 1)')
+    target.add_argument('--server-log', help='append the server output to this file')
+    load = parser.add_argument_group('load')
+    load.add_argument('--mix', default=DEFAULT_MIX,
+                      help=f'statement sizes and weights as rows:weight,... (default: {DEFAULT_MIX})')
+    load.add_argument('--naming', default='royalty_exchange', choices=benchmark.NAMINGS,
+                      help='column naming of the statements (default: royalty_exchange)')
+    load.add_argument('--concurrency', type=int, default=4, help='concurrent clients (default: 4)')
+    load.add_argument('--duration', type=float, default=None, help='seconds to run (default: 30 without --requests)')
+    load.add_argument('--requests', type=int, default=None, help='total requests to send')
+    load.add_argument('--warmup', type=int, default=1, help='untimed uploads of each size first (default: 1)')
+    load.add_argument('--seed', type=int, default=0, help='seed for the upload order and statements')
+    load.add_argument('--allow-cache', action='store_true', help='reuse filenames so repeats hit the result cache')
+    load.add_argument('--timeout', type=float, default=600, help='per-request timeout in seconds (default: 600)')
+    load.add_argument('--data-dir', default=None, help="where statements are cached (default: benchmark.py's)")
+    check = parser.add_argument_group('results')
+    check.add_argument('--json', metavar='PATH', help='also write the summary as JSON')
+    check.add_argument('--max-error-rate', type=float, default=None, help='fail above this error fraction')
+    check.add_argument('--max-p95-ms', type=float, default=None, help='fail above this overall p95 latency')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.duration is None and args.requests is None:
+        args.duration = 30.0
+    mix = parse_mix(args.mix)
+    data_dir = args.data_dir or os.path.join(tempfile.gettempdir(), 'royalty-benchmark-data')
+    uploads = [Upload(benchmark.cached_statement(data_dir, rows, args.naming, seed=args.seed), rows)
+               for rows, _ in mix]
+    weights = [weight for _, weight in mix]
+
+    process = None
+    scratch = tempfile.mkdtemp(prefix='royalty-load-')
+    try:
+        if args.url:
+            url = args.url
+        else:
+            # Keep the test's valuations, jobs and caches out of the real ones
+            env = {'VALUATION_INDEX_DB': os.path.join(scratch, 'valuations.sqlite3'),
+                   'JOB_DIR': os.path.join(scratch, 'jobs'), 'RESULT_CACHE_DIR': ''}
+            process, url = start_server(args.server, args.workers, args.threads, env=env,
+                                        log_path=args.server_log)
+            print(f'Started {args.server} at {url}'
+                  + (f' with {args.workers} workers x {args.threads} threads' if args.server == 'gunicorn' else ''))
+
+        for upload in uploads:
+            for _ in range(args.warmup):
+                upload.send(url, f'warmup-{uuid.uuid4().hex}.csv', args.timeout)
+
+        memory = MemorySampler(process.pid) if process is not None and os.path.isdir('/proc') else None
+        if memory is not None:
+            memory.start()
+        start = time.perf_counter()
+        results = run_load(url, uploads, weights, args.concurrency, args.duration, args.requests, args.seed,
+                           args.allow_cache, args.timeout)
+        elapsed = time.perf_counter() - start
+        if memory is not None:
+            memory.stop()
+    finally:
+        if process is not None:
+            stop_server(process)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    summary = summarize(results, elapsed, memory)
+    summary['settings'] = {key: value for key, value in vars(args).items() if key not in ('json',)}
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    failed = False
+    if args.max_error_rate is not None and summary['error_rate'] > args.max_error_rate:
+        print(f"FAIL: error rate {summary['error_rate']:.2%} is above {args.max_error_rate:.2%}")
+        failed = True
+    if args.max_p95_ms is not None and summary['p95_ms'] > args.max_p95_ms:
+        print(f"FAIL: p95 latency {summary['p95_ms']:.0f} ms is above {args.max_p95_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
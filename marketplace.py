@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Marketplace exports: one statement covering many listings, told apart by a
+listing key column (see statement_reader.LISTING_COLUMNS).
+
+Rather than splitting the file and running the one-listing pipeline per
+listing, the statement is read once and summed by (listing, year) in one
+grouped pass, every listing's inputs are picked with array operations, and
+the model is evaluated for all listings at once by valuation_engine's
+vectorized functions. The result is a table with a row per listing; the
+per-listing workbooks (or one portfolio workbook) are optional extras.
+"""
+
+import os
+import re
+import numpy as np
+import pandas as pd
+import stage_timing
+import statement_reader
+import valuation_engine as engine
+import valuation_workbook
+
+INPUT_COLUMNS = ['year_minus_3', 'year_minus_2', 'year_minus_1', 'ytd', 'base_year']
+# Columns of the results table after the listing key, name and inputs
+VALUE_COLUMNS = ['total', 'bear_value', 'base_value', 'bull_value', 'weighted_value', 'ev_multiple',
+                 'enterprise_value']
+
+
+def listing_label(key):
+    """Royalty name for a listing key: "Listing 123" for numeric keys, like listing_name() for files."""
+    key = str(key).strip()
+    match = re.fullmatch(r'(?:listing[-_ ]?)?(\d+)', key, re.IGNORECASE)
+    return f"Listing {match.group(1)}" if match else key
+
+
+def value_inputs(inputs, yearly=None):
+    """Results table for a listing_inputs() DataFrame: the inputs plus every listing's values.
+
+    The scenarios and DCF projection of all listings are evaluated as arrays
+    in one call each. yearly (the listing_totals() table) adds each
+    listing's total royalties.
+    """
+    with stage_timing.stage('valuation'):
+        base_cf = inputs['base_year'].to_numpy(dtype='float64')
+        scenarios = engine.value_scenarios(base_cf)
+        projection = engine.dcf_projection(base_cf)
+
+        results = pd.DataFrame(index=inputs.index)
+        results.index.name = 'listing_id'
+        results['listing'] = [listing_label(key) for key in inputs.index]
+        for column in INPUT_COLUMNS:
+            results[column] = inputs[column].astype('float64')
+        results['total'] = (yearly.sum(axis=1).reindex(inputs.index).to_numpy()
+                            if yearly is not None else np.nan)
+        implied = scenarios['implied_value'].reshape(-1, 3)
+        results['bear_value'] = implied[:, 0]
+        results['base_value'] = implied[:, 1]
+        results['bull_value'] = implied[:, 2]
+        results['weighted_value'] = scenarios['weighted_value']
+        # A zero base year has no multiple; NaN rather than inf, like the index stores it
+        results['ev_multiple'] = np.where(np.isfinite(scenarios['ev_multiple']), scenarios['ev_multiple'], np.nan)
+        results['enterprise_value'] = projection['enterprise_value']
+    return results[['listing'] + INPUT_COLUMNS + VALUE_COLUMNS]
+
+
+def value_statement(source, filename=None, base_year_method='last_year', csv_engine='c', current_year=None):
+    """Read a marketplace export and value every listing in it.
+
+    Returns (results, yearly): the value_inputs() table and the
+    listing x year totals it was computed from.
+    """
+    yearly, monthly = statement_reader.listing_totals(source, filename, csv_engine=csv_engine)
+    if yearly.empty:
+        raise ValueError("The statement has no rows with a listing, amount and year")
+    with stage_timing.stage('inputs'):
+        inputs = statement_reader.listing_inputs(yearly, current_year, base_year_method, monthly)
+    return value_inputs(inputs, yearly), yearly
+
+
+def write_results_csv(results, output):
+    """Write the results table to a CSV path or text file object."""
+    results.to_csv(output, float_format='%.2f')
+    return output
+
+
+def listings_for_workbooks(results):
+    """(royalty name, inputs) for every listing, as valuation_workbook.iter_portfolio_workbook() takes them."""
+    for row in results[['listing'] + INPUT_COLUMNS].itertuples(index=False):
+        yield row[0], dict(zip(INPUT_COLUMNS, row[1:]))
+
+
+def write_workbooks(results, output_dir, sensitivity=None):
+    """Write a valuation workbook per listing into output_dir with the compiled template.
+
+    Returns the paths written, in the order of the results table.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths, used = [], set()
+    for royalty_name, inputs in listings_for_workbooks(results):
+        # Listing keys can collide once made into file names
+        stem = re.sub(r'[\\/:*?"<>|]', '_', royalty_name) or "Listing"
+        name, n = stem, 2
+        while name.lower() in used:
+            name, n = f"{stem} ({n})", n + 1
+        used.add(name.lower())
+        path = os.path.join(output_dir, f"{name} Valuation.xlsx")
+        valuation_workbook.write_valuation_workbook(path, royalty_name, **inputs, backend='template',
+                                                    sensitivity=sensitivity)
+        paths.append(path)
+    return paths
+
+
+def index_entries(results, yearly):
+    """(listing, inputs, yearly totals) per listing, for ValuationIndex.record_many()."""
+    yearly = yearly.reindex(results.index)
+    for (key, row), (_, years) in zip(results.iterrows(), yearly.iterrows()):
+        yield row['listing'], row[INPUT_COLUMNS], years.dropna()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for generated valuations.
+Results are keyed by a hash of the uploaded bytes plus the parameters that
+shape the output, kept in an in-memory LRU and optionally on disk, and
+identical requests that arrive while one is already computing share its result.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+
+HASH_CHUNK = 1024 * 1024
+
+log = logging.getLogger(__name__)
+
+
+def cache_key(stream, **params):
+    """SHA-256 of a file-like object's contents plus the given parameters.
+
+    The stream is read in chunks and rewound afterwards so it can still be processed.
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _size_of(value):
+    """Approximate memory held by a cached value (bytes payloads dominate)."""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_size_of(v) for v in value)
+    if isinstance(value, str):
+        return len(value)
+    return 64
+
+
+class _InFlight:
+    """A computation other requests for the same key can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    """Two-tier (memory LRU + optional disk) cache with request coalescing.
+
+    get_or_compute() returns (value, source) where source is 'memory', 'disk',
+    'coalesced' (waited on an identical in-flight request) or 'miss'.
+    """
+
+    def __init__(self, max_items=256, max_bytes=256 * 1024 * 1024,
+                 disk_dir=None, disk_max_bytes=1024 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._inflight = {}
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'coalesced': 0, 'misses': 0,
+                       'errors': 0, 'memory_evictions': 0, 'disk_evictions': 0, 'disk_errors': 0}
+
+        self._disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, computing it at most once at a time."""
+        while True:
+            state, value, waiter = self._claim(key)
+            if state != 'wait':
+                break
+            value, source = self._wait(waiter)
+            if value is not None:
+                return value, source
+        if state == 'memory':
+            return value, 'memory'
+
+        try:
+            value = self._disk_get(key)
+            if value is not None:
+                source = 'disk'
+            else:
+                value = compute()
+                source = 'miss'
+                self._disk_put(key, value)
+        except Exception as e:
+            self._release(key, waiter, error=e)
+            raise
+        self._release(key, waiter, value, source)
+        return value, source
+
+    def get_or_stream(self, key, produce):
+        """get_or_compute for a (bytes, meta) value produced as a stream of byte chunks.
+
+        produce() returns (chunks, meta). Returns (chunks, meta, source): on a
+        miss the chunks are passed through as they are produced, and the joined
+        bytes are cached (and handed to identical requests waiting on this one)
+        once the stream is finished. Cached values come back as a single chunk.
+        """
+        while True:
+            state, value, waiter = self._claim(key)
+            if state != 'wait':
+                break
+            value, source = self._wait(waiter)
+            if value is not None:
+                return [value[0]], value[1], source
+        if state == 'memory':
+            return [value[0]], value[1], 'memory'
+
+        try:
+            value = self._disk_get(key)
+            if value is None:
+                chunks, meta = produce()
+        except Exception as e:
+            self._release(key, waiter, error=e)
+            raise
+        if value is not None:
+            self._release(key, waiter, value, 'disk')
+            return [value[0]], value[1], 'disk'
+        return self._tee(key, waiter, chunks, meta), meta, 'miss'
+
+    def _tee(self, key, waiter, chunks, meta):
+        """Pass chunks through, caching the joined bytes if the stream runs to the end."""
+        parts = []
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            # The client went away; waiters compute it themselves
+            self._release(key, waiter)
+            raise
+        except Exception as e:
+            self._release(key, waiter, error=e)
+            raise
+        value = (b''.join(parts), meta)
+        try:
+            self._disk_put(key, value)
+        finally:
+            # Never leave the key in flight, or identical requests would wait on it forever
+            self._release(key, waiter, value, 'miss')
+
+    def _claim(self, key):
+        """('memory', value, None) on a hit, ('wait', None, waiter) if another request
+        is computing key, or ('lead', None, waiter) if this one should."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return 'memory', self._memory[key][0], None
+            waiter = self._inflight.get(key)
+            if waiter is not None:
+                return 'wait', None, waiter
+            waiter = self._inflight[key] = _InFlight()
+            return 'lead', None, waiter
+
+    def _wait(self, waiter):
+        """(value, 'coalesced') once the leading request finishes, or (None, None) if it gave up."""
+        waiter.done.wait()
+        if waiter.error is not None:
+            raise waiter.error
+        if waiter.value is None:
+            return None, None
+        with self._lock:
+            self._stats['coalesced'] += 1
+        return waiter.value, 'coalesced'
+
+    def _release(self, key, waiter, value=None, source=None, error=None):
+        """Finish a leading request: store its value (or error) and wake the waiters."""
+        waiter.value, waiter.error = value, error
+        with self._lock:
+            if error is not None:
+                self._stats['errors'] += 1
+            elif value is not None:
+                self._stats['disk_hits' if source == 'disk' else 'misses'] += 1
+                self._memory_put(key, value)
+            del self._inflight[key]
+        waiter.done.set()
+
+    def stats(self):
+        """Hit/miss counters plus current tier sizes."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(
+                memory_items=len(self._memory),
+                memory_bytes=self._memory_bytes,
+                disk_bytes=self._disk_bytes if self.disk_dir else None,
+                in_flight=len(self._inflight),
+            )
+        return stats
+
+    def clear(self):
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        for path, _, _ in self._disk_entries():
+            self._remove(path)
+        with self._lock:
+            self._disk_bytes = 0
+
+    # ------------------------------------------------------------------
+    # Memory tier
+    # ------------------------------------------------------------------
+    def _memory_put(self, key, value):
+        """Insert and evict least recently used entries. Caller holds the lock."""
+        size = _size_of(value)
+        if size > self.max_bytes:
+            return
+        self._memory[key] = (value, size)
+        self._memory_bytes += size
+        while len(self._memory) > self.max_items or self._memory_bytes > self.max_bytes:
+            _, (_, old_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= old_size
+            self._stats['memory_evictions'] += 1
+
+    # ------------------------------------------------------------------
+    # Disk tier
+    # ------------------------------------------------------------------
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pickle")
+
+    def _disk_entries(self):
+        """(path, mtime, size) for every cache file, oldest first."""
+        if not self.disk_dir:
+            return []
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith('.pickle'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, st.st_mtime, st.st_size))
+        return sorted(entries, key=lambda e: e[1])
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        # Touch so size-based eviction removes the least recently used files first
+        os.utime(path)
+        return value
+
+    def _disk_put(self, key, value):
+        """Store value on disk. Best effort: failures are logged, never raised."""
+        if not self.disk_dir:
+            return
+        tmp_path = None
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            if len(data) > self.disk_max_bytes:
+                return
+
+            # Write to a temp file then rename so readers never see partial entries
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+
+            path = self._disk_path(key)
+            # Replace and count under the lock, so an overwritten entry's size is taken back exactly once
+            with self._lock:
+                try:
+                    replaced = os.path.getsize(path)
+                except OSError:
+                    replaced = 0
+                os.replace(tmp_path, path)
+                tmp_path = None
+                self._disk_bytes += len(data) - replaced
+                over = self._disk_bytes > self.disk_max_bytes
+            if over:
+                self._evict_disk()
+        except Exception:
+            # The disk tier is only an optimization; the request still has its value
+            log.exception("Could not write cache entry %s to disk", key)
+            if tmp_path is not None:
+                self._remove(tmp_path)
+            with self._lock:
+                self._stats['disk_errors'] += 1
+
+    def _evict_disk(self):
+        """Delete the oldest files until the disk tier is back under its size limit."""
+        entries = self._disk_entries()
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.disk_max_bytes:
+                break
+            if self._remove(path):
+                total -= size
+                with self._lock:
+                    self._stats['disk_evictions'] += 1
+        with self._lock:
+            self._disk_bytes = total
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Evaluates the valuation sheet's formulas so workbooks can be written with
+cached values, letting readers that don't recalculate (pandas, openpyxl with
+data_only=True, previewers) see the numbers straight away.
+
+Only the subset of Excel the sheet uses is supported: numbers, text in
+double quotes, cell references and ranges, + - * / ^, unary minus,
+comparisons (= <> < > <= >=), parentheses and the SUM/AVERAGE/MIN/MAX/IF
+functions. Each formula is compiled to Python once and reused for every listing.
+"""
+
+from functools import lru_cache
+import numbers
+import re
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<range>\$?[A-Z]{1,3}\$?\d+:\$?[A-Z]{1,3}\$?\d+)
+      | (?P<func>[A-Z]+)\(
+      | (?P<ref>\$?[A-Z]{1,3}\$?\d+)
+      | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)
+      | (?P<text>"(?:[^"]|"")*")
+      | (?P<op><=|>=|<>|[-+*/^(),=<>])
+    )""", re.VERBOSE)
+
+
+class CellError(str):
+    """An Excel error value such as '#DIV/0!', written to the sheet as an error cell.
+
+    Any arithmetic on an error raises it again, so it propagates to every
+    formula that depends on it, as in Excel.
+    """
+
+    def _propagate(self, *args):
+        raise _Error(self)
+
+    __add__ = __radd__ = __sub__ = __rsub__ = _propagate
+    __mul__ = __rmul__ = __truediv__ = __rtruediv__ = _propagate
+    __pow__ = __rpow__ = __neg__ = __pos__ = _propagate
+
+
+class _Error(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def _range(*values):
+    """Numeric cells of a range; text, blanks and booleans are skipped, errors propagate."""
+    found = []
+    for value in values:
+        if isinstance(value, CellError):
+            raise _Error(value)
+        if isinstance(value, numbers.Real) and not isinstance(value, bool):
+            found.append(value)
+    return found
+
+
+def _numbers(args):
+    """Flatten function arguments into one list of numbers."""
+    for arg in args:
+        if isinstance(arg, list):
+            yield from arg
+        else:
+            yield arg
+
+
+def _sum(*args):
+    return sum(_numbers(args))
+
+
+def _average(*args):
+    values = list(_numbers(args))
+    if not values:
+        raise _Error('#DIV/0!')
+    return sum(values) / len(values)
+
+
+def _min(*args):
+    return min(_numbers(args), default=0)
+
+
+def _max(*args):
+    return max(_numbers(args), default=0)
+
+
+FUNCTIONS = {'SUM': _sum, 'AVERAGE': _average, 'MIN': _min, 'MAX': _max}
+
+_COMPARISONS = {
+    '=': lambda a, b: a == b, '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b, '>': lambda a, b: a > b,
+    '<=': lambda a, b: a <= b, '>=': lambda a, b: a >= b,
+}
+
+
+def _compare(op, a, b):
+    """Excel comparison: errors propagate, text sorts after every number and ignores case."""
+    for value in (a, b):
+        if isinstance(value, CellError):
+            raise _Error(value)
+    a, b = ((isinstance(v, str), v.lower() if isinstance(v, str) else v) for v in (a, b))
+    return _COMPARISONS[op](a, b)
+
+
+def _truth(value):
+    """An IF condition as a bool: numbers are true unless 0, text is #VALUE!."""
+    if isinstance(value, CellError):
+        raise _Error(value)
+    if isinstance(value, str):
+        raise _Error('#VALUE!')
+    return bool(value)
+
+
+def _pow(a, b):
+    if a == 0 and b < 0:
+        raise _Error('#DIV/0!')
+    result = a ** b
+    if isinstance(result, complex):
+        raise _Error('#NUM!')
+    return result
+
+
+def _operand(value):
+    """A cell as an arithmetic operand: blanks are 0 and text is #VALUE!.
+
+    Numbers become Python floats (Excel's only number type), so numpy inputs
+    raise on division by zero instead of quietly returning inf.
+    """
+    if value is None:
+        return 0.0
+    if isinstance(value, CellError):
+        return value
+    if isinstance(value, str):
+        return CellError('#VALUE!')
+    return float(value)
+
+
+def _split_ref(ref):
+    match = re.fullmatch(r'([A-Z]{1,3})(\d+)', ref)
+    column = 0
+    for char in match.group(1):
+        column = column * 26 + ord(char) - 64
+    return column, int(match.group(2))
+
+
+def _column_letter(column):
+    letters = ''
+    while column:
+        column, rem = divmod(column - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _expand_range(start, end):
+    (c1, r1), (c2, r2) = _split_ref(start), _split_ref(end)
+    return [f'{_column_letter(column)}{row}'
+            for column in range(min(c1, c2), max(c1, c2) + 1)
+            for row in range(min(r1, r2), max(r1, r2) + 1)]
+
+
+def _tokenize(text):
+    tokens, pos = [], 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError(f"Unsupported formula syntax at '{text[pos:]}' in ={text}")
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    return tokens
+
+
+class _Compiler:
+    """Recursive-descent translation of one formula to a Python expression.
+
+    Precedence follows Excel rather than Python: unary minus binds tighter than
+    ^, and ^ is left-associative. Cell references become local variables
+    (n_A1 as an operand, v_A1 as a raw range member), collected in self.refs.
+    self.text_result is set when the formula can evaluate to text or a boolean.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+        self.refs = set()
+        self.text_result = False
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        token = self.peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            raise ValueError(f"Malformed formula ={self.text}")
+        self.pos += 1
+        return token
+
+    def compile(self):
+        source = self.comparison()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Malformed formula ={self.text}")
+        return source
+
+    def comparison(self):
+        source = self.additive()
+        while self.peek()[1] in _COMPARISONS:
+            op = self.take()[1]
+            source = f"_compare({op!r},{source},{self.additive()})"
+            self.text_result = True
+        return source
+
+    def additive(self):
+        source = self.multiplicative()
+        while self.peek()[1] in ('+', '-'):
+            op = self.take()[1]
+            source = f"({source}{op}{self.multiplicative()})"
+        return source
+
+    def multiplicative(self):
+        source = self.power()
+        while self.peek()[1] in ('*', '/'):
+            op = self.take()[1]
+            source = f"({source}{op}{self.power()})"
+        return source
+
+    def power(self):
+        source = self.unary()
+        while self.peek()[1] == '^':
+            self.take()
+            exponent = self.unary()
+            # Whole-number literal exponents can't produce a complex result
+            if re.fullmatch(r'\d+\.0', exponent):
+                source = f"({source}**{exponent[:-2]})"
+            else:
+                source = f"_pow({source},{exponent})"
+        return source
+
+    def unary(self):
+        if self.peek()[1] in ('+', '-'):
+            op = self.take()[1]
+            return f"({op}{self.unary()})"
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return repr(float(value))
+        if kind == 'text':
+            self.text_result = True
+            return repr(value[1:-1].replace('""', '"'))
+        if kind == 'ref':
+            ref = value.replace('$', '')
+            self.refs.add(ref)
+            return f"n_{ref}"
+        if kind == 'range':
+            cells = _expand_range(*value.replace('$', '').split(':'))
+            self.refs.update(cells)
+            return f"_range({','.join(f'v_{ref}' for ref in cells)})"
+        if kind == 'func':
+            if value not in FUNCTIONS and value != 'IF':
+                raise ValueError(f"Unsupported function {value}() in ={self.text}")
+            args = []
+            if self.peek()[1] != ')':
+                args.append(self.comparison())
+                while self.peek()[1] == ',':
+                    self.take()
+                    args.append(self.comparison())
+            self.take(')')
+            if value == 'IF':
+                # Only the branch taken is evaluated, so the other can't raise an error
+                if len(args) not in (2, 3):
+                    raise ValueError(f"IF() takes 2 or 3 arguments in ={self.text}")
+                self.text_result = True
+                otherwise = args[2] if len(args) == 3 else 'False'
+                return f"({args[1]} if _truth({args[0]}) else {otherwise})"
+            return f"_f[{value!r}]({','.join(args)})"
+        if value == '(':
+            source = self.comparison()
+            self.take(')')
+            return source
+        raise ValueError(f"Malformed formula ={self.text}")
+
+
+@lru_cache(maxsize=32)
+def compile_sheet(formulas):
+    """Compile a sheet's formulas, given as ((ref, '=...'), ...), to one function.
+
+    The function takes {ref: value} for the constant cells and returns
+    {ref: float, text, bool or CellError} for every formula cell. Formulas are emitted as
+    straight-line code in dependency order, so evaluating a sheet is a single
+    call with no per-reference lookups. The function's reads attribute lists
+    the constant cells it looks up; no others need to be passed in.
+    """
+    formulas = dict(formulas)
+    compiled, text_results = {}, set()
+    for ref, formula in formulas.items():
+        compiler = _Compiler(formula[1:] if formula.startswith('=') else formula)
+        compiled[ref] = (compiler.compile(), compiler.refs)
+        if compiler.text_result:
+            text_results.add(ref)
+
+    order, state = [], {}
+
+    def visit(ref):
+        if state.get(ref) == 'done':
+            return
+        if state.get(ref) == 'visiting':
+            raise ValueError(f"Circular reference through {ref}")
+        state[ref] = 'visiting'
+        for dep in sorted(compiled[ref][1]):
+            if dep in compiled:
+                visit(dep)
+        state[ref] = 'done'
+        order.append(ref)
+
+    for ref in compiled:
+        visit(ref)
+
+    constants = sorted(set().union(*(refs for _, refs in compiled.values())) - compiled.keys())
+    lines = ['def _sheet(_values):']
+    for ref in constants:
+        lines.append(f"    v_{ref} = _values.get({ref!r})")
+        lines.append(f"    n_{ref} = _operand(v_{ref})")
+    for ref in order:
+        lines.append('    try:')
+        lines.append(f"        v_{ref} = {compiled[ref][0]}")
+        lines.append('    except _Error as e:')
+        lines.append(f"        v_{ref} = CellError(e.code)")
+        lines.append('    except ZeroDivisionError:')
+        lines.append(f"        v_{ref} = CellError('#DIV/0!')")
+        lines.append('    except OverflowError:')
+        lines.append(f"        v_{ref} = CellError('#NUM!')")
+        # Text and booleans are only operands once converted like constant cells
+        lines.append(f"    n_{ref} = _operand(v_{ref})" if ref in text_results else f"    n_{ref} = v_{ref}")
+    lines.append('    return {' + ', '.join(f"{ref!r}: v_{ref}" for ref in compiled) + '}')
+
+    namespace = {'_range': _range, '_f': FUNCTIONS, '_pow': _pow, '_compare': _compare, '_truth': _truth,
+                 '_operand': _operand, '_Error': _Error, 'CellError': CellError}
+    exec(compile('\n'.join(lines), '<sheet formulas>', 'exec'), namespace)
+    sheet = namespace['_sheet']
+    sheet.reads = tuple(constants)
+    return sheet
+
+
+def formula_cells(values):
+    """The ((ref, formula), ...) key for compile_sheet from a {ref: value} mapping."""
+    return tuple((ref, value) for ref, value in values.items()
+                 if isinstance(value, str) and value.startswith('='))
+
+
+def evaluate_formulas(values):
+    """Cached values for every formula cell in {ref: value}.
+
+    Returns {ref: float, text, bool or CellError}. Blank cells count as 0 and text in
+    arithmetic gives #VALUE!, as in Excel; errors propagate to dependent cells.
+    """
+    return compile_sheet(formula_cells(values))(values)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Per-stage timings for requests, and histograms to aggregate them.
+Code on the valuation path wraps its stages (parse, detect, aggregate, cells,
+zip, ...) in stage(); while a Timings is active for the current thread the
+durations are added to it, otherwise stage() does nothing but check for one,
+so the desktop tool and batch mode pay essentially nothing.
+
+The web app starts a Timings per request, reports it in a Server-Timing
+header and feeds it into Histograms exposed in Prometheus' text format.
+"""
+
+from contextlib import contextmanager
+import contextvars
+import math
+import threading
+import time
+
+_current = contextvars.ContextVar('stage_timings', default=None)
+
+# Histogram buckets in seconds, from a template render up to a huge statement
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Timings:
+    """Seconds spent in each stage of one request, in the order the stages first ran."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """The stages as a Server-Timing header value, plus the time so far as 'total'."""
+        entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.stages.items()]
+        entries.append(f'total;dur={self.elapsed() * 1000:.2f}')
+        return ', '.join(entries)
+
+
+def begin():
+    """Start collecting stage timings for the current thread; returns the new Timings."""
+    timings = Timings()
+    _current.set(timings)
+    return timings
+
+
+def end():
+    """Stop collecting; returns the Timings that was active, or None."""
+    timings = _current.get()
+    _current.set(None)
+    return timings
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    """Add the time spent in the with block to the active Timings, if any."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def timed(iterable, name):
+    """Iterate iterable, adding the time spent producing each item to stage name.
+
+    For generators whose work happens between yields (chunked readers, XML
+    writers), where a with block can't separate their time from the consumer's.
+    """
+    if _current.get() is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+# ============================================================================
+# PROMETHEUS METRICS
+# ============================================================================
+def _label_text(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Histogram:
+    """A Prometheus histogram with labels, kept in this process."""
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (not cumulative), then sum and count
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self):
+        """The histogram in Prometheus' text exposition format."""
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count)
+                            in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                labels = _label_text(self.labels + ('le',), key + (_number(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _label_text(self.labels + ('le',), key + ('+Inf',))
+            lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _label_text(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_number(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_values(name, help_text, kind, values, label=None):
+    """A counter or gauge family in Prometheus' text format.
+
+    values is {label value: number} (with label naming the label), or a single
+    number when label is None.
+    """
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    if label is None:
+        lines.append(f'{name} {_number(values)}')
+    else:
+        for key, value in values.items():
+            lines.append(f'{name}{_label_text((label,), (key,))} {_number(value)}')
+    return '\n'.join(lines) + '\n'
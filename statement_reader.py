@@ -0,0 +1,812 @@
+#!/usr/bin/env python3
+"""
+Royalty statement reading and aggregation, shared by the desktop tool and the web app.
+CSV statements are streamed in chunks, reading only the amount/year columns,
+so peak memory stays bounded no matter how large the file is. Statements given
+as paths are parsed through a memory map rather than buffered reads.
+
+When the period column is a 'date', its format is detected once from a sample
+and only the distinct date strings of each chunk are parsed with it, so daily
+statements group into years (or quarters/months) at the cost of a groupby.
+
+.xlsx statements are streamed by xlsx_reader, which sums the two columns
+straight from the sheet XML without building a DataFrame.
+
+Parquet and Arrow IPC (Feather) statements are read with pyarrow, projecting
+just the two columns needed; paths are memory-mapped and folded record batch
+by record batch, the same way CSV chunks are. pyarrow is optional: it is only
+imported for those formats and the 'pyarrow' CSV engine.
+"""
+
+from datetime import datetime
+import os
+import re
+import numpy as np
+import pandas as pd
+import stage_timing
+import xlsx_reader
+
+# Column names we recognise, in order of preference (matched case-insensitively)
+AMOUNT_COLUMNS = ['payable_amount', 'amount', 'earnings', 'royalty']
+YEAR_COLUMNS = ['distribution_year', 'year', 'date']
+# Columns that tell listings apart in a marketplace export covering many of them
+LISTING_COLUMNS = ['listing_id', 'listing', 'listing_key', 'royalty_id', 'asset_id', 'catalog_id']
+
+# Rows per chunk when streaming a CSV (two float columns -> ~16 MB per chunk)
+CHUNK_ROWS = 1_000_000
+
+# Statement formats by file extension; anything else is read as CSV
+STATEMENT_FORMATS = {
+    '.csv': 'csv', '.txt': 'csv', '.xlsx': 'xlsx',
+    '.parquet': 'parquet', '.pq': 'parquet', '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow',
+}
+STATEMENT_EXTENSIONS = tuple(STATEMENT_FORMATS)
+
+# CSV parsers: 'c' is pandas' chunked reader (one core, bounded memory); 'pyarrow'
+# parses blocks on every core but holds the two projected columns in memory at once
+CSV_ENGINES = ('c', 'pyarrow')
+
+# Date formats tried, in order, against a sample of a 'date' column. US month-first
+# comes before day-first; a sample with a day above 12 rules it out.
+DATE_FORMATS = [
+    '%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%d/%m/%Y', '%m-%d-%Y', '%d-%m-%Y', '%d.%m.%Y',
+    '%m/%d/%y', '%d/%m/%y', '%Y%m%d', 'ISO8601', '%m/%d/%Y %H:%M', '%m/%d/%Y %H:%M:%S',
+    '%d %b %Y', '%b %d, %Y', '%B %d, %Y', '%d %B %Y', '%Y-%m', '%b %Y', '%B %Y', '%Y',
+]
+DATE_SAMPLE = 1000
+
+# Periods statements can be totalled by
+PERIODS = ('year', 'quarter', 'month')
+
+# How the normalized base year royalties are chosen:
+#   last_year      - last full year's total, or YTD if there is none (the original rule)
+#   ttm            - trailing twelve months ending at the latest month with data
+#   annualized_ytd - latest year's total scaled up to twelve months
+#   seasonal       - latest year's total divided by the share of a year's royalties
+#                    prior years had earned by the same month
+BASE_YEAR_METHODS = ('last_year', 'ttm', 'annualized_ytd', 'seasonal')
+
+
+def detect_columns(columns):
+    """Return (amount_col, year_col) for a statement's header."""
+    columns = list(columns)
+    lowered = [c.lower() for c in columns]
+
+    # Find the amount column
+    amount_col = None
+    for col in AMOUNT_COLUMNS:
+        if col in lowered:
+            amount_col = columns[lowered.index(col)]
+            break
+
+    if amount_col is None:
+        # Try to find any column with 'amount' in the name
+        amount_cols = [c for c in columns if 'amount' in c.lower()]
+        if amount_cols:
+            amount_col = amount_cols[0]
+        else:
+            raise ValueError("Could not find an amount/earnings column in the CSV")
+
+    # Find the year column
+    year_col = None
+    for col in YEAR_COLUMNS:
+        if col in lowered:
+            year_col = columns[lowered.index(col)]
+            break
+
+    if year_col is None:
+        raise ValueError("Could not find a year column in the CSV")
+
+    return amount_col, year_col
+
+
+def detect_listing_column(columns):
+    """The listing key column of a multi-listing statement's header, or None if it has none."""
+    columns = list(columns)
+    lowered = [c.lower() for c in columns]
+    for col in LISTING_COLUMNS:
+        if col in lowered:
+            return columns[lowered.index(col)]
+    listing_cols = [c for c in columns if 'listing' in c.lower()]
+    return listing_cols[0] if listing_cols else None
+
+
+def _rewind(source):
+    """Seek file-like sources back to the start so they can be read again."""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+
+def read_csv_header(source):
+    """Read just the header row of a CSV path or file-like object."""
+    columns = pd.read_csv(source, nrows=0).columns.tolist()
+    _rewind(source)
+    return columns
+
+
+def _finish_yearly(yearly):
+    """Sort by year and use integer years where the column is numeric."""
+    yearly = yearly.sort_index()
+    if pd.api.types.is_float_dtype(yearly.index):
+        yearly.index = yearly.index.astype('int64')
+    return yearly
+
+
+def detect_date_format(values, column='date'):
+    """The first of DATE_FORMATS that parses every value in a sample of values.
+
+    If none parses them all (a statement mixing formats), the one parsing the
+    most; parse_dates() detects again for the values it leaves.
+    """
+    sample = pd.Series(pd.unique(pd.Series(values).dropna().astype(str).str.strip()))
+    sample = sample[sample != ''].head(DATE_SAMPLE)
+    if sample.empty:
+        return DATE_FORMATS[0]
+    parsed = {}
+    for fmt in DATE_FORMATS:
+        parsed[fmt] = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if parsed[fmt] == len(sample):
+            return fmt
+    best = max(DATE_FORMATS, key=lambda fmt: parsed[fmt])
+    if parsed[best]:
+        return best
+    raise ValueError(f"Could not recognise the date format in column '{column}' (e.g. '{sample.iloc[0]}')")
+
+
+def period_keys(dates, period='year'):
+    """Group keys for parsed dates: int years, or quarterly/monthly Periods."""
+    dates = pd.DatetimeIndex(dates)
+    if period == 'year':
+        return dates.year.astype('int64')
+    if period == 'quarter':
+        return dates.to_period('Q')
+    if period == 'month':
+        return dates.to_period('M')
+    raise ValueError(f"Unknown period '{period}' (choose from {', '.join(PERIODS)})")
+
+
+def parse_dates(values, date_format, column='date'):
+    """Parse date strings with date_format, detecting the format again for any that don't match it.
+
+    A format detected from a sample needn't hold for the whole column
+    (exports with rows appended in another format), and a date that doesn't
+    parse would silently drop its amount, so every non-empty value must parse
+    with one of DATE_FORMATS or ValueError is raised.
+
+    When the format detected for the leftovers reads every value, the first
+    one was a guess from dates both read (a day-first file whose sampled days
+    are all 12 or less) and the whole column is parsed with it instead. If
+    it reads only some, and any of those as a different date than before,
+    the column mixes formats that disagree and ValueError is raised too.
+    """
+    values = pd.Series(values, dtype=object).astype(str).str.strip()
+    dates = pd.to_datetime(values, format=date_format, errors='coerce')
+    present = ~values.isin(['', 'nan', 'NaT', 'None'])
+    failed = dates.isna() & present
+    while failed.any():
+        retry_format = detect_date_format(values[failed], column)
+        retried = pd.to_datetime(values, format=retry_format, errors='coerce')
+        if retried[present].notna().all():
+            dates = retried
+            break
+        clash = present & ~failed & retried.notna() & (retried != dates)
+        if clash.any():
+            raise ValueError(f"The dates in column '{column}' mix formats that read "
+                             f"'{values[clash].iloc[0]}' differently ({date_format} and {retry_format})")
+        dates[failed] = retried[failed]
+        still_failed = failed & dates.isna()
+        if still_failed.sum() == failed.sum():
+            raise ValueError(f"Could not parse the date '{values[still_failed].iloc[0]}' in column '{column}'")
+        failed = still_failed
+    return pd.DatetimeIndex(dates)
+
+
+def _sum_by_date(sums, period, column='date'):
+    """Regroup sums keyed by raw date strings into period totals.
+
+    Only the distinct strings are parsed, all at once, with the format
+    detected from them (see parse_dates).
+    """
+    date_format = detect_date_format(sums.index, column)
+    return sums.groupby(period_keys(parse_dates(sums.index, date_format, column), period)).sum()
+
+
+def _fold_chunks(chunks, amount_col, year_col, period):
+    """Fold DataFrame chunks into per-period sums, one chunk at a time.
+
+    The period column may hold numeric years, date strings or already-parsed
+    datetimes. Date strings are summed per distinct string and only parsed
+    once the last chunk is in, so the format is detected from the whole
+    column rather than from the first chunk's dates.
+    """
+    partials, by_date = [], []
+    # Reading the next chunk counts as parsing, folding it as aggregation
+    for chunk in stage_timing.timed(chunks, 'parse'):
+        with stage_timing.stage('aggregate'):
+            column = chunk[year_col]
+            if pd.api.types.is_datetime64_any_dtype(column):
+                chunk = chunk[column.notna()]
+                partials.append(chunk[amount_col].groupby(period_keys(chunk[year_col], period)).sum())
+            elif year_col.lower() == 'date':
+                by_date.append(chunk.groupby(year_col)[amount_col].sum())
+            else:
+                partials.append(chunk.groupby(year_col)[amount_col].sum())
+    with stage_timing.stage('aggregate'):
+        if by_date:
+            sums = pd.concat(by_date).groupby(level=0).sum()
+            if len(sums):
+                partials.append(_sum_by_date(sums, period, year_col))
+        if not partials:
+            return pd.Series(dtype='float64', name=amount_col)
+        return _finish_yearly(pd.concat(partials).groupby(level=0).sum())
+
+
+def _pyarrow():
+    """pyarrow with its csv and parquet modules, imported on first use."""
+    try:
+        import pyarrow
+        import pyarrow.csv
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Parquet/Arrow statements and the 'pyarrow' CSV engine need pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def _arrow_source(source):
+    """What pyarrow readers accept: a path, or the raw stream of an upload."""
+    return getattr(source, 'stream', source)
+
+
+def _arrow_sums(table, amount_col, year_col):
+    """Sum an Arrow table by its period column in Arrow, as a small DataFrame for _fold_chunks.
+
+    Grouping before converting means only the distinct years/dates, not every
+    row's date string, become Python objects.
+    """
+    sums = table.group_by(year_col).aggregate([(amount_col, 'sum')])
+    return sums.to_pandas(date_as_object=False).rename(columns={f'{amount_col}_sum': amount_col})
+
+
+def _is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def _pyarrow_csv_chunks(source, amount_col, year_col, is_date):
+    """The projected columns of a CSV parsed by pyarrow's multithreaded reader, pre-summed in Arrow."""
+    pa = _pyarrow()
+    mapped = pa.memory_map(os.fspath(source)) if _is_path(source) else None
+    try:
+        table = _pyarrow_read_csv(mapped or _arrow_source(source), amount_col, year_col, is_date)
+    finally:
+        if mapped is not None:
+            mapped.close()
+    yield _arrow_sums(table, amount_col, year_col)
+
+
+def _pyarrow_read_csv(source, amount_col, year_col, is_date):
+    pa = _pyarrow()
+    return pa.csv.read_csv(
+        source,
+        read_options=pa.csv.ReadOptions(use_threads=True),
+        convert_options=pa.csv.ConvertOptions(
+            include_columns=[amount_col, year_col],
+            column_types={amount_col: pa.float64(), year_col: pa.string() if is_date else pa.float64()},
+        ),
+    )
+
+
+def aggregate_csv(source, chunksize=CHUNK_ROWS, period='year', csv_engine='c'):
+    """Sum amounts by year (or quarter/month for date columns), streaming the CSV chunk by chunk.
+
+    Only the detected amount and year columns are parsed, with explicit dtypes,
+    and each chunk is folded into per-period partial sums before the next is read.
+    csv_engine is one of CSV_ENGINES.
+    """
+    if csv_engine not in CSV_ENGINES:
+        raise ValueError(f"Unknown CSV engine '{csv_engine}' (choose from {', '.join(CSV_ENGINES)})")
+    with stage_timing.stage('detect'):
+        amount_col, year_col = detect_columns(read_csv_header(source))
+    # A 'date' column holds strings; any other year column is numeric
+    is_date = year_col.lower() == 'date'
+    if period != 'year' and not is_date:
+        raise ValueError(f"Totals by {period} need a date column, not '{year_col}'")
+
+    if csv_engine == 'pyarrow':
+        chunks = _pyarrow_csv_chunks(source, amount_col, year_col, is_date)
+    else:
+        chunks = pd.read_csv(
+            source,
+            usecols=[amount_col, year_col],
+            dtype={amount_col: 'float64', year_col: 'str' if is_date else 'float64'},
+            chunksize=chunksize,
+            memory_map=_is_path(source),
+        )
+    return _fold_chunks(chunks, amount_col, year_col, period)
+
+
+def aggregate_dataframe(df, period='year'):
+    """Sum amounts by year (or quarter/month) for a statement that is already a DataFrame."""
+    amount_col, year_col = detect_columns(df.columns)
+    column = df[year_col]
+    if pd.api.types.is_datetime64_any_dtype(column):
+        # Spreadsheet readers usually hand dates over already parsed
+        return df[amount_col].groupby(period_keys(column, period)).sum().sort_index()
+    if year_col.lower() == 'date':
+        sums = df.groupby(column.astype(str))[amount_col].sum()
+        return _finish_yearly(_sum_by_date(sums, period, year_col))
+    if period != 'year':
+        raise ValueError(f"Totals by {period} need a date column, not '{year_col}'")
+    return df.groupby(year_col)[amount_col].sum().sort_index()
+
+
+def statement_totals(source, chunksize=CHUNK_ROWS, csv_engine='c'):
+    """(yearly, monthly) totals for a CSV statement in one pass; monthly is None without a date column."""
+    with stage_timing.stage('detect'):
+        amount_col, year_col = detect_columns(read_csv_header(source))
+    if year_col.lower() != 'date':
+        return aggregate_csv(source, chunksize, csv_engine=csv_engine), None
+    monthly = aggregate_csv(source, chunksize, period='month', csv_engine=csv_engine)
+    return yearly_from_monthly(monthly), monthly
+
+
+def _open_columnar(source, fmt):
+    """Open a Parquet or Arrow IPC statement.
+
+    Returns (schema, batches, close), where batches(columns) iterates record
+    batches holding just those columns. Paths are memory-mapped, so only the
+    pages of the projected columns are ever read.
+    """
+    pa = _pyarrow()
+    if _is_path(source):
+        source = pa.memory_map(os.fspath(source))
+        close = source.close
+    else:
+        source = _arrow_source(source)
+        close = lambda: None
+
+    if fmt == 'parquet':
+        parquet = pa.parquet.ParquetFile(source)
+        return (parquet.schema_arrow,
+                lambda columns: parquet.iter_batches(batch_size=CHUNK_ROWS, columns=columns),
+                close)
+
+    try:
+        reader = pa.ipc.open_file(source)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        # Not the random-access file format; try the streaming one
+        source.seek(0)
+        reader = pa.ipc.open_stream(source)
+        batches = iter(reader)
+    return reader.schema, lambda columns: (batch.select(columns) for batch in batches), close
+
+
+def _tables(batches, rows=CHUNK_ROWS):
+    """Group record batches into tables of about rows rows (IPC files often hold many small batches)."""
+    pa = _pyarrow()
+    pending, count = [], 0
+    for batch in batches:
+        pending.append(batch)
+        count += batch.num_rows
+        if count >= rows:
+            yield pa.Table.from_batches(pending)
+            pending, count = [], 0
+    if pending:
+        yield pa.Table.from_batches(pending)
+
+
+def columnar_totals(source, fmt='parquet'):
+    """(yearly, monthly) totals for a Parquet or Arrow IPC statement; monthly is None without dates."""
+    pa = _pyarrow()
+    schema, batches, close = _open_columnar(source, fmt)
+    try:
+        amount_col, year_col = detect_columns(schema.names)
+        field_type = schema.field(year_col).type
+        dated = (year_col.lower() == 'date' or pa.types.is_timestamp(field_type)
+                 or pa.types.is_date(field_type))
+        chunks = (_arrow_sums(table, amount_col, year_col)
+                  for table in _tables(batches([amount_col, year_col])))
+        if not dated:
+            return _fold_chunks(chunks, amount_col, year_col, 'year'), None
+        monthly = _fold_chunks(chunks, amount_col, year_col, 'month')
+        return yearly_from_monthly(monthly), monthly
+    finally:
+        close()
+
+
+def xlsx_totals(source, sheet=None):
+    """(yearly, monthly) totals for an .xlsx statement; monthly is None without a date column.
+
+    sheet is a sheet name or 0-based index; by default the first sheet with
+    amount and year columns is used. Sheets the streaming reader can't handle
+    are read with pd.read_excel instead.
+    """
+    try:
+        # The streaming reader parses and sums in one scan
+        with stage_timing.stage('parse'):
+            amount_col, year_col, sums, date1904 = xlsx_reader.sum_by_column(source, detect_columns, sheet)
+    except xlsx_reader.Unsupported:
+        _rewind(getattr(source, 'stream', source))
+        with stage_timing.stage('parse'):
+            df = pd.read_excel(source, sheet_name=0 if sheet is None else sheet)
+        with stage_timing.stage('aggregate'):
+            return dataframe_totals(df)
+
+    numbers = {k: v for k, v in sums.items() if isinstance(k, float)}
+    texts = {k: v for k, v in sums.items() if isinstance(k, str)}
+    if year_col.lower() != 'date':
+        # Years typed in as text count the same as numeric ones
+        years = list(numbers) + list(pd.to_numeric(pd.Series(list(texts), dtype=object), errors='coerce'))
+        chunk = pd.DataFrame({year_col: years, amount_col: list(numbers.values()) + list(texts.values())})
+        return _fold_chunks([chunk], amount_col, year_col, 'year'), None
+
+    chunks = []
+    if numbers:
+        # Real dates are stored as serial day numbers
+        origin = '1904-01-01' if date1904 else '1899-12-30'
+        dates = pd.to_datetime(pd.Series(list(numbers)), unit='D', origin=origin)
+        chunks.append(pd.DataFrame({year_col: dates, amount_col: list(numbers.values())}))
+    if texts:
+        chunks.append(pd.DataFrame({year_col: list(texts), amount_col: list(texts.values())}))
+    monthly = _fold_chunks(chunks, amount_col, year_col, 'month')
+    return yearly_from_monthly(monthly), monthly
+
+
+def statement_format(filename):
+    """One of the STATEMENT_FORMATS values for a file name ('csv' when unrecognised)."""
+    return STATEMENT_FORMATS.get(os.path.splitext(str(filename))[1].lower(), 'csv')
+
+
+def read_totals(source, filename=None, csv_engine='c', sheet=None):
+    """(yearly, monthly or None) for a statement in any supported format.
+
+    source is a path or file object; the format comes from filename, which
+    defaults to source itself (so it must be given for file objects). sheet
+    picks the worksheet of .xlsx statements (see xlsx_totals).
+    """
+    fmt = statement_format(filename if filename is not None else source)
+    if fmt == 'xlsx':
+        return xlsx_totals(source, sheet)
+    if fmt in ('parquet', 'arrow'):
+        return columnar_totals(source, fmt)
+    return statement_totals(source, csv_engine=csv_engine)
+
+
+def dataframe_totals(df):
+    """(yearly, monthly) totals for a statement DataFrame; monthly is None without dates."""
+    amount_col, year_col = detect_columns(df.columns)
+    if year_col.lower() != 'date' and not pd.api.types.is_datetime64_any_dtype(df[year_col]):
+        return aggregate_dataframe(df), None
+    monthly = aggregate_dataframe(df, period='month')
+    return yearly_from_monthly(monthly), monthly
+
+
+def yearly_from_monthly(monthly):
+    """Calendar-year totals from a monthly Period-indexed series."""
+    return monthly.groupby(monthly.index.year.astype('int64')).sum()
+
+
+# ============================================================================
+# MULTI-LISTING STATEMENTS
+# ============================================================================
+def _fold_listing_chunks(chunks, listing_col, amount_col, year_col, period):
+    """Fold DataFrame chunks into a (listing, period) indexed series of sums.
+
+    The multi-listing counterpart of _fold_chunks: each chunk is summed by
+    listing and raw period value in one groupby. Date strings are parsed
+    after the last chunk, once per distinct value, with the format detected
+    from all of them (see parse_dates).
+    """
+    partials, by_date = [], []
+    for chunk in stage_timing.timed(chunks, 'parse'):
+        with stage_timing.stage('aggregate'):
+            keys = chunk[listing_col].astype(str)
+            column = chunk[year_col]
+            if pd.api.types.is_datetime64_any_dtype(column):
+                partials.append(chunk[amount_col].groupby([keys, period_keys(column, period)]).sum())
+            elif year_col.lower() == 'date':
+                by_date.append(chunk[amount_col].groupby([keys, column.astype(str).str.strip()]).sum())
+            else:
+                partials.append(chunk[amount_col].groupby([keys, column]).sum())
+    with stage_timing.stage('aggregate'):
+        if by_date:
+            sums = pd.concat(by_date).groupby(level=[0, 1]).sum()
+            if len(sums):
+                raw = sums.index.levels[1]
+                dates = parse_dates(raw, detect_date_format(raw, year_col), year_col)
+                periods = period_keys(dates, period)[sums.index.codes[1]]
+                partials.append(sums.groupby([sums.index.get_level_values(0), periods]).sum())
+        if not partials:
+            return pd.Series(dtype='float64', name=amount_col)
+        return pd.concat(partials).groupby(level=[0, 1]).sum()
+
+
+def _wide(sums):
+    """A (listing, period) series as a listing x period table, NaN where a listing has no rows."""
+    table = sums.unstack(level=1)
+    if pd.api.types.is_float_dtype(table.columns):
+        table.columns = table.columns.astype('int64')
+    return table.sort_index(axis=0).sort_index(axis=1)
+
+
+def listing_totals(source, filename=None, csv_engine='c', chunksize=CHUNK_ROWS):
+    """(yearly, monthly or None) totals of every listing in a multi-listing statement, in one pass.
+
+    Both are DataFrames indexed by listing key, with a column per year
+    (monthly: per month Period), NaN where a listing has no rows. CSV,
+    Parquet and Arrow statements are supported; only the listing, amount and
+    period columns are read, and each chunk is summed by (listing, period)
+    before the next is read.
+    """
+    fmt = statement_format(filename if filename is not None else source)
+    if fmt == 'xlsx':
+        raise ValueError("Multi-listing statements must be CSV, Parquet or Arrow files")
+    if fmt == 'csv' and csv_engine not in CSV_ENGINES:
+        raise ValueError(f"Unknown CSV engine '{csv_engine}' (choose from {', '.join(CSV_ENGINES)})")
+    if fmt != 'csv' or csv_engine == 'pyarrow':
+        pa = _pyarrow()
+
+    close = lambda: None
+    with stage_timing.stage('detect'):
+        if fmt == 'csv':
+            columns = read_csv_header(source)
+        else:
+            schema, batches, close = _open_columnar(source, fmt)
+            columns = schema.names
+    try:
+        listing_col = detect_listing_column(columns)
+        if listing_col is None:
+            raise ValueError(f"Could not find a listing column (one of {', '.join(LISTING_COLUMNS)})")
+        amount_col, year_col = detect_columns([c for c in columns if c != listing_col])
+        usecols = [listing_col, amount_col, year_col]
+
+        if fmt != 'csv':
+            field_type = schema.field(year_col).type
+            dated = (year_col.lower() == 'date' or pa.types.is_timestamp(field_type)
+                     or pa.types.is_date(field_type))
+            # Summed by (listing, period) in Arrow first, so only distinct keys become Python objects
+            chunks = (table.group_by([listing_col, year_col]).aggregate([(amount_col, 'sum')])
+                      .to_pandas(date_as_object=False).rename(columns={f'{amount_col}_sum': amount_col})
+                      for table in _tables(batches(usecols)))
+        else:
+            dated = year_col.lower() == 'date'
+            if csv_engine == 'pyarrow':
+                mapped = pa.memory_map(os.fspath(source)) if _is_path(source) else None
+                if mapped is not None:
+                    close = mapped.close
+                table = pa.csv.read_csv(
+                    mapped or _arrow_source(source),
+                    read_options=pa.csv.ReadOptions(use_threads=True),
+                    convert_options=pa.csv.ConvertOptions(
+                        include_columns=usecols,
+                        column_types={listing_col: pa.string(), amount_col: pa.float64(),
+                                      year_col: pa.string() if dated else pa.float64()},
+                    ),
+                )
+                chunks = [table.group_by([listing_col, year_col]).aggregate([(amount_col, 'sum')])
+                          .to_pandas().rename(columns={f'{amount_col}_sum': amount_col})]
+            else:
+                chunks = pd.read_csv(
+                    source,
+                    usecols=usecols,
+                    dtype={listing_col: 'str', amount_col: 'float64', year_col: 'str' if dated else 'float64'},
+                    chunksize=chunksize,
+                    memory_map=_is_path(source),
+                )
+
+        sums = _fold_listing_chunks(chunks, listing_col, amount_col, year_col, 'month' if dated else 'year')
+    finally:
+        close()
+
+    with stage_timing.stage('aggregate'):
+        if not dated:
+            return _wide(sums), None
+        monthly = _wide(sums)
+        yearly = monthly.T.groupby(monthly.columns.year.astype('int64')).sum(min_count=1).T
+        return yearly, monthly
+
+
+def listing_base_year_estimates(monthly):
+    """base_year_estimates() for every row of a listing_totals() monthly table at once.
+
+    Returns a DataFrame indexed like monthly with 'ttm', 'annualized_ytd' and
+    'seasonal' columns. Each listing's months run from its first to its last
+    month with data, gaps counting as zero, exactly as for one listing.
+    """
+    estimates = pd.DataFrame(0.0, index=monthly.index, columns=['ttm', 'annualized_ytd', 'seasonal'])
+    if monthly.empty or not len(monthly.columns):
+        return estimates
+
+    # Whole calendar years of months, so each row reshapes to a year x month grid
+    start, end = monthly.columns.min(), monthly.columns.max()
+    months = pd.period_range(pd.Period(year=start.year, month=1, freq='M'),
+                             pd.Period(year=end.year, month=12, freq='M'), freq='M')
+    values = monthly.reindex(columns=months).to_numpy(dtype='float64')
+    present = ~np.isnan(values)
+    has_data = present.any(axis=1)
+    positions = np.arange(len(months))
+    first = np.argmax(present, axis=1)
+    last = len(months) - 1 - np.argmax(present[:, ::-1], axis=1)
+    filled = np.where((positions >= first[:, None]) & (positions <= last[:, None]),
+                      np.nan_to_num(values), 0.0)
+    running = np.concatenate([np.zeros((len(values), 1)), np.cumsum(filled, axis=1)], axis=1)
+    rows = np.arange(len(values))
+
+    def window(begin, stop):
+        """Each row's sum over month positions [begin, stop]."""
+        return running[rows, stop + 1] - running[rows, np.maximum(begin, 0)]
+
+    # With under a year of history, scale what there is up to twelve months
+    span = last - first + 1
+    ttm = np.where(span >= 12, window(last - 11, last), window(first, last) * 12 / span)
+
+    latest_month = last % 12 + 1
+    ytd = window(last - latest_month + 1, last)
+    annualized = ytd * 12 / latest_month
+
+    # Share of each prior complete year earned by the latest month, averaged
+    grid = filled.reshape(len(values), -1, 12)
+    years = np.arange(grid.shape[1])
+    first_full = first // 12 + (first % 12 != 0)
+    complete = (years >= first_full[:, None]) & (years < (last // 12)[:, None])
+    totals = grid.sum(axis=2)
+    to_date = np.cumsum(grid, axis=2)[rows, :, latest_month - 1]
+    counted = complete & (totals > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_share = np.where(counted, to_date / np.where(counted, totals, 1), 0).sum(axis=1) / counted.sum(axis=1)
+        seasonal = np.where(counted.any(axis=1) & (mean_share > 0), ytd / mean_share, annualized)
+
+    estimates['ttm'] = np.where(has_data, ttm, 0.0)
+    estimates['annualized_ytd'] = np.where(has_data, annualized, 0.0)
+    estimates['seasonal'] = np.where(has_data, seasonal, 0.0)
+    return estimates
+
+
+def listing_inputs(yearly, current_year=None, base_year_method='last_year', monthly=None):
+    """yearly_inputs() for every row of a listing_totals() table at once.
+
+    Returns a DataFrame indexed like yearly with the year_minus_3 .. base_year
+    columns, computed with array operations across all listings rather than
+    listing by listing.
+    """
+    if base_year_method not in BASE_YEAR_METHODS:
+        raise ValueError(f"Unknown base year method '{base_year_method}' "
+                         f"(choose from {', '.join(BASE_YEAR_METHODS)})")
+    current_year = current_year or datetime.now().year
+    inputs = pd.DataFrame(index=yearly.index)
+    if yearly.empty:
+        for name in ('year_minus_3', 'year_minus_2', 'year_minus_1', 'ytd', 'base_year'):
+            inputs[name] = pd.Series(dtype='float64')
+        return inputs
+
+    # Every year from the first to the last (and the current one), so "latest - k" is a column offset
+    first = int(min(yearly.columns))
+    last = max(int(max(yearly.columns)), current_year)
+    years = list(range(first, last + 1))
+    values = yearly.reindex(columns=years).to_numpy(dtype='float64')
+    present = ~np.isnan(values)
+    rows = np.arange(len(values))
+
+    def at(positions):
+        """Each row's total at a column position; 0 for years before the first or without rows."""
+        valid = positions >= 0
+        picked = values[rows, np.where(valid, positions, 0)]
+        return np.where(valid & ~np.isnan(picked), picked, 0.0)
+
+    current = np.full(len(values), current_year - first)
+    # Without current year royalties, count back from each listing's latest year instead
+    latest = len(years) - 1 - np.argmax(present[:, ::-1], axis=1)
+    shift = (at(current) == 0) & present.any(axis=1)
+    anchor = np.where(shift, latest, current)
+
+    ytd = at(anchor)
+    inputs['year_minus_3'] = at(anchor - 3)
+    inputs['year_minus_2'] = at(anchor - 2)
+    inputs['year_minus_1'] = at(anchor - 1)
+    inputs['ytd'] = ytd
+    inputs['base_year'] = np.where(inputs['year_minus_1'] > 0, inputs['year_minus_1'], ytd)
+
+    if base_year_method != 'last_year':
+        if monthly is not None and len(monthly.columns):
+            estimates = listing_base_year_estimates(monthly)
+            inputs['base_year'] = estimates[base_year_method].reindex(inputs.index, fill_value=0.0)
+        elif base_year_method == 'annualized_ytd':
+            now = datetime.now()
+            months_elapsed = np.where(at(current) != 0, now.month, 12)
+            inputs['base_year'] = ytd * 12 / months_elapsed
+        else:
+            raise ValueError(f"The '{base_year_method}' base year needs a statement with a date column")
+    return inputs
+
+
+def base_year_estimates(monthly):
+    """Run-rate estimates of a full year's royalties from monthly totals.
+
+    Returns {'ttm', 'annualized_ytd', 'seasonal'}. Gaps between months are
+    filled with zero so the rolling windows always span calendar months.
+    """
+    monthly = monthly[monthly.index.notna()]
+    if monthly.empty:
+        return {'ttm': 0.0, 'annualized_ytd': 0.0, 'seasonal': 0.0}
+    months = pd.period_range(monthly.index.min(), monthly.index.max(), freq='M')
+    full = monthly.reindex(months, fill_value=0.0)
+
+    # With under a year of history, scale what there is up to twelve months
+    ttm = full.rolling(12).sum().iloc[-1] if len(full) >= 12 else full.sum() * 12 / len(full)
+
+    latest = months[-1]
+    ytd = full[months.year == latest.year].sum()
+    annualized = ytd * 12 / latest.month
+
+    # Share of each prior complete year earned by the latest month, averaged
+    first_full_year = months[0].year if months[0].month == 1 else months[0].year + 1
+    complete = full[(months.year >= first_full_year) & (months.year < latest.year)]
+    seasonal = annualized
+    if not complete.empty:
+        by_month = complete.groupby([complete.index.year, complete.index.month]).sum().unstack(fill_value=0.0)
+        totals = by_month.sum(axis=1)
+        shares = by_month.cumsum(axis=1)[latest.month][totals > 0] / totals[totals > 0]
+        if not shares.empty and shares.mean() > 0:
+            seasonal = ytd / shares.mean()
+
+    return {'ttm': float(ttm), 'annualized_ytd': float(annualized), 'seasonal': float(seasonal)}
+
+
+def yearly_inputs(yearly, current_year=None, base_year_method='last_year', monthly=None):
+    """Pick Year -3..-1, YTD and base year royalties from yearly totals.
+
+    base_year_method is one of BASE_YEAR_METHODS; every method but last_year
+    (and annualized_ytd, which falls back to months elapsed this year) needs
+    the monthly totals of a dated statement.
+    """
+    if base_year_method not in BASE_YEAR_METHODS:
+        raise ValueError(f"Unknown base year method '{base_year_method}' "
+                         f"(choose from {', '.join(BASE_YEAR_METHODS)})")
+    # Get years
+    current_year = current_year or datetime.now().year
+    years_list = sorted(yearly.index)
+
+    # Extract values
+    ytd = yearly.get(current_year, 0)
+    year_minus_1 = yearly.get(current_year - 1, 0)
+    year_minus_2 = yearly.get(current_year - 2, 0)
+    year_minus_3 = yearly.get(current_year - 3, 0)
+
+    # If no current year data, shift
+    if ytd == 0 and years_list:
+        latest = max(years_list)
+        ytd = yearly.get(latest, 0)
+        year_minus_1 = yearly.get(latest - 1, 0)
+        year_minus_2 = yearly.get(latest - 2, 0)
+        year_minus_3 = yearly.get(latest - 3, 0)
+
+    # Base year = most recent full year
+    base_year = year_minus_1 if year_minus_1 > 0 else ytd
+    if base_year_method != 'last_year':
+        if monthly is not None and len(monthly):
+            base_year = base_year_estimates(monthly)[base_year_method]
+        elif base_year_method == 'annualized_ytd':
+            # Yearly totals only: assume the current year runs through this month
+            now = datetime.now()
+            months_elapsed = now.month if yearly.get(current_year, 0) else 12
+            base_year = ytd * 12 / months_elapsed
+        else:
+            raise ValueError(f"The '{base_year_method}' base year needs a statement with a date column")
+
+    return {
+        'year_minus_3': year_minus_3,
+        'year_minus_2': year_minus_2,
+        'year_minus_1': year_minus_1,
+        'ytd': ytd,
+        'base_year': base_year,
+    }
+
+
+def listing_name(filename):
+    """Royalty name for a statement: "Listing 123" for listing-123 style names, else the file stem."""
+    base_name = os.path.splitext(os.path.basename(filename))[0]
+    # Extract listing number if present
+    match = re.search(r'listing[-_]?(\d+)', base_name, re.IGNORECASE)
+    if match:
+        return f"Listing {match.group(1)}"
+    return base_name
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Music Royalty Valuation Engine
+Vectorized NumPy version of the DCF model that create_valuation_template writes
+into the spreadsheet as formulas. Every function accepts scalars or arrays and
+broadcasts them, so one call can value thousands of listings/assumption sets.
+"""
+
+import numpy as np
+
+# ============================================================================
+# MODEL DEFAULTS (shared with create_valuation_template)
+# ============================================================================
+GROWTH_1_3 = 0.05          # B16
+GROWTH_4_5 = 0.03          # B17
+DISCOUNT_RATE = 0.12       # B18
+TERMINAL_GROWTH = -0.05    # B19
+
+# Bear / Base / Bull adjustments applied to the key assumptions (F6:H10)
+SCENARIOS = ('bear', 'base', 'bull')
+SCENARIO_BASE_CF_MULTIPLIERS = (0.9, 1.0, 1.1)
+SCENARIO_GROWTH_1_3_OFFSETS = (-0.02, 0.0, 0.03)
+SCENARIO_GROWTH_4_5_OFFSETS = (-0.01, 0.0, 0.02)
+SCENARIO_DISCOUNT_OFFSETS = (0.02, 0.0, 0.0)
+SCENARIO_TERMINAL_OFFSETS = (-0.02, 0.0, 0.02)
+SCENARIO_WEIGHTS = (0.25, 0.50, 0.25)
+
+# Sensitivity table axes
+SENSITIVITY_GROWTH_RATES = [0.00, 0.02, 0.04, 0.06, 0.08, 0.10, 0.12]
+SENSITIVITY_DISCOUNT_RATES = [0.08, 0.10, 0.12, 0.14, 0.16, 0.18]
+SENSITIVITY_TERMINAL_RATES = [-0.10, -0.07, -0.05, -0.03, 0.00, 0.02, 0.03]
+
+# Bump used by the "+1% Change" key value drivers (G31:G33)
+DRIVER_BUMP = 0.01
+
+
+# ============================================================================
+# SCENARIO MODEL (F12:H16, sensitivity grids, key value drivers)
+# ============================================================================
+def year5_cash_flow(base_cf, growth_1_3, growth_4_5):
+    """Year 5 cash flow: base * (1+g1)^3 * (1+g2)^2 (F12:H12)."""
+    base_cf = np.asarray(base_cf, dtype=float)
+    return base_cf * (1 + np.asarray(growth_1_3)) ** 3 * (1 + np.asarray(growth_4_5)) ** 2
+
+
+def terminal_value(base_cf, growth_1_3, growth_4_5, discount, terminal_growth):
+    """Undiscounted Gordon Growth terminal value (F13:H13)."""
+    terminal_growth = np.asarray(terminal_growth, dtype=float)
+    return (year5_cash_flow(base_cf, growth_1_3, growth_4_5) * (1 + terminal_growth)
+            / (np.asarray(discount) - terminal_growth))
+
+
+def implied_value(base_cf, growth_1_3, growth_4_5, discount, terminal_growth):
+    """Implied value of the two-phase growth + terminal model (F16:H16).
+
+    Same cash flow schedule as the sensitivity grids: Year 1 is the base CF,
+    Years 2-3 grow at g1, Years 4-5 at g2, then a Gordon terminal discounted
+    back five years.
+    """
+    base_cf = np.asarray(base_cf, dtype=float)
+    g1 = 1 + np.asarray(growth_1_3, dtype=float)
+    g2 = 1 + np.asarray(growth_4_5, dtype=float)
+    d = 1 + np.asarray(discount, dtype=float)
+
+    year5 = base_cf * g1 ** 3 * g2 ** 2
+    pv_terminal = terminal_value(base_cf, growth_1_3, growth_4_5, discount, terminal_growth) / d ** 5
+    return (base_cf / d
+            + base_cf * g1 / d ** 2
+            + base_cf * g1 ** 2 / d ** 3
+            + base_cf * g1 ** 3 * g2 / d ** 4
+            + year5 / d ** 5
+            + pv_terminal)
+
+
+def scenario_inputs(base_cf, growth_1_3=GROWTH_1_3, growth_4_5=GROWTH_4_5,
+                    discount=DISCOUNT_RATE, terminal_growth=TERMINAL_GROWTH):
+    """Bear/Base/Bull assumptions (F6:H10), each with a trailing axis of 3."""
+    def expand(value):
+        return np.asarray(value, dtype=float)[..., np.newaxis]
+
+    return {
+        'base_cf': expand(base_cf) * np.array(SCENARIO_BASE_CF_MULTIPLIERS),
+        'growth_1_3': expand(growth_1_3) + np.array(SCENARIO_GROWTH_1_3_OFFSETS),
+        'growth_4_5': expand(growth_4_5) + np.array(SCENARIO_GROWTH_4_5_OFFSETS),
+        'discount': expand(discount) + np.array(SCENARIO_DISCOUNT_OFFSETS),
+        'terminal_growth': expand(terminal_growth) + np.array(SCENARIO_TERMINAL_OFFSETS),
+    }
+
+
+def value_scenarios(base_cf, growth_1_3=GROWTH_1_3, growth_4_5=GROWTH_4_5,
+                    discount=DISCOUNT_RATE, terminal_growth=TERMINAL_GROWTH,
+                    weights=SCENARIO_WEIGHTS):
+    """Scenario analysis and weighted valuation (F6:H17, K19:K23)."""
+    inputs = scenario_inputs(base_cf, growth_1_3, growth_4_5, discount, terminal_growth)
+    args = (inputs['base_cf'], inputs['growth_1_3'], inputs['growth_4_5'],
+            inputs['discount'], inputs['terminal_growth'])
+
+    terminal = terminal_value(*args)
+    values = implied_value(*args)
+    weighted = values @ np.asarray(weights, dtype=float)
+    base_cf = np.asarray(base_cf, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vs_base = values / values[..., 1:2] - 1
+        ev_multiple = weighted / base_cf
+
+    return {
+        **inputs,
+        'year5_cf': year5_cash_flow(args[0], args[1], args[2]),
+        'terminal_value': terminal,
+        'pv_terminal': terminal / (1 + inputs['discount']) ** 5,
+        'implied_value': values,
+        'vs_base': vs_base,
+        'weighted_value': weighted,
+        'ev_multiple': ev_multiple,
+    }
+
+
+def sensitivity_grids(base_cf, growth_1_3=GROWTH_1_3, growth_4_5=GROWTH_4_5,
+                      terminal_growth=TERMINAL_GROWTH,
+                      growth_rates=SENSITIVITY_GROWTH_RATES,
+                      discount_rates=SENSITIVITY_DISCOUNT_RATES,
+                      terminal_rates=SENSITIVITY_TERMINAL_RATES):
+    """Both sensitivity tables, shaped (..., len(discount_rates), len(axis)).
+
+    The first varies discount rate vs growth (Years 1-3) (C44:I49), the second
+    discount rate vs terminal growth (C55:I60).
+    """
+    base_cf = np.asarray(base_cf, dtype=float)[..., np.newaxis, np.newaxis]
+    g1 = np.asarray(growth_1_3, dtype=float)[..., np.newaxis, np.newaxis]
+    g2 = np.asarray(growth_4_5, dtype=float)[..., np.newaxis, np.newaxis]
+    tg = np.asarray(terminal_growth, dtype=float)[..., np.newaxis, np.newaxis]
+    rows = np.asarray(discount_rates, dtype=float)[:, np.newaxis]
+
+    growth_grid = implied_value(base_cf, np.asarray(growth_rates, dtype=float), g2, rows, tg)
+    terminal_grid = implied_value(base_cf, g1, g2, rows, np.asarray(terminal_rates, dtype=float))
+    return growth_grid, terminal_grid
+
+
+# ============================================================================
+# 5-YEAR DCF PROJECTION (B24:H28, B31:B39)
+# ============================================================================
+def dcf_projection(base_cf, growth_1_3=GROWTH_1_3, growth_4_5=GROWTH_4_5,
+                   discount=DISCOUNT_RATE, terminal_growth=TERMINAL_GROWTH):
+    """5-year projection and valuation summary, mirroring rows 24-39.
+
+    Unlike the scenario model, Year 1 here is already grown from the base year.
+    The projection rows have a trailing axis: 7 for income (Base..Terminal),
+    5 for discount factors and PVs (Year 1..Year 5).
+    """
+    base_cf = np.asarray(base_cf, dtype=float)
+    g1 = 1 + np.asarray(growth_1_3, dtype=float)
+    g2 = 1 + np.asarray(growth_4_5, dtype=float)
+    r = np.asarray(discount, dtype=float)
+    tg = np.asarray(terminal_growth, dtype=float)
+
+    # Each year is grown from the previous cell, exactly as C24:H24 chain
+    income = [base_cf]
+    for growth in (g1, g1, g1, g2, g2, 1 + tg):
+        income.append(income[-1] * growth)
+    income = np.stack(np.broadcast_arrays(*income), axis=-1)
+
+    discount_factors = np.stack(
+        np.broadcast_arrays(*[1 / (1 + r) ** year for year in range(1, 6)]), axis=-1)
+    pv_cash_flows = income[..., 1:6] * discount_factors
+
+    terminal = income[..., 6] / (r - tg)
+    pv_terminal = terminal * discount_factors[..., 4]
+    sum_pv = pv_cash_flows.sum(axis=-1)
+    enterprise_value = sum_pv + pv_terminal
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_cash_flows = sum_pv / enterprise_value
+        pct_terminal = pv_terminal / enterprise_value
+
+    return {
+        'income': income,
+        'discount_factors': discount_factors,
+        'pv_cash_flows': pv_cash_flows,
+        'terminal_value': terminal,
+        'pv_terminal': pv_terminal,
+        'sum_pv': sum_pv,
+        'enterprise_value': enterprise_value,
+        'pct_cash_flows': pct_cash_flows,
+        'pct_terminal': pct_terminal,
+    }
+
+
+def value_drivers(base_cf, growth_1_3=GROWTH_1_3, growth_4_5=GROWTH_4_5,
+                  discount=DISCOUNT_RATE, terminal_growth=TERMINAL_GROWTH,
+                  enterprise_value=None):
+    """Key value drivers (G31:H33): value change for a +1% bump in g1, tg and r.
+
+    Returns (changes, sensitivities), each with a trailing axis of 3 in the
+    sheet's order: growth rate, terminal growth, discount rate.
+    """
+    if enterprise_value is None:
+        enterprise_value = dcf_projection(base_cf, growth_1_3, growth_4_5,
+                                          discount, terminal_growth)['enterprise_value']
+    g1 = np.asarray(growth_1_3, dtype=float)
+    tg = np.asarray(terminal_growth, dtype=float)
+    r = np.asarray(discount, dtype=float)
+
+    bumped = np.stack(np.broadcast_arrays(
+        implied_value(base_cf, g1 + DRIVER_BUMP, growth_4_5, r, tg),
+        implied_value(base_cf, g1, growth_4_5, r, tg + DRIVER_BUMP),
+        implied_value(base_cf, g1, growth_4_5, r + DRIVER_BUMP, tg),
+    ), axis=-1)
+    enterprise_value = np.asarray(enterprise_value, dtype=float)[..., np.newaxis]
+    changes = bumped - enterprise_value
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sensitivities = changes / enterprise_value
+    return changes, sensitivities
+
+
+# ============================================================================
+# MONTE CARLO
+# ============================================================================
+MC_PATHS = 1_000_000
+# Standard deviations of the normal distributions sampled around each assumption
+MC_GROWTH_1_3_SD = 0.02
+MC_GROWTH_4_5_SD = 0.01
+MC_DISCOUNT_SD = 0.015
+MC_TERMINAL_SD = 0.015
+# Paths where discount - terminal growth falls below this are dropped (Gordon model breaks down)
+MC_MIN_SPREAD = 0.01
+MC_PERCENTILES = (5, 25, 50, 75, 95)
+MC_HISTOGRAM_BINS = 20
+
+
+def monte_carlo(base_cf, growth_1_3=GROWTH_1_3, growth_4_5=GROWTH_4_5,
+                discount=DISCOUNT_RATE, terminal_growth=TERMINAL_GROWTH,
+                paths=MC_PATHS, seed=None,
+                growth_1_3_sd=MC_GROWTH_1_3_SD, growth_4_5_sd=MC_GROWTH_4_5_SD,
+                discount_sd=MC_DISCOUNT_SD, terminal_sd=MC_TERMINAL_SD):
+    """Simulate implied values with normally distributed assumptions.
+
+    Samples all paths at once and evaluates them with implied_value in one
+    vectorized pass. Returns a JSON-ready dict with percentiles, mean/std and
+    a histogram (tails beyond P1/P99 are folded into the end bins).
+    """
+    rng = np.random.default_rng(seed)
+    g1 = rng.normal(growth_1_3, growth_1_3_sd, paths)
+    g2 = rng.normal(growth_4_5, growth_4_5_sd, paths)
+    r = rng.normal(discount, discount_sd, paths)
+    tg = rng.normal(terminal_growth, terminal_sd, paths)
+
+    valid = (r - tg) >= MC_MIN_SPREAD
+    if not valid.all():
+        g1, g2, r, tg = g1[valid], g2[valid], r[valid], tg[valid]
+    values = implied_value(base_cf, g1, g2, r, tg)
+
+    if values.size == 0:
+        raise ValueError("No valid Monte Carlo paths: discount rate must exceed terminal growth")
+
+    percentiles = np.percentile(values, (1,) + tuple(MC_PERCENTILES) + (99,))
+    low, high = percentiles[0], percentiles[-1]
+    if high <= low:
+        high = low + 1
+    counts, edges = np.histogram(np.clip(values, low, high), bins=MC_HISTOGRAM_BINS, range=(low, high))
+
+    return {
+        'paths': int(paths),
+        'valid_paths': int(values.size),
+        'seed': seed,
+        'distributions': {
+            'growth_1_3': {'mean': _json_number(growth_1_3), 'sd': growth_1_3_sd},
+            'growth_4_5': {'mean': _json_number(growth_4_5), 'sd': growth_4_5_sd},
+            'discount': {'mean': _json_number(discount), 'sd': discount_sd},
+            'terminal_growth': {'mean': _json_number(terminal_growth), 'sd': terminal_sd},
+        },
+        'mean': _json_number(values.mean()),
+        'std': _json_number(values.std()),
+        'percentiles': {f'p{p}': _json_number(v) for p, v in zip(MC_PERCENTILES, percentiles[1:-1])},
+        'histogram': {
+            'bin_edges': _json_list(edges),
+            'counts': counts.tolist(),
+        },
+    }
+
+
+# ============================================================================
+# FULL MODEL
+# ============================================================================
+def value_listing(base_cf, growth_1_3=GROWTH_1_3, growth_4_5=GROWTH_4_5,
+                  discount=DISCOUNT_RATE, terminal_growth=TERMINAL_GROWTH,
+                  weights=SCENARIO_WEIGHTS, growth_rates=SENSITIVITY_GROWTH_RATES,
+                  discount_rates=SENSITIVITY_DISCOUNT_RATES,
+                  terminal_rates=SENSITIVITY_TERMINAL_RATES):
+    """Evaluate every computed block of the valuation sheet at once.
+
+    The *_rates arguments are the sensitivity table axes.
+    """
+    scenarios = value_scenarios(base_cf, growth_1_3, growth_4_5, discount,
+                                terminal_growth, weights)
+    projection = dcf_projection(base_cf, growth_1_3, growth_4_5, discount, terminal_growth)
+    changes, sensitivities = value_drivers(base_cf, growth_1_3, growth_4_5, discount,
+                                           terminal_growth, projection['enterprise_value'])
+    growth_grid, terminal_grid = sensitivity_grids(base_cf, growth_1_3, growth_4_5,
+                                                   terminal_growth, growth_rates,
+                                                   discount_rates, terminal_rates)
+    return {
+        'scenarios': scenarios,
+        'projection': projection,
+        'driver_changes': changes,
+        'driver_sensitivities': sensitivities,
+        'growth_sensitivity': growth_grid,
+        'terminal_sensitivity': terminal_grid,
+    }
+
+
+def _json_number(value):
+    """Plain float for JSON, with NaN/inf (e.g. a zero base year) as None."""
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def _json_list(values):
+    return np.vectorize(_json_number, otypes=[object])(np.asarray(values)).tolist()
+
+
+def summarize_listing(base_cf, growth_1_3=GROWTH_1_3, growth_4_5=GROWTH_4_5,
+                      discount=DISCOUNT_RATE, terminal_growth=TERMINAL_GROWTH,
+                      weights=SCENARIO_WEIGHTS, growth_rates=SENSITIVITY_GROWTH_RATES,
+                      discount_rates=SENSITIVITY_DISCOUNT_RATES,
+                      terminal_rates=SENSITIVITY_TERMINAL_RATES):
+    """JSON-ready summary of the full model for a single listing."""
+    model = value_listing(base_cf, growth_1_3, growth_4_5, discount, terminal_growth, weights,
+                          growth_rates, discount_rates, terminal_rates)
+    scenarios = model['scenarios']
+    projection = model['projection']
+
+    scenario_fields = ('base_cf', 'growth_1_3', 'growth_4_5', 'discount', 'terminal_growth',
+                       'year5_cf', 'terminal_value', 'pv_terminal', 'implied_value', 'vs_base')
+    drivers = ('growth_1_3', 'terminal_growth', 'discount')
+
+    return {
+        'assumptions': {
+            'base_cf': _json_number(base_cf),
+            'growth_1_3': _json_number(growth_1_3),
+            'growth_4_5': _json_number(growth_4_5),
+            'discount': _json_number(discount),
+            'terminal_growth': _json_number(terminal_growth),
+            'weights': _json_list(weights),
+        },
+        'scenarios': {
+            name: {field: _json_number(scenarios[field][i]) for field in scenario_fields}
+            for i, name in enumerate(SCENARIOS)
+        },
+        'weighted_value': _json_number(scenarios['weighted_value']),
+        'ev_multiple': _json_number(scenarios['ev_multiple']),
+        'valuation_range': [_json_number(scenarios['implied_value'][0]),
+                            _json_number(scenarios['implied_value'][2])],
+        'dcf': {
+            'income': _json_list(projection['income']),
+            'discount_factors': _json_list(projection['discount_factors']),
+            'pv_cash_flows': _json_list(projection['pv_cash_flows']),
+            **{k: _json_number(projection[k]) for k in (
+                'terminal_value', 'pv_terminal', 'sum_pv', 'enterprise_value',
+                'pct_cash_flows', 'pct_terminal')},
+        },
+        'value_drivers': {
+            name: {'change': _json_number(model['driver_changes'][i]),
+                   'sensitivity': _json_number(model['driver_sensitivities'][i])}
+            for i, name in enumerate(drivers)
+        },
+        'sensitivity': {
+            'discount_rates': [float(r) for r in discount_rates],
+            'growth_rates': [float(r) for r in growth_rates],
+            'growth_grid': _json_list(model['growth_sensitivity']),
+            'terminal_rates': [float(r) for r in terminal_rates],
+            'terminal_grid': _json_list(model['terminal_sensitivity']),
+        },
+    }
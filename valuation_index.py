@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Local SQLite index of every valuation produced.
+Each workbook generated by the desktop tool or the web app is also recorded
+here (listing, yearly totals, scenario values, weighted value, EV/base-CF
+multiple), so listings can be ranked, filtered and exported later without
+opening any xlsx. The latest valuation of each listing is flagged, and the
+ranking columns are indexed together with that flag, so top-N and range
+queries stay index scans however many rows accumulate.
+"""
+
+import csv
+from datetime import datetime
+import json
+import math
+import os
+import sqlite3
+import valuation_engine as engine
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS valuations (
+    id INTEGER PRIMARY KEY,
+    listing TEXT NOT NULL,
+    source TEXT,
+    base_year_method TEXT,
+    year_minus_3 REAL,
+    year_minus_2 REAL,
+    year_minus_1 REAL,
+    ytd REAL,
+    base_year REAL,
+    yearly TEXT NOT NULL,
+    bear_value REAL,
+    base_value REAL,
+    bull_value REAL,
+    weighted_value REAL,
+    ev_multiple REAL,
+    created_at TEXT NOT NULL,
+    latest INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS valuations_listing ON valuations (listing, latest);
+CREATE INDEX IF NOT EXISTS valuations_latest_multiple ON valuations (latest, ev_multiple);
+CREATE INDEX IF NOT EXISTS valuations_latest_value ON valuations (latest, weighted_value);
+CREATE INDEX IF NOT EXISTS valuations_latest_created ON valuations (latest, created_at);
+"""
+
+# Columns results can be ordered by (each has a (latest, column) index)
+ORDER_COLUMNS = ('ev_multiple', 'weighted_value', 'created_at')
+
+EXPORT_FIELDS = ['id', 'listing', 'source', 'base_year_method', 'year_minus_3', 'year_minus_2',
+                 'year_minus_1', 'ytd', 'base_year', 'bear_value', 'base_value', 'bull_value',
+                 'weighted_value', 'ev_multiple', 'created_at', 'yearly']
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 10_000
+
+
+def _finite(value):
+    """SQLite REAL for a number, or NULL for nan/inf (e.g. the multiple of a zero base year)."""
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+class ValuationIndex:
+    """Records valuations and answers ranking/filter queries over them."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            # WAL lets web workers and batch processes write while others read
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(self, listing, inputs, yearly, source=None, base_year_method='last_year'):
+        """Value a listing's inputs (from statement_reader.yearly_inputs) and store the result.
+
+        Returns the new row id. Earlier valuations of the listing are kept as
+        history but no longer count as its latest.
+        """
+        scenarios = engine.value_scenarios(float(inputs['base_year']))
+        bear, base, bull = (float(v) for v in scenarios['implied_value'])
+        row = (
+            listing, source, base_year_method,
+            float(inputs['year_minus_3']), float(inputs['year_minus_2']), float(inputs['year_minus_1']),
+            float(inputs['ytd']), float(inputs['base_year']),
+            json.dumps({str(int(year)): float(amount) for year, amount in yearly.items()}),
+            _finite(bear), _finite(base), _finite(bull),
+            _finite(scenarios['weighted_value']), _finite(scenarios['ev_multiple']),
+            datetime.now().isoformat(timespec='seconds'),
+        )
+        with self._connect() as conn:
+            conn.execute("UPDATE valuations SET latest=0 WHERE listing=? AND latest=1", (listing,))
+            cursor = conn.execute(
+                "INSERT INTO valuations (listing, source, base_year_method, year_minus_3, year_minus_2, "
+                "year_minus_1, ytd, base_year, yearly, bear_value, base_value, bull_value, weighted_value, "
+                "ev_multiple, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        return cursor.lastrowid
+
+    def record_many(self, entries, source=None, base_year_method='last_year'):
+        """record() for many (listing, inputs, yearly) entries in one transaction.
+
+        The scenarios of every entry are valued in one vectorized call.
+        Returns the number of rows recorded.
+        """
+        entries = list(entries)
+        if not entries:
+            return 0
+        scenarios = engine.value_scenarios([float(inputs['base_year']) for _, inputs, _ in entries])
+        created_at = datetime.now().isoformat(timespec='seconds')
+        rows = []
+        for i, (listing, inputs, yearly) in enumerate(entries):
+            bear, base, bull = (float(v) for v in scenarios['implied_value'][i])
+            rows.append((
+                listing, source, base_year_method,
+                float(inputs['year_minus_3']), float(inputs['year_minus_2']), float(inputs['year_minus_1']),
+                float(inputs['ytd']), float(inputs['base_year']),
+                json.dumps({str(int(year)): float(amount) for year, amount in yearly.items()}),
+                _finite(bear), _finite(base), _finite(bull),
+                _finite(scenarios['weighted_value'][i]), _finite(scenarios['ev_multiple'][i]),
+                created_at,
+            ))
+        with self._connect() as conn:
+            for row in rows:
+                conn.execute("UPDATE valuations SET latest=0 WHERE listing=? AND latest=1", (row[0],))
+                conn.execute(
+                    "INSERT INTO valuations (listing, source, base_year_method, year_minus_3, year_minus_2, "
+                    "year_minus_1, ytd, base_year, yearly, bear_value, base_value, bull_value, weighted_value, "
+                    "ev_multiple, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        return len(rows)
+
+    def _select(self, order_by='ev_multiple', descending=True, min_value=None, max_value=None,
+                min_multiple=None, max_multiple=None, listing=None, history=False, limit=DEFAULT_LIMIT):
+        if order_by not in ORDER_COLUMNS:
+            raise ValueError(f"Can't order by '{order_by}' (choose from {', '.join(ORDER_COLUMNS)})")
+        where, params = [], []
+        if not history:
+            where.append("latest=1")
+        if listing:
+            where.append("listing=?")
+            params.append(listing)
+        for column, op, bound in (('weighted_value', '>=', min_value), ('weighted_value', '<=', max_value),
+                                  ('ev_multiple', '>=', min_multiple), ('ev_multiple', '<=', max_multiple)):
+            if bound is not None:
+                where.append(f"{column}{op}?")
+                params.append(float(bound))
+        # Rows with nothing to rank by (the multiple of a zero base year) are left out
+        where.append(f"{order_by} IS NOT NULL")
+        direction = 'DESC' if descending else 'ASC'
+        sql = (f"SELECT * FROM valuations WHERE {' AND '.join(where)} "
+               f"ORDER BY {order_by} {direction}, id {direction}")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return sql, params
+
+    def query(self, **filters):
+        """Matching valuations as dicts, best first.
+
+        Filters: order_by (one of ORDER_COLUMNS), descending, min_value/max_value
+        (weighted value), min_multiple/max_multiple, listing, history (include
+        superseded valuations) and limit. Rows with no value in the order_by
+        column are left out.
+        """
+        sql, params = self._select(**filters)
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            result['yearly'] = json.loads(result['yearly'])
+            del result['latest']
+            results.append(result)
+        return results
+
+    def export_rows(self, **filters):
+        """Yield the EXPORT_FIELDS header, then one tuple per matching valuation.
+
+        Newest first and unlimited by default; rows are streamed from SQLite
+        rather than loaded all at once.
+        """
+        filters.setdefault('order_by', 'created_at')
+        filters.setdefault('limit', None)
+        sql, params = self._select(**filters)
+        sql = sql.replace("SELECT *", f"SELECT {', '.join(EXPORT_FIELDS)}", 1)
+        yield tuple(EXPORT_FIELDS)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            yield from conn.execute(sql, params)
+        finally:
+            conn.close()
+
+    def export_csv(self, output, **filters):
+        """Write matching valuations as CSV to a text file object (see export_rows)."""
+        csv.writer(output).writerows(self.export_rows(**filters))
+        return output
+
+    def count(self, history=False):
+        with self._connect() as conn:
+            sql = "SELECT COUNT(*) FROM valuations" + ("" if history else " WHERE latest=1")
+            return conn.execute(sql).fetchone()[0]
@@ -0,0 +1,1797 @@
+#!/usr/bin/env python3
+"""
+Valuation workbook layout and rendering backends.
+The sheet is described once as a backend-neutral SheetLayout (values plus style
+keys), then written by whichever backend the caller picks:
+
+    'openpyxl'            - full in-memory openpyxl Workbook
+    'openpyxl-write-only' - openpyxl write-only mode, rows streamed in order
+    'xlsxwriter'          - XlsxWriter in constant-memory mode (optional dependency)
+    'direct'              - SpreadsheetML written straight into the zip, row by row
+    'template'            - the 'direct' sheet compiled once per process, with only
+                            the input cells patched in per listing (fastest, default)
+
+Styles are shared: each distinct font/fill/format combination is defined once
+by name and reused for every cell, instead of fresh Font objects per cell.
+
+Every backend writes each formula's cached value alongside it (evaluated by
+sheet_formulas), so the files read correctly without a recalculation pass.
+openpyxl can't write cached values itself, so its backends save and then
+rewrite the sheet XML; they're kept for comparison, not used by default.
+
+The sensitivity tables' axes and sizes come from a SensitivityConfig; their
+cells can be written as a formula each, as shared formulas, or as values,
+and are evaluated a whole table at a time (see SENSITIVITY_MODES).
+
+iter_valuation_workbook() yields the same workbook as zip bytes while it is
+being written ('template' and 'direct' stream the sheet member as it is
+deflated), for sending straight into an HTTP response.
+iter_portfolio_workbook() does the same for many listings in one workbook: a
+summary sheet plus a sheet per listing, all from the compiled template.
+"""
+
+from copy import copy
+from datetime import datetime
+from xml.sax.saxutils import escape
+import io
+import math
+import zipfile
+import numpy as np
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.styles.numbers import BUILTIN_FORMATS_REVERSE
+from openpyxl.utils import get_column_letter, column_index_from_string
+from openpyxl.utils.cell import coordinate_from_string
+import re
+import sheet_formulas
+import stage_timing
+import valuation_engine as engine
+
+DEFAULT_BACKEND = 'template'
+
+# Weighted valuation and its EV / base year CF multiple on the valuation sheet
+# (valuation_engine.value_scenarios' weighted_value and ev_multiple)
+WEIGHTED_VALUE_CELL = 'K19'
+EV_MULTIPLE_CELL = 'K22'
+
+# Style keys used by the layout
+FONTS = {
+    'title': dict(bold=True, size=16),
+    'subtitle': dict(italic=True, size=11, color="666666"),
+    'section': dict(bold=True, size=12),
+    'header': dict(bold=True, size=11),
+    'headline': dict(bold=True, size=14),
+    'bold': dict(bold=True),
+    'edit': dict(italic=True, color="0066CC"),
+    'comment': dict(italic=True, color="666666"),
+    'note': dict(size=10, color="666666"),
+}
+FILLS = {
+    'input': "E2EFDA",
+    'bear': "FCE4D6",
+    'base': "DDEBF7",
+    'bull': "E2EFDA",
+    'weighted': "FFF2CC",
+}
+ALIGNMENTS = {
+    'center': dict(horizontal='center'),
+}
+
+# How sensitivity table cells are written:
+#   'formulas' - every cell has its own fully expanded formula
+#   'shared'   - one formula per table, shared by the other cells (only the
+#                'direct' and 'template' backends can write shared formulas;
+#                openpyxl and XlsxWriter fall back to a formula per cell)
+#   'values'   - the values alone, precomputed for each table at once
+SENSITIVITY_MODES = ('formulas', 'shared', 'values')
+DEFAULT_SENSITIVITY_MODE = 'shared'
+# Largest number of rates on either axis of a sensitivity table
+MAX_SENSITIVITY_AXIS = 200
+
+
+def parse_axis(text):
+    """Rates for a sensitivity axis from 'start:stop:count' or a comma separated list.
+
+    Rates are fractions or percentages: '0:0.12:25', '8%,10%,12%' and
+    '-10%:3%:14' all work.
+    """
+    def rate(part):
+        part = part.strip()
+        try:
+            if part.endswith('%'):
+                return float(part[:-1]) / 100
+            return float(part)
+        except ValueError:
+            raise ValueError(f"Invalid rate '{part}' in sensitivity axis '{text}'")
+
+    if ':' in text:
+        parts = text.split(':')
+        if len(parts) != 3:
+            raise ValueError(f"Sensitivity axis ranges are start:stop:count, got '{text}'")
+        try:
+            count = int(parts[2])
+        except ValueError:
+            raise ValueError(f"Invalid count in sensitivity axis '{text}'")
+        if count < 1:
+            raise ValueError(f"Sensitivity axis '{text}' needs at least one rate")
+        rates = np.linspace(rate(parts[0]), rate(parts[1]), count)
+    else:
+        rates = [rate(part) for part in text.split(',') if part.strip()]
+    # Rounded so 0.1 from a range prints (and caches) the same as a typed 0.1
+    return tuple(round(float(r), 10) for r in rates)
+
+
+class SensitivityConfig:
+    """Axes of the two sensitivity tables and how their cells are written.
+
+    The growth and terminal rates run across the columns of the first and
+    second table; both tables have a row per discount rate. Any axis left as
+    None uses valuation_engine's default rates.
+    """
+
+    def __init__(self, growth_rates=None, discount_rates=None, terminal_rates=None,
+                 mode=DEFAULT_SENSITIVITY_MODE):
+        self.growth_rates = self._axis('growth', growth_rates, engine.SENSITIVITY_GROWTH_RATES)
+        self.discount_rates = self._axis('discount', discount_rates, engine.SENSITIVITY_DISCOUNT_RATES)
+        self.terminal_rates = self._axis('terminal', terminal_rates, engine.SENSITIVITY_TERMINAL_RATES)
+        if mode not in SENSITIVITY_MODES:
+            raise ValueError(f"Unknown sensitivity mode '{mode}' (choose from {', '.join(SENSITIVITY_MODES)})")
+        self.mode = mode
+
+    @staticmethod
+    def _axis(name, rates, default):
+        rates = tuple(float(r) for r in (default if rates is None else rates))
+        if not 1 <= len(rates) <= MAX_SENSITIVITY_AXIS:
+            raise ValueError(f"The {name} axis needs between 1 and {MAX_SENSITIVITY_AXIS} rates, got {len(rates)}")
+        if not all(math.isfinite(r) and r > -1 for r in rates):
+            raise ValueError(f"The {name} axis rates must be finite and above -100%")
+        return rates
+
+    @classmethod
+    def from_text(cls, growth=None, discount=None, terminal=None, mode=None):
+        """A config from parse_axis() strings; blank or None parts keep their defaults."""
+        return cls(parse_axis(growth) if growth else None,
+                   parse_axis(discount) if discount else None,
+                   parse_axis(terminal) if terminal else None,
+                   mode or DEFAULT_SENSITIVITY_MODE)
+
+    def key(self):
+        return (self.growth_rates, self.discount_rates, self.terminal_rates, self.mode)
+
+    def __eq__(self, other):
+        return isinstance(other, SensitivityConfig) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return (f"SensitivityConfig({len(self.discount_rates)}x{len(self.growth_rates)} growth, "
+                f"{len(self.discount_rates)}x{len(self.terminal_rates)} terminal, mode={self.mode!r})")
+
+
+class LayoutCell:
+    """One cell of a SheetLayout: a value plus font/fill/alignment style keys."""
+
+    __slots__ = ('value', 'font', 'fill', 'number_format', 'alignment')
+
+    def __init__(self):
+        self.value = None
+        self.font = None
+        self.fill = None
+        self.number_format = None
+        self.alignment = None
+
+    @property
+    def style_key(self):
+        return (self.font, self.fill, self.number_format, self.alignment)
+
+
+class SheetLayout:
+    """Backend-neutral worksheet, addressed like an openpyxl sheet (ws['A1'] = ...).
+
+    Assigning a value to a cell keeps any style already set on it, exactly like
+    openpyxl, so later sections can overwrite earlier ones.
+    """
+
+    def __init__(self, title):
+        self.title = title
+        self.cells = {}
+        self.column_widths = {}
+        # Shared formula cells: {ref: (shared index, range on the anchor cell, else None)}
+        self.shared_formulas = {}
+        # Sensitivity tables not written as plain formulas (see _add_sensitivity_table)
+        self.grids = []
+
+    def __getitem__(self, ref):
+        cell = self.cells.get(ref)
+        if cell is None:
+            cell = self.cells[ref] = LayoutCell()
+        return cell
+
+    def __setitem__(self, ref, value):
+        self[ref].value = value
+
+    def rows(self):
+        """Yield (row_number, [(column_number, cell), ...]) in sheet order."""
+        by_row = {}
+        for ref, cell in self.cells.items():
+            col, row = coordinate_from_string(ref)
+            by_row.setdefault(row, []).append((column_index_from_string(col), cell))
+        for row in sorted(by_row):
+            yield row, sorted(by_row[row], key=lambda item: item[0])
+
+    def style_keys(self):
+        """Distinct style combinations used, in first-use order."""
+        return list(dict.fromkeys(cell.style_key for cell in self.cells.values()))
+
+    def formula_values(self):
+        """Cached value (float, text, bool or sheet_formulas.CellError) for every formula cell.
+
+        Shared formula sensitivity tables are evaluated a table at a time
+        instead of formula by formula.
+        """
+        values = {ref: cell.value for ref, cell in self.cells.items()}
+        grids = [grid for grid in self.grids if grid['formulas']]
+        for grid in grids:
+            for refs in grid['refs']:
+                for ref in refs:
+                    del values[ref]
+        cached = sheet_formulas.evaluate_formulas(values)
+        cached.update(_sensitivity_values(grids, values))
+        return cached
+
+
+def build_valuation_layout(royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year,
+                           monte_carlo=None, sensitivity=None):
+    """Lays out the complete valuation template with data populated.
+
+    monte_carlo is an optional valuation_engine.monte_carlo() result to add as
+    a percentile/histogram section below the model notes. sensitivity is a
+    SensitivityConfig for the two sensitivity tables (default axes and mode
+    when None).
+    """
+
+    ws = SheetLayout("Valuation Model")
+
+    # ============================================================================
+    # TITLE
+    # ============================================================================
+    ws['A1'] = "MUSIC ROYALTY DCF VALUATION MODEL"
+    ws['A1'].font = 'title'
+    ws['A2'] = "Master Template with Weighted Scenario Analysis"
+    ws['A2'].font = 'subtitle'
+
+    # ============================================================================
+    # DATA INPUT SECTION
+    # ============================================================================
+    ws['A4'] = "DATA INPUT"
+    ws['A4'].font = 'section'
+
+    ws['A5'] = "Royalty Name/ID:"
+    ws['B5'] = royalty_name
+    ws['B5'].fill = 'input'
+    ws['C5'] = "<- Edit"
+    ws['C5'].font = 'edit'
+
+    ws['A7'] = "HISTORICAL ROYALTIES"
+    ws['A7'].font = 'header'
+
+    # Historical data - POPULATED
+    ws['A8'] = "Year -3 Royalties"
+    ws['B8'] = year_minus_3
+    ws['B8'].fill = 'input'
+    ws['B8'].number_format = '#,##0.00'
+    ws['C8'] = "<- Edit"
+    ws['C8'].font = 'edit'
+
+    ws['A9'] = "Year -2 Royalties"
+    ws['B9'] = year_minus_2
+    ws['B9'].fill = 'input'
+    ws['B9'].number_format = '#,##0.00'
+    ws['C9'] = "<- Edit"
+    ws['C9'].font = 'edit'
+
+    ws['A10'] = "Year -1 Royalties"
+    ws['B10'] = year_minus_1
+    ws['B10'].fill = 'input'
+    ws['B10'].number_format = '#,##0.00'
+    ws['C10'] = "<- Edit"
+    ws['C10'].font = 'edit'
+
+    ws['A11'] = "Current YTD Royalties"
+    ws['B11'] = ytd
+    ws['B11'].fill = 'input'
+    ws['B11'].number_format = '#,##0.00'
+    ws['C11'] = "<- Edit"
+    ws['C11'].font = 'edit'
+
+    ws['A12'] = "3-Year Average"
+    ws['B12'] = "=AVERAGE(B8:B10)"
+    ws['B12'].number_format = '#,##0.00'
+
+    ws['A13'] = "Base Year Royalties"
+    ws['B13'] = base_year
+    ws['B13'].fill = 'input'
+    ws['B13'].number_format = '#,##0.00'
+    ws['C13'] = "<- Edit (normalized starting CF)"
+    ws['C13'].font = 'edit'
+
+    # ============================================================================
+    # KEY ASSUMPTIONS
+    # ============================================================================
+    ws['A15'] = "KEY ASSUMPTIONS"
+    ws['A15'].font = 'section'
+
+    ws['A16'] = "Growth Rate (Years 1-3)"
+    ws['B16'] = engine.GROWTH_1_3
+    ws['B16'].fill = 'input'
+    ws['B16'].number_format = '0.0%'
+    ws['C16'] = "<- Edit"
+    ws['C16'].font = 'edit'
+
+    ws['A17'] = "Growth Rate (Years 4-5)"
+    ws['B17'] = engine.GROWTH_4_5
+    ws['B17'].fill = 'input'
+    ws['B17'].number_format = '0.0%'
+    ws['C17'] = "<- Edit"
+    ws['C17'].font = 'edit'
+
+    ws['A18'] = "Discount Rate"
+    ws['B18'] = engine.DISCOUNT_RATE
+    ws['B18'].fill = 'input'
+    ws['B18'].number_format = '0.0%'
+    ws['C18'] = "<- Edit"
+    ws['C18'].font = 'edit'
+
+    ws['A19'] = "Terminal Growth Rate"
+    ws['B19'] = engine.TERMINAL_GROWTH
+    ws['B19'].fill = 'input'
+    ws['B19'].number_format = '0.0%'
+    ws['C19'] = "<- Edit (usually negative)"
+    ws['C19'].font = 'edit'
+
+    # ============================================================================
+    # SCENARIO ANALYSIS
+    # ============================================================================
+    ws['E4'] = "SCENARIO ANALYSIS"
+    ws['E4'].font = 'section'
+
+    ws['F5'] = "Bear"
+    ws['F5'].font = 'header'
+    ws['F5'].fill = 'bear'
+    ws['F5'].alignment = 'center'
+    ws['G5'] = "Base"
+    ws['G5'].font = 'header'
+    ws['G5'].fill = 'base'
+    ws['G5'].alignment = 'center'
+    ws['H5'] = "Bull"
+    ws['H5'].font = 'header'
+    ws['H5'].fill = 'bull'
+    ws['H5'].alignment = 'center'
+
+    # Scenario parameters
+    ws['E6'] = "Base Year CF"
+    ws['F6'] = "=B13*0.9"
+    ws['G6'] = "=B13"
+    ws['H6'] = "=B13*1.1"
+    for col in ['F', 'G', 'H']:
+        ws[f'{col}6'].number_format = '#,##0.00'
+
+    ws['E7'] = "Growth (Yr 1-3)"
+    ws['F7'] = "=B16-0.02"
+    ws['G7'] = "=B16"
+    ws['H7'] = "=B16+0.03"
+    for col in ['F', 'G', 'H']:
+        ws[f'{col}7'].number_format = '0.0%'
+
+    ws['E8'] = "Growth (Yr 4-5)"
+    ws['F8'] = "=B17-0.01"
+    ws['G8'] = "=B17"
+    ws['H8'] = "=B17+0.02"
+    for col in ['F', 'G', 'H']:
+        ws[f'{col}8'].number_format = '0.0%'
+
+    ws['E9'] = "Discount Rate"
+    ws['F9'] = "=B18+0.02"
+    ws['G9'] = "=B18"
+    ws['H9'] = "=B18"
+    for col in ['F', 'G', 'H']:
+        ws[f'{col}9'].number_format = '0.0%'
+
+    ws['E10'] = "Terminal Growth"
+    ws['F10'] = "=B19-0.02"
+    ws['G10'] = "=B19"
+    ws['H10'] = "=B19+0.02"
+    for col in ['F', 'G', 'H']:
+        ws[f'{col}10'].number_format = '0.0%'
+
+    ws['E12'] = "Year 5 CF"
+    for col, c in [('F', 'F'), ('G', 'G'), ('H', 'H')]:
+        ws[f'{col}12'] = f"={c}6*(1+{c}7)^3*(1+{c}8)^2"
+        ws[f'{col}12'].number_format = '#,##0.00'
+
+    ws['E13'] = "Terminal Value"
+    for col, c in [('F', 'F'), ('G', 'G'), ('H', 'H')]:
+        ws[f'{col}13'] = f"={c}12*(1+{c}10)/({c}9-{c}10)"
+        ws[f'{col}13'].number_format = '#,##0.00'
+
+    ws['E14'] = "PV of Terminal"
+    for col, c in [('F', 'F'), ('G', 'G'), ('H', 'H')]:
+        ws[f'{col}14'] = f"={c}13/(1+{c}9)^5"
+        ws[f'{col}14'].number_format = '#,##0.00'
+
+    ws['E16'] = "Implied Value"
+    ws['E16'].font = 'header'
+    for col, c in [('F', 'F'), ('G', 'G'), ('H', 'H')]:
+        ws[f'{col}16'] = (
+            f"={c}6/(1+{c}9)"
+            f"+{c}6*(1+{c}7)/(1+{c}9)^2"
+            f"+{c}6*(1+{c}7)^2/(1+{c}9)^3"
+            f"+{c}6*(1+{c}7)^3*(1+{c}8)/(1+{c}9)^4"
+            f"+{c}12/(1+{c}9)^5"
+            f"+{c}14"
+        )
+        ws[f'{col}16'].number_format = '$#,##0.00'
+        ws[f'{col}16'].font = 'bold'
+
+    ws['E17'] = "vs Base Case"
+    ws['F17'] = "=F16/G16-1"
+    ws['G17'] = "-"
+    ws['H17'] = "=H16/G16-1"
+    for col in ['F', 'H']:
+        ws[f'{col}17'].number_format = '0.0%'
+
+    # ============================================================================
+    # WEIGHTED AVERAGE VALUATION
+    # ============================================================================
+    ws['E19'] = "WEIGHTED AVERAGE VALUATION"
+    ws['E19'].font = 'section'
+
+    ws['E20'] = "Scenario Weights"
+    ws['E20'].font = 'header'
+    ws['F20'] = "Bear Weight"
+    ws['G20'] = "Base Weight"
+    ws['H20'] = "Bull Weight"
+
+    ws['F21'] = engine.SCENARIO_WEIGHTS[0]
+    ws['F21'].fill = 'input'
+    ws['F21'].number_format = '0%'
+    ws['G21'] = engine.SCENARIO_WEIGHTS[1]
+    ws['G21'].fill = 'input'
+    ws['G21'].number_format = '0%'
+    ws['H21'] = engine.SCENARIO_WEIGHTS[2]
+    ws['H21'].fill = 'input'
+    ws['H21'].number_format = '0%'
+    ws['I21'] = "<- Edit weights (must = 100%)"
+    ws['I21'].font = 'edit'
+
+    # The result sits right of the weights: the DCF projection below uses rows 22-28 up to column H
+    ws['J19'] = "WEIGHTED VALUATION"
+    ws['J19'].font = 'section'
+    ws[WEIGHTED_VALUE_CELL] = "=F16*F21+G16*G21+H16*H21"
+    ws[WEIGHTED_VALUE_CELL].number_format = '$#,##0.00'
+    ws[WEIGHTED_VALUE_CELL].font = 'headline'
+    ws[WEIGHTED_VALUE_CELL].fill = 'weighted'
+
+    ws['J20'] = "Valuation Range"
+    ws['K20'] = "=F16"
+    ws['K20'].number_format = '$#,##0'
+    ws['L20'] = "to"
+    ws['M20'] = "=H16"
+    ws['M20'].number_format = '$#,##0'
+
+    ws['J21'] = "Weight Check"
+    ws['K21'] = "=F21+G21+H21"
+    ws['K21'].number_format = '0%'
+    ws['L21'] = '=IF(K21=1,"OK","ERROR: Must = 100%")'
+
+    ws['J22'] = "EV / Base Year CF"
+    ws[EV_MULTIPLE_CELL] = f"={WEIGHTED_VALUE_CELL}/B13"
+    ws[EV_MULTIPLE_CELL].number_format = '0.0x'
+
+    ws['J23'] = "Payback Period (years)"
+    ws['K23'] = f"={WEIGHTED_VALUE_CELL}/B13"
+    ws['K23'].number_format = '0.0'
+
+    # ============================================================================
+    # 5-YEAR DCF PROJECTION
+    # ============================================================================
+    ws['A21'] = "5-YEAR DCF PROJECTION"
+    ws['A21'].font = 'section'
+
+    headers = ["Year", "Base", "Year 1", "Year 2", "Year 3", "Year 4", "Year 5", "Terminal"]
+    for i, h in enumerate(headers):
+        col = get_column_letter(i + 1)
+        ws[f'{col}22'] = h
+        ws[f'{col}22'].font = 'header'
+
+    ws['A23'] = "Fiscal Year"
+    ws['B23'] = datetime.now().year
+    for i in range(1, 6):
+        ws[f'{get_column_letter(i+2)}23'] = f"={get_column_letter(i+1)}23+1"
+    ws['H23'] = "Perpetuity"
+
+    ws['A24'] = "Royalty Income"
+    ws['B24'] = "=B13"
+    ws['C24'] = "=B24*(1+$B$16)"
+    ws['D24'] = "=C24*(1+$B$16)"
+    ws['E24'] = "=D24*(1+$B$16)"
+    ws['F24'] = "=E24*(1+$B$17)"
+    ws['G24'] = "=F24*(1+$B$17)"
+    ws['H24'] = "=G24*(1+$B$19)"
+    for col in 'BCDEFGH':
+        ws[f'{col}24'].number_format = '#,##0.00'
+
+    ws['A25'] = "Growth Rate"
+    ws['B25'] = "-"
+    ws['C25'] = "=$B$16"
+    ws['D25'] = "=$B$16"
+    ws['E25'] = "=$B$16"
+    ws['F25'] = "=$B$17"
+    ws['G25'] = "=$B$17"
+    ws['H25'] = "=$B$19"
+    for col in 'CDEFGH':
+        ws[f'{col}25'].number_format = '0.0%'
+
+    ws['A27'] = "Discount Factor"
+    ws['B27'] = 1
+    for i in range(1, 6):
+        col = get_column_letter(i + 2)
+        ws[f'{col}27'] = f"=1/(1+$B$18)^{i}"
+        ws[f'{col}27'].number_format = '0.0000'
+    ws['H27'] = "=G27"
+    ws['H27'].number_format = '0.0000'
+
+    ws['A28'] = "PV of Cash Flow"
+    for col in ['C', 'D', 'E', 'F', 'G']:
+        ws[f'{col}28'] = f"={col}24*{col}27"
+        ws[f'{col}28'].number_format = '#,##0.00'
+
+    # ============================================================================
+    # VALUATION SUMMARY
+    # ============================================================================
+    ws['A30'] = "VALUATION SUMMARY"
+    ws['A30'].font = 'section'
+
+    ws['A31'] = "Terminal Value (undiscounted)"
+    ws['B31'] = "=H24/($B$18-$B$19)"
+    ws['B31'].number_format = '#,##0.00'
+    ws['C31'] = "Gordon Growth formula"
+    ws['C31'].font = 'comment'
+
+    ws['A32'] = "PV of Terminal Value"
+    ws['B32'] = "=B31*G27"
+    ws['B32'].number_format = '#,##0.00'
+
+    ws['A34'] = "Sum of PV of Cash Flows"
+    ws['B34'] = "=SUM(C28:G28)"
+    ws['B34'].number_format = '#,##0.00'
+
+    ws['A35'] = "PV of Terminal Value"
+    ws['B35'] = "=B32"
+    ws['B35'].number_format = '#,##0.00'
+
+    ws['A36'] = "Enterprise Value"
+    ws['B36'] = "=B34+B35"
+    ws['B36'].number_format = '$#,##0.00'
+    ws['B36'].font = 'bold'
+
+    ws['A38'] = "% from Cash Flows"
+    ws['B38'] = "=B34/B36"
+    ws['B38'].number_format = '0.0%'
+
+    ws['A39'] = "% from Terminal Value"
+    ws['B39'] = "=B35/B36"
+    ws['B39'].number_format = '0.0%'
+
+    # ============================================================================
+    # SENSITIVITY ANALYSIS 1 & 2
+    # ============================================================================
+    sensitivity = sensitivity or SensitivityConfig()
+    # Both tables have a row per discount rate; everything below them moves down with their size
+    second_table = 41 + len(sensitivity.discount_rates) + 5
+    notes_row = second_table + len(sensitivity.discount_rates) + 4
+    _add_sensitivity_table(ws, 41, 'growth', sensitivity)
+    _add_sensitivity_table(ws, second_table, 'terminal', sensitivity)
+
+    # ============================================================================
+    # KEY VALUE DRIVERS
+    # ============================================================================
+    ws['E29'] = "KEY VALUE DRIVERS"
+    ws['E29'].font = 'section'
+
+    ws['E30'] = "Driver"
+    ws['E30'].font = 'header'
+    ws['F30'] = "Impact"
+    ws['G30'] = "+1% Change"
+    ws['H30'] = "% Sensitivity"
+
+    ws['E31'] = "Royalty Growth Rate"
+    ws['F31'] = "High"
+    ws['G31'] = (
+        "=($B$13*(1+($B$16+0.01))^3*(1+$B$17)^2*(1+$B$19)/($B$18-$B$19))/(1+$B$18)^5"
+        "+$B$13/(1+$B$18)+$B$13*(1+($B$16+0.01))/(1+$B$18)^2"
+        "+$B$13*(1+($B$16+0.01))^2/(1+$B$18)^3"
+        "+$B$13*(1+($B$16+0.01))^3*(1+$B$17)/(1+$B$18)^4"
+        "+$B$13*(1+($B$16+0.01))^3*(1+$B$17)^2/(1+$B$18)^5"
+        "-B36"
+    )
+    ws['G31'].number_format = '+#,##0.00;-#,##0.00'
+    ws['H31'] = "=G31/B36"
+    ws['H31'].number_format = '+0.0%;-0.0%'
+
+    ws['E32'] = "Terminal Growth Rate"
+    ws['F32'] = "High"
+    ws['G32'] = (
+        "=($B$13*(1+$B$16)^3*(1+$B$17)^2*(1+($B$19+0.01))/($B$18-($B$19+0.01)))/(1+$B$18)^5"
+        "+$B$13/(1+$B$18)+$B$13*(1+$B$16)/(1+$B$18)^2"
+        "+$B$13*(1+$B$16)^2/(1+$B$18)^3"
+        "+$B$13*(1+$B$16)^3*(1+$B$17)/(1+$B$18)^4"
+        "+$B$13*(1+$B$16)^3*(1+$B$17)^2/(1+$B$18)^5"
+        "-B36"
+    )
+    ws['G32'].number_format = '+#,##0.00;-#,##0.00'
+    ws['H32'] = "=G32/B36"
+    ws['H32'].number_format = '+0.0%;-0.0%'
+
+    ws['E33'] = "Discount Rate"
+    ws['F33'] = "High"
+    ws['G33'] = (
+        "=($B$13*(1+$B$16)^3*(1+$B$17)^2*(1+$B$19)/(($B$18+0.01)-$B$19))/(1+($B$18+0.01))^5"
+        "+$B$13/(1+($B$18+0.01))+$B$13*(1+$B$16)/(1+($B$18+0.01))^2"
+        "+$B$13*(1+$B$16)^2/(1+($B$18+0.01))^3"
+        "+$B$13*(1+$B$16)^3*(1+$B$17)/(1+($B$18+0.01))^4"
+        "+$B$13*(1+$B$16)^3*(1+$B$17)^2/(1+($B$18+0.01))^5"
+        "-B36"
+    )
+    ws['G33'].number_format = '+#,##0.00;-#,##0.00'
+    ws['H33'] = "=G33/B36"
+    ws['H33'].number_format = '+0.0%;-0.0%'
+
+    # ============================================================================
+    # VALUE COMPOSITION
+    # ============================================================================
+    ws['E36'] = "VALUE COMPOSITION"
+    ws['E36'].font = 'section'
+
+    ws['E37'] = "Component"
+    ws['E37'].font = 'header'
+    ws['F37'] = "Value"
+    ws['G37'] = "% of Total"
+
+    ws['E38'] = "PV of 5-Year Cash Flows"
+    ws['F38'] = "=B34"
+    ws['F38'].number_format = '#,##0.00'
+    ws['G38'] = "=B34/B36"
+    ws['G38'].number_format = '0.0%'
+
+    ws['E39'] = "PV of Terminal Value"
+    ws['F39'] = "=B35"
+    ws['F39'].number_format = '#,##0.00'
+    ws['G39'] = "=B35/B36"
+    ws['G39'].number_format = '0.0%'
+
+    ws['E40'] = "Total Enterprise Value"
+    ws['F40'] = "=B36"
+    ws['F40'].number_format = '#,##0.00'
+    ws['F40'].font = 'bold'
+    ws['G40'] = "100%"
+
+    # ============================================================================
+    # MODEL NOTES
+    # ============================================================================
+    ws[f'A{notes_row}'] = "MODEL NOTES"
+    ws[f'A{notes_row}'].font = 'section'
+
+    notes = [
+        "* Green cells are INPUT cells - edit these with your royalty data",
+        "* Royalties = pure cash flow (no costs modeled)",
+        "* Terminal Value = Year 5 CF x (1+g) / (r-g) using Gordon Growth Model",
+        "* Two-phase growth: Years 1-3 near-term, Years 4-5 mature growth",
+        "* Weighted Valuation combines Bear/Base/Bull using your probability weights",
+        "* Sensitivity tables show impact of key assumption changes"
+    ]
+    for i, note in enumerate(notes):
+        ws[f'A{notes_row+1+i}'] = note
+        ws[f'A{notes_row+1+i}'].font = 'note'
+
+    if monte_carlo is not None:
+        add_monte_carlo_section(ws, monte_carlo, base_year, start_row=notes_row + 9)
+
+    # Column widths
+    ws.column_widths['A'] = 28
+    ws.column_widths['B'] = 14
+    ws.column_widths['C'] = 14
+    ws.column_widths['D'] = 14
+    ws.column_widths['E'] = 26
+    ws.column_widths['F'] = 14
+    ws.column_widths['G'] = 14
+    ws.column_widths['H'] = 14
+    ws.column_widths['I'] = 30
+    ws.column_widths['J'] = 24
+    ws.column_widths['K'] = 14
+
+    return ws
+
+
+_SENSITIVITY_TABLES = {
+    'growth': ("SENSITIVITY: Discount Rate vs Growth Rate (Years 1-3)", "Growth Rate (Years 1-3)"),
+    'terminal': ("SENSITIVITY: Discount Rate vs Terminal Growth Rate", "Terminal Growth Rate"),
+}
+# Cells the sensitivity formulas read: base year, growth 1-3 / 4-5 and terminal growth
+_SENSITIVITY_INPUTS = ('B13', 'B16', 'B17', 'B19')
+
+
+def _sensitivity_formula(kind, col, row, axis_row):
+    """The implied value formula for one sensitivity cell (discount rate in $B{row})."""
+    if kind == 'growth':
+        g1, tg = f'{col}${axis_row}', '$B$19'
+    else:
+        g1, tg = '$B$16', f'{col}${axis_row}'
+    return (
+        f"=($B$13*(1+{g1})^3*(1+$B$17)^2*(1+{tg})/($B{row}-{tg}))/(1+$B{row})^5"
+        f"+$B$13/(1+$B{row})"
+        f"+$B$13*(1+{g1})/(1+$B{row})^2"
+        f"+$B$13*(1+{g1})^2/(1+$B{row})^3"
+        f"+$B$13*(1+{g1})^3*(1+$B$17)/(1+$B{row})^4"
+        f"+$B$13*(1+{g1})^3*(1+$B$17)^2/(1+$B{row})^5"
+    )
+
+
+def _add_sensitivity_table(ws, start_row, kind, sensitivity):
+    """One sensitivity table: discount rates down column B, kind's rates across from column C.
+
+    Takes len(sensitivity.discount_rates) + 3 rows from start_row. Tables not
+    in 'formulas' mode are registered in ws.grids so their values can be
+    computed for the whole table at once.
+    """
+    title, axis_label = _SENSITIVITY_TABLES[kind]
+    rates = sensitivity.growth_rates if kind == 'growth' else sensitivity.terminal_rates
+    axis_row, first_row = start_row + 2, start_row + 3
+
+    ws[f'A{start_row}'] = title
+    ws[f'A{start_row}'].font = 'section'
+
+    ws[f'A{start_row + 1}'] = "Enterprise Value"
+    ws[f'C{start_row + 1}'] = axis_label
+    ws[f'C{start_row + 1}'].font = 'header'
+
+    for i, rate in enumerate(rates):
+        col = get_column_letter(i + 3)
+        ws[f'{col}{axis_row}'] = rate
+        ws[f'{col}{axis_row}'].number_format = '0%'
+        ws[f'{col}{axis_row}'].font = 'header'
+        ws[f'{col}{axis_row}'].alignment = 'center'
+
+    ws[f'A{first_row}'] = "Discount"
+    refs = []
+    for i, dr in enumerate(sensitivity.discount_rates):
+        row = first_row + i
+        ws[f'B{row}'] = dr
+        ws[f'B{row}'].number_format = '0%'
+        ws[f'B{row}'].font = 'header'
+
+        refs.append([])
+        for j in range(len(rates)):
+            col = get_column_letter(j + 3)
+            if sensitivity.mode != 'values':
+                ws[f'{col}{row}'] = _sensitivity_formula(kind, col, row, axis_row)
+            ws[f'{col}{row}'].number_format = '#,##0'
+            refs[-1].append(f'{col}{row}')
+
+    ws[f'A{first_row + 1}'] = "Rate"
+
+    if sensitivity.mode == 'formulas':
+        return
+    grid = {'kind': kind, 'rates': rates, 'discount_rates': sensitivity.discount_rates,
+            'refs': refs, 'formulas': sensitivity.mode == 'shared'}
+    ws.grids.append(grid)
+    if sensitivity.mode == 'shared':
+        # The top-left formula is written once; every other cell shifts it like a fill
+        index = len(ws.grids) - 1
+        span = f'{refs[0][0]}:{refs[-1][-1]}'
+        for row_refs in refs:
+            for ref in row_refs:
+                ws.shared_formulas[ref] = (index, None)
+        ws.shared_formulas[refs[0][0]] = (index, span)
+    else:
+        inputs = {ref: ws[ref].value for ref in _SENSITIVITY_INPUTS}
+        for ref, value in _sensitivity_values([grid], inputs).items():
+            ws[ref] = value
+
+
+def _sensitivity_values(grids, values):
+    """{ref: float or CellError} for every cell of the given sensitivity tables.
+
+    values holds the sheet's constant cells. Each table is one vectorized
+    valuation_engine.implied_value() call, so its cost barely grows with size.
+    """
+    if not grids:
+        return {}
+    try:
+        base_cf, g1, g2, tg = (float(values.get(ref) or 0) for ref in _SENSITIVITY_INPUTS)
+    except (TypeError, ValueError):
+        # Text in an input cell, as Excel would show it
+        return {ref: sheet_formulas.CellError('#VALUE!')
+                for grid in grids for refs in grid['refs'] for ref in refs}
+
+    result = {}
+    for grid in grids:
+        rows = np.asarray(grid['discount_rates'], dtype=float)[:, np.newaxis]
+        axis = np.asarray(grid['rates'], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            if grid['kind'] == 'growth':
+                table = engine.implied_value(base_cf, axis, g2, rows, tg)
+            else:
+                table = engine.implied_value(base_cf, g1, g2, rows, axis)
+        for refs, row_values in zip(grid['refs'], table.tolist()):
+            for ref, value in zip(refs, row_values):
+                # A discount rate equal to the terminal growth rate divides by zero
+                result[ref] = value if math.isfinite(value) else sheet_formulas.CellError('#DIV/0!')
+    return result
+
+
+def add_monte_carlo_section(ws, monte_carlo, base_year, start_row=71):
+    """Monte Carlo percentiles, assumption distributions and histogram table.
+
+    These are values simulated when the workbook was generated, not formulas,
+    so they don't follow later edits to the input cells.
+    """
+    row = start_row
+    ws[f'A{row}'] = "MONTE CARLO SIMULATION"
+    ws[f'A{row}'].font = 'section'
+    ws[f'A{row+1}'] = (f"{monte_carlo['valid_paths']:,} paths simulated from Base Year Royalties of "
+                       f"{base_year:,.2f} at generation (values do not recalculate)")
+    ws[f'A{row+1}'].font = 'comment'
+
+    # Percentiles
+    ws[f'A{row+3}'] = "Percentile"
+    ws[f'A{row+3}'].font = 'header'
+    ws[f'B{row+3}'] = "Implied Value"
+    ws[f'B{row+3}'].font = 'header'
+    stats = [(name.upper(), value) for name, value in monte_carlo['percentiles'].items()]
+    stats += [("Mean", monte_carlo['mean']), ("Std Dev", monte_carlo['std'])]
+    for i, (label, value) in enumerate(stats):
+        ws[f'A{row+4+i}'] = label
+        ws[f'B{row+4+i}'] = value
+        ws[f'B{row+4+i}'].number_format = '$#,##0.00'
+    ws[f'A{row+6}'].font = 'bold'
+    ws[f'B{row+6}'].font = 'bold'
+
+    # Assumption distributions
+    ws[f'E{row+3}'] = "Assumption (normal)"
+    ws[f'E{row+3}'].font = 'header'
+    ws[f'F{row+3}'] = "Mean"
+    ws[f'F{row+3}'].font = 'header'
+    ws[f'G{row+3}'] = "Std Dev"
+    ws[f'G{row+3}'].font = 'header'
+    labels = {
+        'growth_1_3': "Growth Rate (Years 1-3)",
+        'growth_4_5': "Growth Rate (Years 4-5)",
+        'discount': "Discount Rate",
+        'terminal_growth': "Terminal Growth Rate",
+    }
+    for i, (key, dist) in enumerate(monte_carlo['distributions'].items()):
+        ws[f'E{row+4+i}'] = labels[key]
+        ws[f'F{row+4+i}'] = dist['mean']
+        ws[f'F{row+4+i}'].number_format = '0.0%'
+        ws[f'G{row+4+i}'] = dist['sd']
+        ws[f'G{row+4+i}'].number_format = '0.0%'
+
+    # Histogram
+    row += 5 + len(stats)
+    ws[f'A{row}'] = "DISTRIBUTION OF IMPLIED VALUE"
+    ws[f'A{row}'].font = 'header'
+    for col, header in zip('ABCD', ["Value From", "Value To", "Paths", "% of Paths"]):
+        ws[f'{col}{row+1}'] = header
+        ws[f'{col}{row+1}'].font = 'header'
+    edges = monte_carlo['histogram']['bin_edges']
+    counts = monte_carlo['histogram']['counts']
+    total = sum(counts) or 1
+    for i, count in enumerate(counts):
+        r = row + 2 + i
+        ws[f'A{r}'] = edges[i]
+        ws[f'A{r}'].number_format = '$#,##0'
+        ws[f'B{r}'] = edges[i + 1]
+        ws[f'B{r}'].number_format = '$#,##0'
+        ws[f'C{r}'] = count
+        ws[f'C{r}'].number_format = '#,##0'
+        ws[f'D{r}'] = count / total
+        ws[f'D{r}'].number_format = '0.0%'
+
+
+# ============================================================================
+# RENDERING BACKENDS
+# ============================================================================
+_OPENPYXL_STYLES = {}
+
+
+def _openpyxl_style(key):
+    """Shared openpyxl (font, fill, number_format, alignment) for a style key, built once per process."""
+    style = _OPENPYXL_STYLES.get(key)
+    if style is None:
+        font, fill, number_format, alignment = key
+        style = _OPENPYXL_STYLES[key] = (
+            Font(**FONTS[font]) if font else None,
+            PatternFill(start_color=FILLS[fill], end_color=FILLS[fill], fill_type="solid") if fill else None,
+            number_format,
+            Alignment(**ALIGNMENTS[alignment]) if alignment else None,
+        )
+    return style
+
+
+class _OpenpyxlStyler:
+    """Applies layout styles to openpyxl cells.
+
+    The first cell with a given style is styled normally; every later cell
+    with the same style just copies its style record instead of looking up
+    the font/fill/format again.
+    """
+
+    def __init__(self):
+        self.styled = {}
+
+    def apply(self, target, cell):
+        key = cell.style_key
+        if key == (None, None, None, None):
+            return
+        proto = self.styled.get(key)
+        if proto is not None:
+            target._style = copy(proto)
+            return
+        font, fill, number_format, alignment = _openpyxl_style(key)
+        if font:
+            target.font = font
+        if fill:
+            target.fill = fill
+        if number_format:
+            target.number_format = number_format
+        if alignment:
+            target.alignment = alignment
+        self.styled[key] = target._style
+
+
+def _write_bytes(output, data):
+    """Write a finished package to a path or file-like object."""
+    if hasattr(output, 'write'):
+        output.write(data)
+    else:
+        with open(output, 'wb') as f:
+            f.write(data)
+
+
+_OPENPYXL_FORMULA_CELL = re.compile(r'<c r="([A-Z]+\d+)"([^>]*)><f>(.*?)</f><v\s*/></c>', re.S)
+
+
+def _save_openpyxl(wb, layout, output):
+    """Save an openpyxl workbook with the layout's cached formula values filled in.
+
+    openpyxl can only write formulas with empty values, so the saved sheet XML
+    gets its <v/> elements filled in before the package is written out.
+    """
+    wb.calculation.fullCalcOnLoad = False
+    buffer = io.BytesIO()
+    with stage_timing.stage('zip'):
+        wb.save(buffer)
+    cached = layout.formula_values()
+
+    def fill(match):
+        ref, attrs, formula = match.groups()
+        return _xml_formula_cell(ref, attrs, formula, cached.get(ref))
+
+    sheet = 'xl/worksheets/sheet1.xml'
+    package = io.BytesIO()
+    with stage_timing.stage('cached_values'), zipfile.ZipFile(buffer) as source, \
+            zipfile.ZipFile(package, 'w', zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            data = source.read(info)
+            if info.filename == sheet:
+                data = _OPENPYXL_FORMULA_CELL.sub(fill, data.decode('utf-8')).encode('utf-8')
+            target.writestr(info, data)
+    _write_bytes(output, package.getvalue())
+
+
+def render_openpyxl(layout, output):
+    """Write the layout through a regular in-memory openpyxl Workbook."""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = layout.title
+    styler = _OpenpyxlStyler()
+
+    with stage_timing.stage('cells'):
+        for row, cells in layout.rows():
+            for col, cell in cells:
+                target = ws.cell(row=row, column=col, value=cell.value)
+                styler.apply(target, cell)
+
+        for col, width in layout.column_widths.items():
+            ws.column_dimensions[col].width = width
+
+    _save_openpyxl(wb, layout, output)
+
+
+def render_openpyxl_write_only(layout, output):
+    """Write the layout with openpyxl's write-only mode, streaming rows in order."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(layout.title)
+    styler = _OpenpyxlStyler()
+
+    for col, width in layout.column_widths.items():
+        ws.column_dimensions[col].width = width
+
+    next_row = 1
+    with stage_timing.stage('cells'):
+        for row, cells in layout.rows():
+            # Write-only sheets can't skip rows, so pad the gaps with empty ones
+            for _ in range(row - next_row):
+                ws.append([])
+            values = [None] * cells[-1][0]
+            for col, cell in cells:
+                target = WriteOnlyCell(ws, value=cell.value)
+                styler.apply(target, cell)
+                values[col - 1] = target
+            ws.append(values)
+            next_row = row + 1
+
+    _save_openpyxl(wb, layout, output)
+
+
+def render_xlsxwriter(layout, output):
+    """Write the layout with XlsxWriter in constant-memory mode."""
+    try:
+        import xlsxwriter
+    except ImportError:
+        raise ValueError("The 'xlsxwriter' backend needs XlsxWriter: pip install xlsxwriter")
+
+    wb = xlsxwriter.Workbook(output, {'constant_memory': True})
+    # Cached values are written, so there's no need to force a recalculation on open
+    wb.calc_on_load = False
+    ws = wb.add_worksheet(layout.title)
+    cached = layout.formula_values()
+
+    formats = {}
+    for key in layout.style_keys():
+        font, fill, number_format, alignment = key
+        props = {}
+        if font:
+            spec = FONTS[font]
+            props.update(bold=spec.get('bold', False), italic=spec.get('italic', False))
+            if 'size' in spec:
+                props['font_size'] = spec['size']
+            if 'color' in spec:
+                props['font_color'] = '#' + spec['color']
+        if fill:
+            props.update(pattern=1, bg_color='#' + FILLS[fill])
+        if number_format:
+            props['num_format'] = number_format
+        if alignment:
+            props['align'] = ALIGNMENTS[alignment]['horizontal']
+        formats[key] = wb.add_format(props) if props else None
+
+    for col, width in layout.column_widths.items():
+        index = column_index_from_string(col) - 1
+        ws.set_column(index, index, width)
+
+    with stage_timing.stage('cells'):
+        for row, cells in layout.rows():
+            for col, cell in cells:
+                r, c, fmt, value = row - 1, col - 1, formats[cell.style_key], cell.value
+                if value is None:
+                    ws.write_blank(r, c, None, fmt)
+                elif isinstance(value, str) and value.startswith('='):
+                    result = cached.get(f'{get_column_letter(col)}{row}')
+                    ws.write_formula(r, c, value, fmt, str(result) if isinstance(result, str) else result)
+                elif isinstance(value, str):
+                    ws.write_string(r, c, value, fmt)
+                else:
+                    ws.write_number(r, c, value, fmt)
+
+    with stage_timing.stage('zip'):
+        wb.close()
+
+
+# ----------------------------------------------------------------------------
+# Direct SpreadsheetML writer
+# ----------------------------------------------------------------------------
+_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_ATTR_ENTITIES = {'"': '&quot;'}
+
+
+def _content_types(sheet_count=1):
+    """[Content_Types].xml for a workbook of sheet1.xml .. sheet{sheet_count}.xml."""
+    return (
+        _XML_HEADER
+        + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        + ''.join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+                  'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                  for i in range(1, sheet_count + 1))
+        + '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    )
+
+
+_ROOT_RELS = (
+    _XML_HEADER
+    + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="xl/workbook.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>'
+)
+
+
+def _workbook_rels(sheet_count=1):
+    """xl/_rels/workbook.xml.rels: rId1..rId{sheet_count} for the sheets, then the styles."""
+    return (
+        _XML_HEADER
+        + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        + ''.join(f'<Relationship Id="rId{i}" Target="worksheets/sheet{i}.xml" '
+                  'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+                  for i in range(1, sheet_count + 1))
+        + f'<Relationship Id="rId{sheet_count + 1}" Target="styles.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+        '</Relationships>'
+    )
+
+
+def _workbook_xml(titles):
+    """xl/workbook.xml listing a sheet per title, in order."""
+    sheets = ''.join(f'<sheet name="{escape(title, _ATTR_ENTITIES)}" sheetId="{i}" r:id="rId{i}"/>'
+                     for i, title in enumerate(titles, start=1))
+    return (
+        _XML_HEADER
+        + f'<workbook xmlns="{_MAIN_NS}" xmlns:r="{_REL_NS}">'
+        f'<bookViews><workbookView/></bookViews><sheets>{sheets}</sheets>'
+        '<calcPr calcId="124519"/></workbook>'
+    )
+
+
+def _xml_font(font):
+    spec = FONTS[font] if font else {}
+    parts = ['<font>']
+    if spec.get('bold'):
+        parts.append('<b/>')
+    if spec.get('italic'):
+        parts.append('<i/>')
+    parts.append(f'<sz val="{spec.get("size", 11)}"/>')
+    if 'color' in spec:
+        parts.append(f'<color rgb="FF{spec["color"]}"/>')
+    parts.append('<name val="Calibri"/><family val="2"/></font>')
+    return ''.join(parts)
+
+
+def _xml_styles(style_keys):
+    """styles.xml for the given style keys; returns (xml, {style_key: xf index})."""
+    fonts, fills, num_fmts, xfs = [None], [], {}, []
+    xf_index = {}
+    for key in style_keys:
+        font, fill, number_format, alignment = key
+        if key == (None, None, None, None):
+            xf_index[key] = 0
+            continue
+        if font not in fonts:
+            fonts.append(font)
+        if fill and fill not in fills:
+            fills.append(fill)
+        fmt_id = BUILTIN_FORMATS_REVERSE.get(number_format or 'General')
+        if fmt_id is None:
+            fmt_id = num_fmts.setdefault(number_format, 164 + len(num_fmts))
+        attrs = (f'numFmtId="{fmt_id}" fontId="{fonts.index(font)}" '
+                 f'fillId="{fills.index(fill) + 2 if fill else 0}" borderId="0" xfId="0" '
+                 'applyNumberFormat="1" applyFont="1" applyFill="1"')
+        if alignment:
+            align = ' '.join(f'{k}="{v}"' for k, v in ALIGNMENTS[alignment].items())
+            xfs.append(f'<xf {attrs} applyAlignment="1"><alignment {align}/></xf>')
+        else:
+            xfs.append(f'<xf {attrs}/>')
+        xf_index[key] = len(xfs)
+
+    xml = [_XML_HEADER, f'<styleSheet xmlns="{_MAIN_NS}">']
+    if num_fmts:
+        xml.append(f'<numFmts count="{len(num_fmts)}">')
+        xml.extend(f'<numFmt numFmtId="{i}" formatCode="{escape(code, _ATTR_ENTITIES)}"/>'
+                   for code, i in num_fmts.items())
+        xml.append('</numFmts>')
+    xml.append(f'<fonts count="{len(fonts)}">{"".join(_xml_font(f) for f in fonts)}</fonts>')
+    xml.append(f'<fills count="{len(fills) + 2}">'
+               '<fill><patternFill patternType="none"/></fill>'
+               '<fill><patternFill patternType="gray125"/></fill>')
+    xml.extend(f'<fill><patternFill patternType="solid"><fgColor rgb="FF{FILLS[f]}"/>'
+               f'<bgColor rgb="FF{FILLS[f]}"/></patternFill></fill>' for f in fills)
+    xml.append('</fills>')
+    xml.append('<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>')
+    xml.append('<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>')
+    xml.append(f'<cellXfs count="{len(xfs) + 1}"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>')
+    xml.extend(xfs)
+    xml.append('</cellXfs>')
+    xml.append('<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>')
+    xml.append('</styleSheet>')
+    return ''.join(xml), xf_index
+
+
+def _xml_formula_cell(ref, attrs, formula_xml, cached, f_attrs=''):
+    """A formula <c> element with its cached value (a number, text, boolean or error).
+
+    A formula_xml of None writes an empty <f/>, for cells sharing another cell's formula.
+    """
+    f = f'<f{f_attrs}/>' if formula_xml is None else f'<f{f_attrs}>{formula_xml}</f>'
+    if cached is None:
+        return f'<c r="{ref}"{attrs}>{f}</c>'
+    if isinstance(cached, sheet_formulas.CellError):
+        return f'<c r="{ref}"{attrs} t="e">{f}<v>{escape(cached)}</v></c>'
+    if isinstance(cached, str):
+        return f'<c r="{ref}"{attrs} t="str">{f}<v>{escape(cached)}</v></c>'
+    if isinstance(cached, bool):
+        return f'<c r="{ref}"{attrs} t="b">{f}<v>{int(cached)}</v></c>'
+    return f'<c r="{ref}"{attrs}>{f}<v>{float(cached)!r}</v></c>'
+
+
+def _xml_cell(ref, value, style, cached=None, shared=None):
+    """One <c> element: formula (with its cached value), inline string or number.
+
+    shared is the cell's SheetLayout.shared_formulas entry, if it has one.
+    """
+    s = f' s="{style}"' if style else ''
+    if value is None:
+        return f'<c r="{ref}"{s}/>'
+    if isinstance(value, sheet_formulas.CellError):
+        return f'<c r="{ref}"{s} t="e"><v>{escape(value)}</v></c>'
+    if isinstance(value, str):
+        if value.startswith('='):
+            if shared is None:
+                return _xml_formula_cell(ref, s, escape(value[1:]), cached)
+            index, span = shared
+            if span is None:
+                return _xml_formula_cell(ref, s, None, cached, f' t="shared" si="{index}"')
+            return _xml_formula_cell(ref, s, escape(value[1:]), cached, f' t="shared" ref="{span}" si="{index}"')
+        return f'<c r="{ref}"{s} t="inlineStr"><is><t xml:space="preserve">{escape(value)}</t></is></c>'
+    if isinstance(value, (bool, np.bool_)):
+        return f'<c r="{ref}"{s} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, np.integer)):
+        return f'<c r="{ref}"{s}><v>{int(value)}</v></c>'
+    return f'<c r="{ref}"{s}><v>{float(value)!r}</v></c>'
+
+
+def _xml_sheet_rows(layout, xf_index, holes=(), cached=None):
+    """Yield the worksheet XML a row at a time.
+
+    cached holds the formula values to write. Cells listed in holes are yielded
+    as (ref, style) tuples instead of XML so a CompiledTemplate can fill them in later.
+    """
+    cached = cached or {}
+    yield _XML_HEADER + f'<worksheet xmlns="{_MAIN_NS}" xmlns:r="{_REL_NS}">'
+    if layout.column_widths:
+        cols = sorted((column_index_from_string(c), w) for c, w in layout.column_widths.items())
+        yield '<cols>' + ''.join(
+            f'<col min="{i}" max="{i}" width="{w}" customWidth="1"/>' for i, w in cols) + '</cols>'
+    yield '<sheetData>'
+    for row, cells in layout.rows():
+        xml = [f'<row r="{row}">']
+        for col, cell in cells:
+            ref = f'{get_column_letter(col)}{row}'
+            if ref in holes:
+                yield ''.join(xml)
+                yield (ref, xf_index[cell.style_key])
+                xml = []
+            else:
+                xml.append(_xml_cell(ref, cell.value, xf_index[cell.style_key], cached.get(ref),
+                                     layout.shared_formulas.get(ref)))
+        xml.append('</row>')
+        yield ''.join(xml)
+    yield '</sheetData></worksheet>'
+
+
+def _xml_static_parts(layout):
+    """Every zip member except the worksheet; returns ({name: xml}, {style_key: xf index})."""
+    styles_xml, xf_index = _xml_styles(layout.style_keys())
+    parts = {
+        '[Content_Types].xml': _content_types(),
+        '_rels/.rels': _ROOT_RELS,
+        'xl/workbook.xml': _workbook_xml([layout.title]),
+        'xl/_rels/workbook.xml.rels': _workbook_rels(),
+        'xl/styles.xml': styles_xml,
+    }
+    return parts, xf_index
+
+
+def _sheet_zipinfo(name='xl/worksheets/sheet1.xml'):
+    info = zipfile.ZipInfo(name, datetime.now().timetuple()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+class ChunkSink:
+    """Write-only file object that hands out whatever zipfile has written so far.
+
+    It can't seek, so zipfile writes each member's sizes in a trailing data
+    descriptor instead of going back to patch its header.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+# Uncompressed sheet XML handed to the deflater per write when streaming
+STREAM_CHUNK = 16 * 1024
+
+
+def _stream_member(zf, sink, info, pieces):
+    """Deflate the XML pieces into a new zip member, yielding the sink's bytes as they build up."""
+    # zipfile only applies the archive's compresslevel to members opened by name
+    info._compresslevel = zf.compresslevel
+    with zf.open(info, 'w') as member:
+        pending, size = [], 0
+        for piece in stage_timing.timed(pieces, 'cells'):
+            pending.append(piece)
+            size += len(piece)
+            if size >= STREAM_CHUNK:
+                with stage_timing.stage('zip'):
+                    member.write(''.join(pending).encode('utf-8'))
+                pending, size = [], 0
+                if sink.buffer:
+                    yield sink.take()
+        with stage_timing.stage('zip'):
+            member.write(''.join(pending).encode('utf-8'))
+
+
+def _stream_zip(parts, sheet_pieces, compresslevel=None):
+    """Yield a workbook zip as it's produced: the static parts, then the sheet as it's deflated."""
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+        with stage_timing.stage('zip'):
+            for name, xml in parts.items():
+                zf.writestr(name, xml)
+        yield sink.take()
+
+        yield from _stream_member(zf, sink, _sheet_zipinfo(), sheet_pieces)
+    yield sink.take()
+
+
+def iter_render_direct(layout):
+    """render_direct as a generator of zip bytes (see _stream_zip)."""
+    parts, xf_index = _xml_static_parts(layout)
+    yield from _stream_zip(parts, _xml_sheet_rows(layout, xf_index, cached=layout.formula_values()))
+
+
+def render_direct(layout, output):
+    """Write the SpreadsheetML parts straight into the zip, streaming the sheet row by row.
+
+    Skips openpyxl's object model and XML tree serializer entirely, which is
+    where nearly all of the time goes for a sheet this size.
+    """
+    parts, xf_index = _xml_static_parts(layout)
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zf:
+        with stage_timing.stage('zip'):
+            for name, xml in parts.items():
+                zf.writestr(name, xml)
+        with zf.open(_sheet_zipinfo(), 'w') as sheet:
+            rows = _xml_sheet_rows(layout, xf_index, cached=layout.formula_values())
+            for chunk in stage_timing.timed(rows, 'cells'):
+                with stage_timing.stage('zip'):
+                    sheet.write(chunk.encode('utf-8'))
+
+
+BACKENDS = {
+    'openpyxl': render_openpyxl,
+    'openpyxl-write-only': render_openpyxl_write_only,
+    'xlsxwriter': render_xlsxwriter,
+    'direct': render_direct,
+}
+
+
+def render(layout, output, backend='direct'):
+    """Write a SheetLayout to a path or file-like object with the chosen backend."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown workbook backend '{backend}' (choose from {', '.join(BACKENDS)})")
+    BACKENDS[backend](layout, output)
+    return output
+
+
+# ============================================================================
+# PRECOMPILED TEMPLATE
+# ============================================================================
+# The only cells that differ between listings: name, historical royalties,
+# base year and the fiscal year the projection starts from
+INPUT_CELLS = {
+    'B5': 'royalty_name',
+    'B8': 'year_minus_3',
+    'B9': 'year_minus_2',
+    'B10': 'year_minus_1',
+    'B11': 'ytd',
+    'B13': 'base_year',
+    'B23': 'fiscal_year',
+}
+
+
+class CompiledTemplate:
+    """The valuation workbook rendered once, with holes left for the input and formula cells.
+
+    The static zip members are compressed once, and the worksheet XML is kept
+    as literal segments around the holes, each hole with its markup up to the
+    value already formatted. Producing a workbook only evaluates the
+    precompiled formulas on the input cells and the constants they read,
+    formats the values, joins the segments and deflates the one sheet member.
+
+    Each SensitivityConfig needs its own template; sensitivity tables not in
+    'formulas' mode are left as holes and evaluated a table at a time.
+    """
+
+    def __init__(self, sensitivity=None):
+        layout = build_valuation_layout("", 0, 0, 0, 0, 0, sensitivity=sensitivity)
+        parts, xf_index = _xml_static_parts(layout)
+        self.style_keys = layout.style_keys()
+        self.grids = layout.grids
+        self.shared_formulas = layout.shared_formulas
+        grid_refs = {ref for grid in self.grids for refs in grid['refs'] for ref in refs}
+        self.values = {ref: cell.value for ref, cell in layout.cells.items()}
+        formula_values = {ref: value for ref, value in self.values.items() if ref not in grid_refs}
+        self.formulas = {ref: escape(value[1:]) for ref, value in formula_values.items()
+                         if isinstance(value, str) and value.startswith('=')}
+        self.evaluate = sheet_formulas.compile_sheet(sheet_formulas.formula_cells(formula_values))
+        # The only constant cells evaluation reads, so rendering doesn't copy the whole sheet
+        self.constants = {ref: self.values.get(ref) for ref in {*self.evaluate.reads, *_SENSITIVITY_INPUTS}
+                          if ref not in INPUT_CELLS}
+
+        static_zip = io.BytesIO()
+        with zipfile.ZipFile(static_zip, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, xml in parts.items():
+                zf.writestr(name, xml)
+        self.static_zip = static_zip.getvalue()
+
+        self.parts = parts
+
+        # Merge adjacent literal chunks so rendering joins as few pieces as possible
+        self.segments = []
+        holes = INPUT_CELLS.keys() | self.formulas.keys() | grid_refs
+        for part in _xml_sheet_rows(layout, xf_index, holes=holes):
+            if isinstance(part, tuple):
+                self.segments.append(self._hole(*part))
+            elif self.segments and isinstance(self.segments[-1], str):
+                self.segments[-1] += part
+            else:
+                self.segments.append(part)
+
+    def _hole(self, ref, style):
+        """(kind, ref, style, extra) for a hole.
+
+        extra is the input name for input cells, the SheetLayout.shared_formulas
+        entry for shared formulas, and otherwise the <c> element up to its value.
+        """
+        attrs = f' s="{style}"' if style else ''
+        if ref in INPUT_CELLS:
+            return 'input', ref, style, INPUT_CELLS[ref]
+        if ref in self.formulas:
+            return 'formula', ref, style, f'<c r="{ref}"{attrs}><f>{self.formulas[ref]}</f><v>'
+        if ref in self.shared_formulas:
+            return 'shared', ref, style, self.shared_formulas[ref]
+        return 'grid', ref, style, f'<c r="{ref}"{attrs}><v>'
+
+    def evaluate_inputs(self, inputs):
+        """(cell values, cached formula values) of the sheet for one listing's inputs.
+
+        The cell values are the inputs and the constant cells the formulas read.
+        """
+        values = {ref: inputs[name] for ref, name in INPUT_CELLS.items()}
+        values.update(self.constants)
+        return values, self.evaluate(values)
+
+    def sheet_pieces(self, inputs, evaluated=None):
+        """The worksheet XML for one listing's inputs, as the literal segments and filled holes.
+
+        evaluated is evaluate_inputs(inputs), for callers that already have it.
+        """
+        values, cached = evaluated or self.evaluate_inputs(inputs)
+        grid_values = _sensitivity_values(self.grids, values)
+
+        for part in self.segments:
+            if part.__class__ is str:
+                yield part
+                continue
+            kind, ref, style, extra = part
+            if kind == 'formula':
+                value = cached[ref]
+                # Nearly every cached value is a float; anything else goes through the general writer
+                yield (f'{extra}{value!r}</v></c>' if value.__class__ is float else
+                       _xml_formula_cell(ref, f' s="{style}"' if style else '', self.formulas[ref], value))
+            elif kind == 'grid':
+                value = grid_values[ref]
+                yield f'{extra}{value!r}</v></c>' if value.__class__ is float else _xml_cell(ref, value, style)
+            elif kind == 'shared':
+                yield _xml_cell(ref, self.values[ref], style, grid_values[ref], extra)
+            else:
+                yield _xml_cell(ref, inputs[extra], style)
+
+    def sheet_xml(self, inputs):
+        return ''.join(self.sheet_pieces(inputs))
+
+    @staticmethod
+    def _inputs(royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year, fiscal_year=None):
+        return {
+            'royalty_name': royalty_name,
+            'year_minus_3': year_minus_3,
+            'year_minus_2': year_minus_2,
+            'year_minus_1': year_minus_1,
+            'ytd': ytd,
+            'base_year': base_year,
+            'fiscal_year': fiscal_year or datetime.now().year,
+        }
+
+    def render(self, output, royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year,
+               fiscal_year=None):
+        """Write a workbook for one listing to a path or file-like object."""
+        inputs = self._inputs(royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year,
+                              fiscal_year)
+        with stage_timing.stage('cells'):
+            xml = self.sheet_xml(inputs)
+        buffer = io.BytesIO(self.static_zip)
+        with stage_timing.stage('zip'), zipfile.ZipFile(buffer, 'a') as zf:
+            # Fastest deflate level: ~3x quicker than the default for ~20% more bytes
+            zf.writestr(_sheet_zipinfo(), xml, compresslevel=1)
+
+        _write_bytes(output, buffer.getvalue())
+        return output
+
+    def iter_render(self, royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year,
+                    fiscal_year=None):
+        """Yield a workbook for one listing as zip bytes, as they are produced.
+
+        The static parts go out first; the sheet is deflated and sent in pieces.
+        """
+        inputs = self._inputs(royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year,
+                              fiscal_year)
+        yield from _stream_zip(self.parts, self.sheet_pieces(inputs), compresslevel=1)
+
+
+# Compiled templates kept per process, one per SensitivityConfig in use
+MAX_COMPILED_TEMPLATES = 8
+_compiled_templates = {}
+
+
+def compiled_template(sensitivity=None):
+    """The process-wide CompiledTemplate for a SensitivityConfig, built on first use."""
+    sensitivity = sensitivity or SensitivityConfig()
+    template = _compiled_templates.get(sensitivity)
+    if template is None:
+        if len(_compiled_templates) >= MAX_COMPILED_TEMPLATES:
+            # Drop the oldest; the default config is usually the first and stays in use
+            _compiled_templates.pop(next(iter(_compiled_templates)), None)
+        template = _compiled_templates[sensitivity] = CompiledTemplate(sensitivity)
+    return template
+
+
+def write_valuation_workbook(output, royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year,
+                             backend=DEFAULT_BACKEND, monte_carlo=None, sensitivity=None):
+    """Write a listing's valuation workbook with any backend, including 'template'.
+
+    sensitivity is a SensitivityConfig for the sensitivity tables (defaults when None).
+    """
+    if backend == 'template':
+        if monte_carlo is None:
+            return compiled_template(sensitivity).render(
+                output, royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year)
+        # The Monte Carlo section isn't part of the precompiled sheet
+        backend = 'direct'
+    with stage_timing.stage('layout'):
+        layout = build_valuation_layout(royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year,
+                                        monte_carlo, sensitivity)
+    return render(layout, output, backend)
+
+
+def iter_valuation_workbook(royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year,
+                            backend=DEFAULT_BACKEND, monte_carlo=None, sensitivity=None):
+    """write_valuation_workbook as a generator of zip bytes, yielded as the workbook is written.
+
+    'template' and 'direct' really stream; the other backends need a seekable
+    file, so their finished workbook is yielded in STREAM_CHUNK pieces.
+    """
+    if backend == 'template':
+        if monte_carlo is None:
+            yield from compiled_template(sensitivity).iter_render(
+                royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year)
+            return
+        backend = 'direct'
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown workbook backend '{backend}' (choose from {', '.join(BACKENDS)})")
+    with stage_timing.stage('layout'):
+        layout = build_valuation_layout(royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year,
+                                        monte_carlo, sensitivity)
+    if backend == 'direct':
+        yield from iter_render_direct(layout)
+        return
+    data = render(layout, io.BytesIO(), backend).getvalue()
+    for start in range(0, len(data), STREAM_CHUNK):
+        yield data[start:start + STREAM_CHUNK]
+
+
+# ============================================================================
+# PORTFOLIO WORKBOOK
+# ============================================================================
+PORTFOLIO_SUMMARY_TITLE = "Portfolio Summary"
+# Excel's limit on sheet name length, and the characters it doesn't allow in them
+MAX_SHEET_TITLE = 31
+_INVALID_TITLE_CHARS = re.compile(r"[\[\]:*?/\\]")
+# Summary table columns: heading and number format
+PORTFOLIO_COLUMNS = (
+    ("Listing", None),
+    ("Base Year CF", '$#,##0'),
+    ("Bear Value", '$#,##0'),
+    ("Base Value", '$#,##0'),
+    ("Bull Value", '$#,##0'),
+    ("Weighted Value", '$#,##0'),
+    ("EV / Base Year CF", '0.0x'),
+    ("DCF Enterprise Value", '$#,##0'),
+)
+# Row of the first listing in the summary table (below the title and headings)
+PORTFOLIO_FIRST_ROW = 5
+
+
+def _sheet_title(name, used):
+    """A valid sheet name for a listing, unique (ignoring case) among used; adds it to used."""
+    base = _INVALID_TITLE_CHARS.sub('_', str(name)).strip().strip("'") or "Listing"
+    title, n = base[:MAX_SHEET_TITLE], 2
+    while title.lower() in used:
+        suffix = f" ({n})"
+        title, n = base[:MAX_SHEET_TITLE - len(suffix)] + suffix, n + 1
+    used.add(title.lower())
+    return title
+
+
+def _cell_math(fn, *operands):
+    """fn(*operands), or the error Excel would show instead: the first error operand, or #DIV/0!."""
+    for value in operands:
+        if isinstance(value, sheet_formulas.CellError):
+            return value
+    try:
+        return fn(*operands)
+    except ZeroDivisionError:
+        return sheet_formulas.CellError('#DIV/0!')
+
+
+def _portfolio_values(values, cached):
+    """A listing's summary row values (base CF .. DCF enterprise value) from its evaluated sheet."""
+    def cell(ref):
+        return cached[ref] if ref in cached else float(values[ref] or 0)
+
+    base_cf, bear, base, bull, weighted, multiple, enterprise = (
+        cell(ref) for ref in ('B13', 'F16', 'G16', 'H16', WEIGHTED_VALUE_CELL, EV_MULTIPLE_CELL, 'B36'))
+    return [base_cf, bear, base, bull, weighted, multiple, enterprise]
+
+
+def _portfolio_summary(listings, errors=None):
+    """The summary sheet for [(sheet title, listing name, _portfolio_values())], with its cached values.
+
+    Each row links to its listing's sheet, so the summary follows edits to
+    the listing sheets' inputs.
+    """
+    ws = SheetLayout(PORTFOLIO_SUMMARY_TITLE)
+    cached = {}
+    ws['A1'] = "PORTFOLIO SUMMARY"
+    ws['A1'].font = 'title'
+    ws['A2'] = f"{len(listings)} listings valued {datetime.now().strftime('%Y-%m-%d')}"
+    ws['A2'].font = 'subtitle'
+
+    header_row = PORTFOLIO_FIRST_ROW - 1
+    for i, (heading, _) in enumerate(PORTFOLIO_COLUMNS):
+        ref = f'{get_column_letter(i + 1)}{header_row}'
+        ws[ref] = heading
+        ws[ref].font = 'header'
+
+    def put(ref, formula, value, number_format, font=None):
+        ws[ref] = formula
+        ws[ref].number_format = number_format
+        ws[ref].font = font
+        cached[ref] = value
+
+    row = PORTFOLIO_FIRST_ROW
+    for row, (title, name, values) in enumerate(listings, start=PORTFOLIO_FIRST_ROW):
+        sheet = "'" + title.replace("'", "''") + "'!"
+        formulas = (
+            f"={sheet}B13", f"={sheet}F16", f"={sheet}G16", f"={sheet}H16",
+            f"={sheet}{WEIGHTED_VALUE_CELL}", f"={sheet}{EV_MULTIPLE_CELL}",
+            f"={sheet}B36",
+        )
+        ws[f'A{row}'] = name
+        for i, (formula, value) in enumerate(zip(formulas, values)):
+            put(f'{get_column_letter(i + 2)}{row}', formula, value, PORTFOLIO_COLUMNS[i + 1][1])
+
+    if listings:
+        last, total_row = row, row + 1
+        ws[f'A{total_row}'] = "Portfolio Total"
+        ws[f'A{total_row}'].font = 'bold'
+        for i in (0, 1, 2, 3, 4, 6):
+            col = get_column_letter(i + 2)
+            total = _cell_math(lambda *v: sum(v), *(values[i] for _, _, values in listings))
+            put(f'{col}{total_row}', f"=SUM({col}{PORTFOLIO_FIRST_ROW}:{col}{last})", total,
+                PORTFOLIO_COLUMNS[i + 1][1], 'bold')
+        multiple = _cell_math(lambda v, b: v / b, cached[f'F{total_row}'], cached[f'B{total_row}'])
+        put(f'G{total_row}', f"=F{total_row}/B{total_row}", multiple, PORTFOLIO_COLUMNS[6][1], 'bold')
+        row = total_row
+
+    if errors:
+        row += 2
+        ws[f'A{row}'] = "NOT VALUED"
+        ws[f'A{row}'].font = 'section'
+        for row, message in enumerate(errors, start=row + 1):
+            ws[f'A{row}'] = message
+            ws[f'A{row}'].font = 'note'
+
+    ws.column_widths['A'] = 36
+    for i in range(1, len(PORTFOLIO_COLUMNS)):
+        ws.column_widths[get_column_letter(i + 1)] = 20
+    return ws, cached
+
+
+def iter_portfolio_workbook(listings, sensitivity=None, errors=None):
+    """Yield one workbook for many listings as zip bytes: a summary sheet, then a sheet per listing.
+
+    listings is an iterable of (royalty_name, inputs), inputs holding
+    year_minus_3 .. base_year as returned by statement_reader.yearly_inputs().
+    It's consumed lazily: each listing's sheet is rendered from the compiled
+    template and deflated into the zip before the next is read, and every
+    sheet shares the one styles part, so memory doesn't grow with the number
+    of listings beyond a row of summary values each.
+
+    errors, if given, is a list of messages for statements that couldn't be
+    valued. It's read once listings is exhausted (so the generator feeding
+    listings can fill it in) and listed below the summary table.
+    """
+    template = compiled_template(sensitivity)
+    sink = ChunkSink()
+    used = {PORTFOLIO_SUMMARY_TITLE.lower()}
+    rows = []
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        # Listing sheets are sheet2.xml onwards; the summary (sheet1.xml) is written last
+        for royalty_name, inputs in listings:
+            title = _sheet_title(royalty_name, used)
+            inputs = CompiledTemplate._inputs(royalty_name, **inputs)
+            evaluated = template.evaluate_inputs(inputs)
+            info = _sheet_zipinfo(f'xl/worksheets/sheet{len(rows) + 2}.xml')
+            yield from _stream_member(zf, sink, info, template.sheet_pieces(inputs, evaluated))
+            rows.append((title, royalty_name, _portfolio_values(*evaluated)))
+            yield sink.take()
+
+        summary, cached = _portfolio_summary(rows, errors)
+        # The template's styles come first so its precompiled style indexes stay valid
+        extra = [key for key in summary.style_keys() if key not in template.style_keys]
+        styles_xml, xf_index = _xml_styles(template.style_keys + extra)
+        yield from _stream_member(zf, sink, _sheet_zipinfo(), _xml_sheet_rows(summary, xf_index, cached=cached))
+
+        titles = [summary.title] + [title for title, _, _ in rows]
+        with stage_timing.stage('zip'):
+            zf.writestr('xl/styles.xml', styles_xml)
+            zf.writestr('xl/workbook.xml', _workbook_xml(titles))
+            zf.writestr('xl/_rels/workbook.xml.rels', _workbook_rels(len(titles)))
+            zf.writestr('_rels/.rels', _ROOT_RELS)
+            zf.writestr('[Content_Types].xml', _content_types(len(titles)))
+    yield sink.take()
+
+
+def write_portfolio_workbook(output, listings, sensitivity=None, errors=None):
+    """Write iter_portfolio_workbook() to a path or file-like object as it's produced."""
+    if hasattr(output, 'write'):
+        for chunk in iter_portfolio_workbook(listings, sensitivity, errors):
+            output.write(chunk)
+    else:
+        with open(output, 'wb') as f:
+            for chunk in iter_portfolio_workbook(listings, sensitivity, errors):
+                f.write(chunk)
+    return output
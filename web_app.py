@@ -4,17 +4,87 @@ Music Royalty Valuation Tool - Web Version
 Run this file and open the URL in any browser (including on your phone).
 """
 
-from flask import Flask, request, send_file, render_template_string
+from flask import Flask, Request, Response, g, request, send_file, render_template_string, jsonify, url_for, stream_with_context
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
 import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-from openpyxl.utils import get_column_letter
 from datetime import datetime
+from urllib.parse import quote
+import job_queue
+import marketplace
+import result_cache
+import stage_timing
+import statement_reader
+import valuation_engine as engine
+import valuation_index
+import valuation_workbook
 import os
+import cProfile
+import csv
 import io
 import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unicodedata
+import zipfile
+
+# Largest accepted request in MB (0 = no limit); bigger uploads get a 413
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 1024))
+
+# Uploads over this many MB are spooled to a temporary file (in UPLOAD_DIR, default
+# the system temp folder) and parsed from a memory map instead of held in memory
+UPLOAD_SPOOL_BYTES = int(float(os.environ.get('UPLOAD_SPOOL_MB', 1)) * 1024 * 1024)
+UPLOAD_DIR = os.environ.get('UPLOAD_DIR') or None
+
+
+class SpoolingRequest(Request):
+    """Request whose file uploads go to named temporary files once they pass UPLOAD_SPOOL_BYTES.
+
+    A named file can be handed to the statement readers by path, which parse
+    it through a memory map, so a worker never holds a large statement in memory.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is None or total_content_length > UPLOAD_SPOOL_BYTES:
+            return tempfile.NamedTemporaryFile('wb+', prefix='royalty-upload-', dir=UPLOAD_DIR)
+        return io.BytesIO()
+
 
 app = Flask(__name__)
+app.request_class = SpoolingRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024 or None
+
+# Workbook writer for downloads; the precompiled template only patches the input cells
+WORKBOOK_BACKEND = os.environ.get('WORKBOOK_BACKEND', 'template')
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Finished workbooks keyed by upload contents; set RESULT_CACHE_DIR to add a disk tier
+RESULT_CACHE = result_cache.ResultCache(
+    max_items=int(os.environ.get('RESULT_CACHE_ITEMS', 256)),
+    disk_dir=os.environ.get('RESULT_CACHE_DIR') or None,
+    disk_max_bytes=int(os.environ.get('RESULT_CACHE_DISK_MB', 1024)) * 1024 * 1024,
+)
+
+# CSV parser for uploads (statement_reader.CSV_ENGINES); 'pyarrow' uses every core
+CSV_ENGINE = os.environ.get('CSV_ENGINE', 'c')
+
+# Every generated valuation is recorded here for /valuations queries
+VALUATION_INDEX = valuation_index.ValuationIndex(
+    os.environ.get('VALUATION_INDEX_DB') or os.path.join(tempfile.gettempdir(), 'royalty-valuations.sqlite3'))
+
+# Requests taking longer than PROFILE_SLOW_MS get their cProfile stats dumped to
+# PROFILE_DIR (0 = off; while on, every request runs under the profiler)
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'royalty-valuation-profiles')
+
+# Per-request stage timings, aggregated for /metrics (per process: each worker has its own)
+STAGE_SECONDS = stage_timing.Histogram(
+    'royalty_stage_seconds', 'Time spent in each stage of a request.', ('endpoint', 'stage'))
+REQUEST_SECONDS = stage_timing.Histogram(
+    'royalty_request_seconds', 'Request time, including streaming the response.', ('endpoint', 'status'))
 
 # HTML Template - Mobile-friendly
 HTML_TEMPLATE = """
@@ -156,6 +226,49 @@ HTML_TEMPLATE = """
         .success.show {
             display: block;
         }
+        .preview {
+            background: #f8f9ff;
+            border: 1px solid #e3e7ff;
+            padding: 14px 16px;
+            border-radius: 8px;
+            margin-bottom: 20px;
+            font-size: 13px;
+            color: #444;
+            display: none;
+        }
+        .preview.show {
+            display: block;
+        }
+        .preview .headline {
+            font-size: 22px;
+            font-weight: bold;
+            color: #333;
+            margin: 2px 0 10px 0;
+        }
+        .preview table {
+            width: 100%;
+            border-collapse: collapse;
+        }
+        .preview td {
+            padding: 3px 0;
+        }
+        .preview td:last-child {
+            text-align: right;
+        }
+        .option {
+            display: flex;
+            justify-content: space-between;
+            align-items: center;
+            font-size: 13px;
+            color: #555;
+            margin-bottom: 20px;
+        }
+        .option select {
+            padding: 6px 8px;
+            border: 1px solid #ddd;
+            border-radius: 6px;
+            font-size: 13px;
+        }
         .loading {
             display: none;
             text-align: center;
@@ -212,13 +325,30 @@ HTML_TEMPLATE = """
                 <div class="upload-text">Tap to select your CSV file</div>
                 <div class="upload-hint">or drag and drop here</div>
             </div>
-            <input type="file" name="file" id="fileInput" accept=".csv,.xlsx">
+            <input type="file" name="file" id="fileInput" accept=".csv,.xlsx,.parquet,.arrow,.feather,.zip" multiple>
 
             <div class="file-name" id="fileName">
                 <span id="fileNameText"></span>
                 <button type="button" id="clearFile">&times;</button>
             </div>
 
+            <label class="option" for="baseYearMethod">
+                Base year
+                <select name="base_year_method" id="baseYearMethod">
+                    <option value="last_year">Last full year</option>
+                    <option value="ttm">Trailing 12 months</option>
+                    <option value="annualized_ytd">Annualized YTD</option>
+                    <option value="seasonal">Seasonally adjusted YTD</option>
+                </select>
+            </label>
+
+            <label class="option" for="portfolio">
+                Several statements: one portfolio workbook
+                <input type="checkbox" name="portfolio" id="portfolio" value="1">
+            </label>
+
+            <div class="preview" id="preview"></div>
+
             <div class="loading" id="loading">
                 <div class="spinner"></div>
                 <div>Generating valuation...</div>
@@ -247,9 +377,43 @@ HTML_TEMPLATE = """
         const clearFile = document.getElementById('clearFile');
         const submitBtn = document.getElementById('submitBtn');
         const uploadForm = document.getElementById('uploadForm');
+        const baseYearMethod = document.getElementById('baseYearMethod');
+        const portfolio = document.getElementById('portfolio');
         const loading = document.getElementById('loading');
         const errorDiv = document.getElementById('error');
         const successDiv = document.getElementById('success');
+        const previewDiv = document.getElementById('preview');
+
+        const money = (v) => v === null ? '-' : '$' + v.toLocaleString(undefined, {maximumFractionDigits: 0});
+
+        // Instant preview of the valuation from the JSON API while the user decides to download
+        async function showPreview() {
+            previewDiv.classList.remove('show');
+            const file = fileInput.files[0];
+            if (fileInput.files.length !== 1 || file.name.toLowerCase().endsWith('.zip')) return;
+
+            const formData = new FormData();
+            formData.append('file', file);
+            formData.append('base_year_method', baseYearMethod.value);
+            try {
+                const response = await fetch('/api/valuation', {method: 'POST', body: formData});
+                if (!response.ok || fileInput.files[0] !== file) return;
+                const data = await response.json();
+                const years = Object.entries(data.yearly)
+                    .map(([year, amount]) => `<tr><td>${year}</td><td>${money(amount)}</td></tr>`).join('');
+                previewDiv.innerHTML = `
+                    <div>Weighted valuation</div>
+                    <div class="headline">${money(data.weighted_value)}</div>
+                    <table>
+                        <tr><td>Bear / Base / Bull</td><td>${money(data.scenarios.bear.implied_value)} / ${money(data.scenarios.base.implied_value)} / ${money(data.scenarios.bull.implied_value)}</td></tr>
+                        <tr><td>EV / Base Year CF</td><td>${data.ev_multiple === null ? '-' : data.ev_multiple.toFixed(1) + 'x'}</td></tr>
+                        ${years}
+                    </table>`;
+                previewDiv.classList.add('show');
+            } catch (err) {
+                // The preview is optional; the download still reports any errors
+            }
+        }
 
         uploadArea.addEventListener('click', () => fileInput.click());
 
@@ -272,20 +436,25 @@ HTML_TEMPLATE = """
         });
 
         fileInput.addEventListener('change', updateFileName);
+        baseYearMethod.addEventListener('change', showPreview);
 
         function updateFileName() {
             if (fileInput.files.length) {
-                fileNameText.textContent = fileInput.files[0].name;
+                fileNameText.textContent = fileInput.files.length > 1
+                    ? `${fileInput.files.length} files selected`
+                    : fileInput.files[0].name;
                 fileName.classList.add('show');
                 uploadArea.style.display = 'none';
                 submitBtn.disabled = false;
                 errorDiv.classList.remove('show');
+                showPreview();
             }
         }
 
         clearFile.addEventListener('click', () => {
             fileInput.value = '';
             fileName.classList.remove('show');
+            previewDiv.classList.remove('show');
             uploadArea.style.display = 'block';
             submitBtn.disabled = true;
         });
@@ -299,9 +468,13 @@ HTML_TEMPLATE = """
             successDiv.classList.remove('show');
 
             const formData = new FormData(uploadForm);
+            // Several statements or a zip go to the bulk endpoint and come back as one zip,
+            // or as one portfolio workbook with a sheet per listing
+            const bulk = fileInput.files.length > 1 || fileInput.files[0].name.toLowerCase().endsWith('.zip');
+            const endpoint = !bulk ? '/process' : portfolio.checked ? '/process/portfolio' : '/process/bulk';
 
             try {
-                const response = await fetch('/process', {
+                const response = await fetch(endpoint, {
                     method: 'POST',
                     body: formData
                 });
@@ -311,7 +484,8 @@ HTML_TEMPLATE = """
                     const url = window.URL.createObjectURL(blob);
                     const a = document.createElement('a');
                     a.href = url;
-                    a.download = response.headers.get('X-Filename') || 'Valuation.xlsx';
+                    a.download = response.headers.get('X-Filename')
+                        || (bulk && !portfolio.checked ? 'Valuations.zip' : 'Valuation.xlsx');
                     document.body.appendChild(a);
                     a.click();
                     window.URL.revokeObjectURL(url);
@@ -323,6 +497,7 @@ HTML_TEMPLATE = """
                     // Reset form
                     fileInput.value = '';
                     fileName.classList.remove('show');
+                    previewDiv.classList.remove('show');
                     uploadArea.style.display = 'block';
                 } else {
                     const text = await response.text();
@@ -342,532 +517,115 @@ HTML_TEMPLATE = """
 """
 
 
-def create_valuation_template(royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year):
-    """Creates the complete valuation template with data populated. Returns bytes."""
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Valuation Model"
-
-    # Define styles
-    edit_font = Font(italic=True, color="0066CC")
-    header_font = Font(bold=True, size=11)
-    section_font = Font(bold=True, size=12)
-    input_fill = PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid")
-    scenario_bear_fill = PatternFill(start_color="FCE4D6", end_color="FCE4D6", fill_type="solid")
-    scenario_base_fill = PatternFill(start_color="DDEBF7", end_color="DDEBF7", fill_type="solid")
-    scenario_bull_fill = PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid")
-    weighted_fill = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
-
-    # TITLE
-    ws['A1'] = "MUSIC ROYALTY DCF VALUATION MODEL"
-    ws['A1'].font = Font(bold=True, size=16)
-    ws['A2'] = "Master Template with Weighted Scenario Analysis"
-    ws['A2'].font = Font(italic=True, size=11, color="666666")
-
-    # DATA INPUT SECTION
-    ws['A4'] = "DATA INPUT"
-    ws['A4'].font = section_font
-
-    ws['A5'] = "Royalty Name/ID:"
-    ws['B5'] = royalty_name
-    ws['B5'].fill = input_fill
-    ws['C5'] = "<- Edit"
-    ws['C5'].font = edit_font
-
-    ws['A7'] = "HISTORICAL ROYALTIES"
-    ws['A7'].font = header_font
-
-    ws['A8'] = "Year -3 Royalties"
-    ws['B8'] = year_minus_3
-    ws['B8'].fill = input_fill
-    ws['B8'].number_format = '#,##0.00'
-    ws['C8'] = "<- Edit"
-    ws['C8'].font = edit_font
-
-    ws['A9'] = "Year -2 Royalties"
-    ws['B9'] = year_minus_2
-    ws['B9'].fill = input_fill
-    ws['B9'].number_format = '#,##0.00'
-    ws['C9'] = "<- Edit"
-    ws['C9'].font = edit_font
-
-    ws['A10'] = "Year -1 Royalties"
-    ws['B10'] = year_minus_1
-    ws['B10'].fill = input_fill
-    ws['B10'].number_format = '#,##0.00'
-    ws['C10'] = "<- Edit"
-    ws['C10'].font = edit_font
-
-    ws['A11'] = "Current YTD Royalties"
-    ws['B11'] = ytd
-    ws['B11'].fill = input_fill
-    ws['B11'].number_format = '#,##0.00'
-    ws['C11'] = "<- Edit"
-    ws['C11'].font = edit_font
-
-    ws['A12'] = "3-Year Average"
-    ws['B12'] = "=AVERAGE(B8:B10)"
-    ws['B12'].number_format = '#,##0.00'
-
-    ws['A13'] = "Base Year Royalties"
-    ws['B13'] = base_year
-    ws['B13'].fill = input_fill
-    ws['B13'].number_format = '#,##0.00'
-    ws['C13'] = "<- Edit (normalized starting CF)"
-    ws['C13'].font = edit_font
-
-    # KEY ASSUMPTIONS
-    ws['A15'] = "KEY ASSUMPTIONS"
-    ws['A15'].font = section_font
-
-    ws['A16'] = "Growth Rate (Years 1-3)"
-    ws['B16'] = 0.05
-    ws['B16'].fill = input_fill
-    ws['B16'].number_format = '0.0%'
-    ws['C16'] = "<- Edit"
-    ws['C16'].font = edit_font
-
-    ws['A17'] = "Growth Rate (Years 4-5)"
-    ws['B17'] = 0.03
-    ws['B17'].fill = input_fill
-    ws['B17'].number_format = '0.0%'
-    ws['C17'] = "<- Edit"
-    ws['C17'].font = edit_font
-
-    ws['A18'] = "Discount Rate"
-    ws['B18'] = 0.12
-    ws['B18'].fill = input_fill
-    ws['B18'].number_format = '0.0%'
-    ws['C18'] = "<- Edit"
-    ws['C18'].font = edit_font
-
-    ws['A19'] = "Terminal Growth Rate"
-    ws['B19'] = -0.05
-    ws['B19'].fill = input_fill
-    ws['B19'].number_format = '0.0%'
-    ws['C19'] = "<- Edit (usually negative)"
-    ws['C19'].font = edit_font
-
-    # SCENARIO ANALYSIS
-    ws['E4'] = "SCENARIO ANALYSIS"
-    ws['E4'].font = section_font
-
-    ws['F5'] = "Bear"
-    ws['F5'].font = header_font
-    ws['F5'].fill = scenario_bear_fill
-    ws['F5'].alignment = Alignment(horizontal='center')
-    ws['G5'] = "Base"
-    ws['G5'].font = header_font
-    ws['G5'].fill = scenario_base_fill
-    ws['G5'].alignment = Alignment(horizontal='center')
-    ws['H5'] = "Bull"
-    ws['H5'].font = header_font
-    ws['H5'].fill = scenario_bull_fill
-    ws['H5'].alignment = Alignment(horizontal='center')
-
-    ws['E6'] = "Base Year CF"
-    ws['F6'] = "=B13*0.9"
-    ws['G6'] = "=B13"
-    ws['H6'] = "=B13*1.1"
-    for col in ['F', 'G', 'H']:
-        ws[f'{col}6'].number_format = '#,##0.00'
-
-    ws['E7'] = "Growth (Yr 1-3)"
-    ws['F7'] = "=B16-0.02"
-    ws['G7'] = "=B16"
-    ws['H7'] = "=B16+0.03"
-    for col in ['F', 'G', 'H']:
-        ws[f'{col}7'].number_format = '0.0%'
-
-    ws['E8'] = "Growth (Yr 4-5)"
-    ws['F8'] = "=B17-0.01"
-    ws['G8'] = "=B17"
-    ws['H8'] = "=B17+0.02"
-    for col in ['F', 'G', 'H']:
-        ws[f'{col}8'].number_format = '0.0%'
-
-    ws['E9'] = "Discount Rate"
-    ws['F9'] = "=B18+0.02"
-    ws['G9'] = "=B18"
-    ws['H9'] = "=B18"
-    for col in ['F', 'G', 'H']:
-        ws[f'{col}9'].number_format = '0.0%'
-
-    ws['E10'] = "Terminal Growth"
-    ws['F10'] = "=B19-0.02"
-    ws['G10'] = "=B19"
-    ws['H10'] = "=B19+0.02"
-    for col in ['F', 'G', 'H']:
-        ws[f'{col}10'].number_format = '0.0%'
-
-    ws['E12'] = "Year 5 CF"
-    for col, c in [('F', 'F'), ('G', 'G'), ('H', 'H')]:
-        ws[f'{col}12'] = f"={c}6*(1+{c}7)^3*(1+{c}8)^2"
-        ws[f'{col}12'].number_format = '#,##0.00'
-
-    ws['E13'] = "Terminal Value"
-    for col, c in [('F', 'F'), ('G', 'G'), ('H', 'H')]:
-        ws[f'{col}13'] = f"={c}12*(1+{c}10)/({c}9-{c}10)"
-        ws[f'{col}13'].number_format = '#,##0.00'
-
-    ws['E14'] = "PV of Terminal"
-    for col, c in [('F', 'F'), ('G', 'G'), ('H', 'H')]:
-        ws[f'{col}14'] = f"={c}13/(1+{c}9)^5"
-        ws[f'{col}14'].number_format = '#,##0.00'
-
-    ws['E16'] = "Implied Value"
-    ws['E16'].font = header_font
-    for col, c in [('F', 'F'), ('G', 'G'), ('H', 'H')]:
-        ws[f'{col}16'] = (
-            f"={c}6/(1+{c}9)"
-            f"+{c}6*(1+{c}7)/(1+{c}9)^2"
-            f"+{c}6*(1+{c}7)^2/(1+{c}9)^3"
-            f"+{c}6*(1+{c}7)^3*(1+{c}8)/(1+{c}9)^4"
-            f"+{c}12/(1+{c}9)^5"
-            f"+{c}14"
-        )
-        ws[f'{col}16'].number_format = '$#,##0.00'
-        ws[f'{col}16'].font = Font(bold=True)
-
-    ws['E17'] = "vs Base Case"
-    ws['F17'] = "=F16/G16-1"
-    ws['G17'] = "-"
-    ws['H17'] = "=H16/G16-1"
-    for col in ['F', 'H']:
-        ws[f'{col}17'].number_format = '0.0%'
-
-    # WEIGHTED AVERAGE VALUATION
-    ws['E19'] = "WEIGHTED AVERAGE VALUATION"
-    ws['E19'].font = section_font
-
-    ws['E20'] = "Scenario Weights"
-    ws['E20'].font = header_font
-    ws['F20'] = "Bear Weight"
-    ws['G20'] = "Base Weight"
-    ws['H20'] = "Bull Weight"
-
-    ws['F21'] = 0.25
-    ws['F21'].fill = input_fill
-    ws['F21'].number_format = '0%'
-    ws['G21'] = 0.50
-    ws['G21'].fill = input_fill
-    ws['G21'].number_format = '0%'
-    ws['H21'] = 0.25
-    ws['H21'].fill = input_fill
-    ws['H21'].number_format = '0%'
-    ws['I21'] = "<- Edit weights (must = 100%)"
-    ws['I21'].font = edit_font
-
-    ws['E22'] = "Weight Check"
-    ws['F22'] = "=F21+G21+H21"
-    ws['F22'].number_format = '0%'
-    ws['G22'] = '=IF(F22=1,"OK","ERROR: Must = 100%")'
-
-    ws['E24'] = "WEIGHTED VALUATION"
-    ws['E24'].font = Font(bold=True, size=12)
-    ws['F24'] = "=F16*F21+G16*G21+H16*H21"
-    ws['F24'].number_format = '$#,##0.00'
-    ws['F24'].font = Font(bold=True, size=14)
-    ws['F24'].fill = weighted_fill
-
-    ws['E25'] = "Valuation Range"
-    ws['F25'] = "=F16"
-    ws['F25'].number_format = '$#,##0'
-    ws['G25'] = "to"
-    ws['H25'] = "=H16"
-    ws['H25'].number_format = '$#,##0'
-
-    ws['E26'] = "EV / Base Year CF"
-    ws['F26'] = "=F24/B13"
-    ws['F26'].number_format = '0.0x'
-
-    ws['E27'] = "Payback Period (years)"
-    ws['F27'] = "=F24/B13"
-    ws['F27'].number_format = '0.0'
-
-    # 5-YEAR DCF PROJECTION
-    ws['A21'] = "5-YEAR DCF PROJECTION"
-    ws['A21'].font = section_font
-
-    headers = ["Year", "Base", "Year 1", "Year 2", "Year 3", "Year 4", "Year 5", "Terminal"]
-    for i, h in enumerate(headers):
-        col = get_column_letter(i + 1)
-        ws[f'{col}22'] = h
-        ws[f'{col}22'].font = header_font
-
-    ws['A23'] = "Fiscal Year"
-    ws['B23'] = datetime.now().year
-    for i in range(1, 6):
-        ws[f'{get_column_letter(i+2)}23'] = f"={get_column_letter(i+1)}23+1"
-    ws['H23'] = "Perpetuity"
-
-    ws['A24'] = "Royalty Income"
-    ws['B24'] = "=B13"
-    ws['C24'] = "=B24*(1+$B$16)"
-    ws['D24'] = "=C24*(1+$B$16)"
-    ws['E24'] = "=D24*(1+$B$16)"
-    ws['F24'] = "=E24*(1+$B$17)"
-    ws['G24'] = "=F24*(1+$B$17)"
-    ws['H24'] = "=G24*(1+$B$19)"
-    for col in 'BCDEFGH':
-        ws[f'{col}24'].number_format = '#,##0.00'
-
-    ws['A25'] = "Growth Rate"
-    ws['B25'] = "-"
-    ws['C25'] = "=$B$16"
-    ws['D25'] = "=$B$16"
-    ws['E25'] = "=$B$16"
-    ws['F25'] = "=$B$17"
-    ws['G25'] = "=$B$17"
-    ws['H25'] = "=$B$19"
-    for col in 'CDEFGH':
-        ws[f'{col}25'].number_format = '0.0%'
-
-    ws['A27'] = "Discount Factor"
-    ws['B27'] = 1
-    for i in range(1, 6):
-        col = get_column_letter(i + 2)
-        ws[f'{col}27'] = f"=1/(1+$B$18)^{i}"
-        ws[f'{col}27'].number_format = '0.0000'
-    ws['H27'] = "=G27"
-    ws['H27'].number_format = '0.0000'
-
-    ws['A28'] = "PV of Cash Flow"
-    for col in ['C', 'D', 'E', 'F', 'G']:
-        ws[f'{col}28'] = f"={col}24*{col}27"
-        ws[f'{col}28'].number_format = '#,##0.00'
-
-    # VALUATION SUMMARY
-    ws['A30'] = "VALUATION SUMMARY"
-    ws['A30'].font = section_font
-
-    ws['A31'] = "Terminal Value (undiscounted)"
-    ws['B31'] = "=H24/($B$18-$B$19)"
-    ws['B31'].number_format = '#,##0.00'
-    ws['C31'] = "Gordon Growth formula"
-    ws['C31'].font = Font(italic=True, color="666666")
-
-    ws['A32'] = "PV of Terminal Value"
-    ws['B32'] = "=B31*G27"
-    ws['B32'].number_format = '#,##0.00'
-
-    ws['A34'] = "Sum of PV of Cash Flows"
-    ws['B34'] = "=SUM(C28:G28)"
-    ws['B34'].number_format = '#,##0.00'
-
-    ws['A35'] = "PV of Terminal Value"
-    ws['B35'] = "=B32"
-    ws['B35'].number_format = '#,##0.00'
-
-    ws['A36'] = "Enterprise Value"
-    ws['B36'] = "=B34+B35"
-    ws['B36'].number_format = '$#,##0.00'
-    ws['B36'].font = Font(bold=True)
-
-    ws['A38'] = "% from Cash Flows"
-    ws['B38'] = "=B34/B36"
-    ws['B38'].number_format = '0.0%'
-
-    ws['A39'] = "% from Terminal Value"
-    ws['B39'] = "=B35/B36"
-    ws['B39'].number_format = '0.0%'
-
-    # SENSITIVITY ANALYSIS 1
-    ws['A41'] = "SENSITIVITY: Discount Rate vs Growth Rate (Years 1-3)"
-    ws['A41'].font = section_font
-
-    ws['A42'] = "Enterprise Value"
-    ws['C42'] = "Growth Rate (Years 1-3)"
-    ws['C42'].font = header_font
-
-    growth_rates = [0.00, 0.02, 0.04, 0.06, 0.08, 0.10, 0.12]
-    for i, gr in enumerate(growth_rates):
-        col = get_column_letter(i + 3)
-        ws[f'{col}43'] = gr
-        ws[f'{col}43'].number_format = '0%'
-        ws[f'{col}43'].font = header_font
-        ws[f'{col}43'].alignment = Alignment(horizontal='center')
-
-    ws['A44'] = "Discount"
-    discount_rates = [0.08, 0.10, 0.12, 0.14, 0.16, 0.18]
-    for i, dr in enumerate(discount_rates):
-        row = 44 + i
-        ws[f'B{row}'] = dr
-        ws[f'B{row}'].number_format = '0%'
-        ws[f'B{row}'].font = header_font
-
-        for j in range(len(growth_rates)):
-            col = get_column_letter(j + 3)
-            formula = (
-                f"=($B$13*(1+{col}$43)^3*(1+$B$17)^2*(1+$B$19)/($B{row}-$B$19))/(1+$B{row})^5"
-                f"+$B$13/(1+$B{row})"
-                f"+$B$13*(1+{col}$43)/(1+$B{row})^2"
-                f"+$B$13*(1+{col}$43)^2/(1+$B{row})^3"
-                f"+$B$13*(1+{col}$43)^3*(1+$B$17)/(1+$B{row})^4"
-                f"+$B$13*(1+{col}$43)^3*(1+$B$17)^2/(1+$B{row})^5"
-            )
-            ws[f'{col}{row}'] = formula
-            ws[f'{col}{row}'].number_format = '#,##0'
-
-    ws['A45'] = "Rate"
-
-    # SENSITIVITY ANALYSIS 2
-    ws['A52'] = "SENSITIVITY: Discount Rate vs Terminal Growth Rate"
-    ws['A52'].font = section_font
-
-    ws['A53'] = "Enterprise Value"
-    ws['C53'] = "Terminal Growth Rate"
-    ws['C53'].font = header_font
-
-    term_growth_rates = [-0.10, -0.07, -0.05, -0.03, 0.00, 0.02, 0.03]
-    for i, tg in enumerate(term_growth_rates):
-        col = get_column_letter(i + 3)
-        ws[f'{col}54'] = tg
-        ws[f'{col}54'].number_format = '0%'
-        ws[f'{col}54'].font = header_font
-        ws[f'{col}54'].alignment = Alignment(horizontal='center')
-
-    ws['A55'] = "Discount"
-    for i, dr in enumerate(discount_rates):
-        row = 55 + i
-        ws[f'B{row}'] = dr
-        ws[f'B{row}'].number_format = '0%'
-        ws[f'B{row}'].font = header_font
-
-        for j in range(len(term_growth_rates)):
-            col = get_column_letter(j + 3)
-            formula = (
-                f"=($B$13*(1+$B$16)^3*(1+$B$17)^2*(1+{col}$54)/($B{row}-{col}$54))/(1+$B{row})^5"
-                f"+$B$13/(1+$B{row})"
-                f"+$B$13*(1+$B$16)/(1+$B{row})^2"
-                f"+$B$13*(1+$B$16)^2/(1+$B{row})^3"
-                f"+$B$13*(1+$B$16)^3*(1+$B$17)/(1+$B{row})^4"
-                f"+$B$13*(1+$B$16)^3*(1+$B$17)^2/(1+$B{row})^5"
-            )
-            ws[f'{col}{row}'] = formula
-            ws[f'{col}{row}'].number_format = '#,##0'
-
-    ws['A56'] = "Rate"
-
-    # MODEL NOTES
-    ws['A62'] = "MODEL NOTES"
-    ws['A62'].font = section_font
-
-    notes = [
-        "* Green cells are INPUT cells - edit these with your royalty data",
-        "* Royalties = pure cash flow (no costs modeled)",
-        "* Terminal Value = Year 5 CF x (1+g) / (r-g) using Gordon Growth Model",
-        "* Two-phase growth: Years 1-3 near-term, Years 4-5 mature growth",
-        "* Weighted Valuation combines Bear/Base/Bull using your probability weights",
-        "* Sensitivity tables show impact of key assumption changes"
-    ]
-    for i, note in enumerate(notes):
-        ws[f'A{63+i}'] = note
-        ws[f'A{63+i}'].font = Font(size=10, color="666666")
-
-    # Column widths
-    ws.column_dimensions['A'].width = 28
-    ws.column_dimensions['B'].width = 14
-    ws.column_dimensions['C'].width = 14
-    ws.column_dimensions['D'].width = 14
-    ws.column_dimensions['E'].width = 26
-    ws.column_dimensions['F'].width = 14
-    ws.column_dimensions['G'].width = 14
-    ws.column_dimensions['H'].width = 14
-    ws.column_dimensions['I'].width = 30
+def create_valuation_template(royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year,
+                              backend=WORKBOOK_BACKEND, monte_carlo=None, sensitivity=None):
+    """Creates the complete valuation template with data populated. Returns bytes.
 
+    backend picks the workbook writer (see valuation_workbook.BACKENDS).
+    """
     # Save to bytes
     output = io.BytesIO()
-    wb.save(output)
+    valuation_workbook.write_valuation_workbook(
+        output, royalty_name, year_minus_3, year_minus_2, year_minus_1, ytd, base_year, backend,
+        monte_carlo=monte_carlo, sensitivity=sensitivity)
     output.seek(0)
     return output
 
 
-def process_csv(file_storage):
-    """Process uploaded CSV and return Excel bytes + filename."""
+def aggregate_upload(file_storage, sheet=None):
+    """Sum an uploaded statement by year and, for dated statements, by month.
 
-    # Read the file
-    filename = file_storage.filename
-    if filename.endswith('.xlsx'):
-        df = pd.read_excel(file_storage)
-    else:
-        df = pd.read_csv(file_storage)
-
-    # Find the amount column
-    amount_col = None
-    for col in ['payable_amount', 'amount', 'earnings', 'royalty']:
-        if col in df.columns.str.lower().tolist():
-            amount_col = [c for c in df.columns if c.lower() == col][0]
-            break
-
-    if amount_col is None:
-        amount_cols = [c for c in df.columns if 'amount' in c.lower()]
-        if amount_cols:
-            amount_col = amount_cols[0]
-        else:
-            raise ValueError("Could not find an amount/earnings column in the CSV")
-
-    # Find the year column
-    year_col = None
-    for col in ['distribution_year', 'year', 'date']:
-        if col in df.columns.str.lower().tolist():
-            year_col = [c for c in df.columns if c.lower() == col][0]
-            break
-
-    if year_col is None:
-        raise ValueError("Could not find a year column in the CSV")
-
-    # Sum by year
-    yearly = df.groupby(year_col)[amount_col].sum().sort_index()
-
-    # Get years
-    current_year = datetime.now().year
-    years_list = sorted(yearly.index)
-
-    # Extract values
-    ytd = yearly.get(current_year, 0)
-    year_minus_1 = yearly.get(current_year - 1, 0)
-    year_minus_2 = yearly.get(current_year - 2, 0)
-    year_minus_3 = yearly.get(current_year - 3, 0)
-
-    # If no current year data, shift
-    if ytd == 0 and years_list:
-        latest = max(years_list)
-        ytd = yearly.get(latest, 0)
-        year_minus_1 = yearly.get(latest - 1, 0)
-        year_minus_2 = yearly.get(latest - 2, 0)
-        year_minus_3 = yearly.get(latest - 3, 0)
-
-    # Base year = most recent full year
-    base_year = year_minus_1 if year_minus_1 > 0 else ytd
+    Returns (yearly, monthly or None); CSVs are streamed in chunks and
+    Parquet/Arrow uploads read only the amount and year columns. Uploads
+    spooled to disk are read by path, through a memory map. sheet picks the
+    worksheet of an .xlsx upload (default: the first with the right columns).
+    """
+    source = _spooled_path(file_storage) or file_storage
+    return statement_reader.read_totals(source, file_storage.filename, csv_engine=CSV_ENGINE, sheet=sheet)
 
-    # Generate output filename
-    base_name = os.path.splitext(filename)[0]
-    if 'listing' in base_name.lower():
-        match = re.search(r'listing[-_]?(\d+)', base_name, re.IGNORECASE)
-        if match:
-            royalty_name = f"Listing {match.group(1)}"
-        else:
-            royalty_name = base_name
-    else:
-        royalty_name = base_name
 
+def _spooled_path(file_storage):
+    """Path of the temporary file an upload was spooled to, or None if it is in memory."""
+    stream = file_storage.stream
+    path = getattr(stream, 'name', None)
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return None
+    # Anything still buffered has to reach the file before it's reopened by path
+    stream.flush()
+    return path
+
+
+def value_upload(file_storage, monte_carlo=False, base_year_method='last_year', sheet=None):
+    """Everything a listing's workbook needs from an upload, short of writing it.
+
+    Returns (royalty_name, inputs, Monte Carlo results or None, output filename)
+    and records the valuation in the index.
+    """
+
+    # Read the file and sum by year
+    yearly, monthly = aggregate_upload(file_storage, sheet)
+    with stage_timing.stage('inputs'):
+        inputs = statement_reader.yearly_inputs(yearly, base_year_method=base_year_method, monthly=monthly)
+
+    # Generate output filename
+    royalty_name = statement_reader.listing_name(file_storage.filename)
     output_filename = f"{royalty_name} Valuation.xlsx"
 
+    with stage_timing.stage('monte_carlo'):
+        simulation = engine.monte_carlo(inputs['base_year']) if monte_carlo else None
+
+    try:
+        with stage_timing.stage('index'):
+            VALUATION_INDEX.record(royalty_name, inputs, yearly, source=file_storage.filename,
+                                   base_year_method=base_year_method)
+    except sqlite3.Error:
+        # A busy index shouldn't cost the user their download
+        app.logger.exception("Could not record %s in the valuation index", royalty_name)
+
+    return royalty_name, inputs, simulation, output_filename
+
+
+def process_csv(file_storage, monte_carlo=False, base_year_method='last_year', sheet=None, sensitivity=None):
+    """Process uploaded CSV and return Excel bytes + filename.
+
+    With monte_carlo=True the workbook also gets a Monte Carlo section;
+    sensitivity is an optional valuation_workbook.SensitivityConfig.
+    """
+    royalty_name, inputs, simulation, output_filename = value_upload(
+        file_storage, monte_carlo, base_year_method, sheet)
+
     # Create the valuation
     excel_bytes = create_valuation_template(
         royalty_name=royalty_name,
-        year_minus_3=year_minus_3,
-        year_minus_2=year_minus_2,
-        year_minus_1=year_minus_1,
-        ytd=ytd,
-        base_year=base_year
+        **inputs,
+        monte_carlo=simulation,
+        sensitivity=sensitivity
     )
-
     return excel_bytes, output_filename
 
 
+def stream_valuation(file_storage, monte_carlo=False, base_year_method='last_year', sheet=None,
+                     sensitivity=None):
+    """process_csv with the workbook as an iterator of zip bytes, written as it's sent.
+
+    Returns (chunks, output filename). The upload is read and valued up front,
+    so bad statements raise here rather than halfway through a response.
+    """
+    royalty_name, inputs, simulation, output_filename = value_upload(
+        file_storage, monte_carlo, base_year_method, sheet)
+    chunks = valuation_workbook.iter_valuation_workbook(
+        royalty_name, **inputs, backend=WORKBOOK_BACKEND, monte_carlo=simulation, sensitivity=sensitivity)
+    return chunks, output_filename
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    message = f"Upload too large: the limit is {MAX_UPLOAD_MB} MB"
+    if request.path.startswith(('/api/', '/jobs')):
+        return jsonify(error=message), 413
+    return message, 413
+
+
 @app.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
@@ -875,28 +633,680 @@ def index():
 
 @app.route('/process', methods=['POST'])
 def process():
-    if 'file' not in request.files:
+    # The multipart body is parsed (and large uploads spooled) on first access
+    with stage_timing.stage('upload'):
+        file = request.files.get('file')
+    if file is None:
         return 'No file uploaded', 400
 
-    file = request.files['file']
     if file.filename == '':
         return 'No file selected', 400
 
+    monte_carlo = _is_truthy(request.form.get('monte_carlo'))
+    base_year_method = request.form.get('base_year_method') or 'last_year'
+    sheet = request.form.get('sheet') or None
+
     try:
-        excel_bytes, output_filename = process_csv(file)
-
-        response = send_file(
-            excel_bytes,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=output_filename
-        )
-        response.headers['X-Filename'] = output_filename
-        return response
+        sensitivity = _read_sensitivity(request.form)
+        if monte_carlo:
+            # The simulation isn't seeded, so a repeat should get fresh paths rather than a cached run
+            chunks, output_filename = stream_valuation(file, monte_carlo, base_year_method, sheet, sensitivity)
+            cache_status = 'bypass'
+        else:
+            # Same file + same parameters -> same workbook, so serve repeats from the cache.
+            # The month matters too: run-rate base years depend on how much of the year has passed.
+            with stage_timing.stage('cache_key'):
+                key = result_cache.cache_key(file.stream, filename=file.filename, backend=WORKBOOK_BACKEND,
+                                             year=datetime.now().year, month=datetime.now().month,
+                                             base_year_method=base_year_method, sheet=sheet,
+                                             sensitivity=sensitivity and sensitivity.key())
+            # New workbooks are streamed into the response as they're written (and
+            # cached once complete); repeats are served from the cached bytes
+            chunks, output_filename, cache_status = RESULT_CACHE.get_or_stream(
+                key, lambda: stream_valuation(file, monte_carlo, base_year_method, sheet, sensitivity))
+        chunks = iter(chunks)
+        # Pull the first chunk now so any error becomes a 400 before headers go out
+        first = next(chunks, b'')
+    except Exception as e:
+        return str(e), 400
+
+    def generate():
+        yield first
+        yield from chunks
 
+    response = Response(stream_with_context(generate()), mimetype=XLSX_MIMETYPE)
+    if hasattr(chunks, 'close'):
+        # Closed even if the response is never iterated, so the cache isn't left waiting
+        response.call_on_close(chunks.close)
+    _set_attachment(response, output_filename)
+    response.headers['X-Cache'] = cache_status
+    return response
+
+
+def _set_attachment(response, filename):
+    """Content-Disposition (as send_file writes it) and X-Filename for a download."""
+    try:
+        filename.encode('ascii')
+        response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    except UnicodeEncodeError:
+        fallback = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        response.headers.set('Content-Disposition', 'attachment', filename=fallback,
+                             **{'filename*': f"UTF-8''{quote(filename, safe='')}"})
+    response.headers['X-Filename'] = filename
+
+
+def _is_truthy(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+# Form/JSON fields for the sensitivity table axes, as SensitivityConfig arguments
+SENSITIVITY_FIELDS = {
+    'sensitivity_growth': 'growth_rates',
+    'sensitivity_discount': 'discount_rates',
+    'sensitivity_terminal': 'terminal_rates',
+}
+
+
+def _read_sensitivity(source):
+    """SensitivityConfig from a form or JSON body, or None when no sensitivity field is set.
+
+    Axes are 'start:stop:count' or comma separated rates (see
+    valuation_workbook.parse_axis), or lists of rates in JSON;
+    sensitivity_mode is one of valuation_workbook.SENSITIVITY_MODES.
+    """
+    options = {}
+    for field, name in SENSITIVITY_FIELDS.items():
+        value = source.get(field)
+        if value in (None, ''):
+            continue
+        options[name] = valuation_workbook.parse_axis(value) if isinstance(value, str) else value
+    if source.get('sensitivity_mode'):
+        options['mode'] = source['sensitivity_mode']
+    return valuation_workbook.SensitivityConfig(**options) if options else None
+
+
+def _index_filters(args):
+    """valuation_index query filters from request args."""
+    filters = {'descending': not _is_truthy(args.get('ascending')),
+               'history': _is_truthy(args.get('history'))}
+    if args.get('order_by'):
+        filters['order_by'] = args['order_by']
+    if args.get('listing'):
+        filters['listing'] = args['listing']
+    for field in ('min_value', 'max_value', 'min_multiple', 'max_multiple'):
+        if args.get(field) not in (None, ''):
+            filters[field] = float(args[field])
+    return filters
+
+
+@app.route('/valuations')
+def valuations():
+    """Recorded valuations, best EV/base CF multiple first (see valuation_index.query for filters)."""
+    try:
+        filters = _index_filters(request.args)
+        limit = int(request.args.get('limit', valuation_index.DEFAULT_LIMIT))
+        filters['limit'] = max(1, min(limit, valuation_index.MAX_LIMIT))
+        rows = VALUATION_INDEX.query(**filters)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(count=len(rows), valuations=rows)
+
+
+@app.route('/valuations/export.csv')
+def export_valuations():
+    """Every recorded valuation matching the filters as a streamed CSV download."""
+    try:
+        filters = _index_filters(request.args)
+        if request.args.get('limit'):
+            filters['limit'] = int(request.args['limit'])
+        rows = VALUATION_INDEX.export_rows(**filters)
+        header = next(rows)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        for i, row in enumerate(rows, start=1):
+            writer.writerow(row)
+            if i % 1000 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="valuations-{stamp}.csv"'})
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(RESULT_CACHE.stats())
+
+
+# ============================================================================
+# BACKGROUND JOBS: submit, poll, download
+# ============================================================================
+def _process_path(input_path, filename, monte_carlo=False, base_year_method='last_year', sheet=None,
+                  sensitivity=None):
+    """process_csv for an upload spooled to disk (runs in a job worker process).
+
+    The options are _job_options(); sensitivity is the form's sensitivity fields.
+    """
+    with open(input_path, 'rb') as f:
+        excel_bytes, output_filename = process_csv(FileStorage(f, filename=filename), monte_carlo,
+                                                   base_year_method, sheet, _read_sensitivity(sensitivity or {}))
+    return excel_bytes.getvalue(), output_filename
+
+
+def _job_options(form):
+    """The /process options of a job submission, as JSON-friendly keyword arguments for _process_path.
+
+    Sensitivity fields are validated here so bad axes are a 400 rather than a failed job.
+    """
+    _read_sensitivity(form)
+    sensitivity = {field: form[field] for field in (*SENSITIVITY_FIELDS, 'sensitivity_mode') if form.get(field)}
+    return {
+        'monte_carlo': _is_truthy(form.get('monte_carlo')),
+        'base_year_method': form.get('base_year_method') or 'last_year',
+        'sheet': form.get('sheet') or None,
+        'sensitivity': sensitivity or None,
+    }
+
+
+JOBS = job_queue.JobQueue(
+    _process_path,
+    job_dir=os.environ.get('JOB_DIR') or os.path.join(tempfile.gettempdir(), 'royalty-valuation-jobs'),
+    small_workers=int(os.environ.get('JOB_WORKERS', 0)) or None,
+    large_workers=int(os.environ.get('JOB_LARGE_WORKERS', 1)),
+    large_bytes=int(os.environ.get('JOB_LARGE_MB', 50)) * 1024 * 1024,
+)
+
+
+# ============================================================================
+# JSON VALUATION API
+# ============================================================================
+ASSUMPTION_FIELDS = ('growth_1_3', 'growth_4_5', 'discount', 'terminal_growth')
+MONTE_CARLO_FIELDS = ('growth_1_3_sd', 'growth_4_5_sd', 'discount_sd', 'terminal_sd')
+# Upper bound on simulated paths per request (~8 bytes x 5 arrays per path)
+MAX_MONTE_CARLO_PATHS = 5_000_000
+
+
+def _json_inputs(values):
+    """Plain floats for the Year -3..YTD/base year inputs."""
+    return {k: float(v) for k, v in values.items()}
+
+
+def _read_assumptions(source):
+    """Optional model overrides from a form or JSON body, falling back to the sheet defaults."""
+    assumptions = {
+        'growth_1_3': engine.GROWTH_1_3,
+        'growth_4_5': engine.GROWTH_4_5,
+        'discount': engine.DISCOUNT_RATE,
+        'terminal_growth': engine.TERMINAL_GROWTH,
+        'weights': engine.SCENARIO_WEIGHTS,
+    }
+    for field in ASSUMPTION_FIELDS:
+        if source.get(field) not in (None, ''):
+            assumptions[field] = float(source[field])
+    weights = source.get('weights')
+    if weights not in (None, ''):
+        if isinstance(weights, str):
+            weights = weights.split(',')
+        weights = tuple(float(w) for w in weights)
+        if len(weights) != 3:
+            raise ValueError("weights must have three values (bear, base, bull)")
+        assumptions['weights'] = weights
+    return assumptions
+
+
+def _read_monte_carlo(source):
+    """Monte Carlo options: true/'1', or a dict of paths/seed/standard deviations. None if off."""
+    options = source.get('monte_carlo')
+    if isinstance(options, dict):
+        pass
+    elif _is_truthy(options):
+        # Form posts flatten the options into mc_* fields
+        options = {k[3:]: source[k] for k in source.keys() if k.startswith('mc_')}
+    else:
+        return None
+
+    settings = {}
+    if options.get('paths') not in (None, ''):
+        settings['paths'] = int(options['paths'])
+        if not 0 < settings['paths'] <= MAX_MONTE_CARLO_PATHS:
+            raise ValueError(f"paths must be between 1 and {MAX_MONTE_CARLO_PATHS:,}")
+    if options.get('seed') not in (None, ''):
+        settings['seed'] = int(options['seed'])
+    for field in MONTE_CARLO_FIELDS:
+        if options.get(field) not in (None, ''):
+            settings[field] = float(options[field])
+    return settings
+
+
+@app.route('/api/valuation', methods=['POST'])
+def api_valuation():
+    """Value a listing and return every model output as JSON.
+
+    Accepts either an uploaded statement ('file') or a JSON body with
+    already-aggregated data: {"yearly": {"2023": 1234.5, ...}} or the inputs
+    themselves ({"base_year": ..., "year_minus_1": ...}). Assumption overrides
+    (growth_1_3, growth_4_5, discount, terminal_growth, weights) are optional,
+    as are the sensitivity axes (sensitivity_growth, sensitivity_discount,
+    sensitivity_terminal), and "monte_carlo" adds simulated percentiles and a histogram.
+    """
+    try:
+        if 'file' in request.files and request.files['file'].filename:
+            file = request.files['file']
+            yearly, monthly = aggregate_upload(file, request.form.get('sheet') or None)
+            inputs = statement_reader.yearly_inputs(
+                yearly, base_year_method=request.form.get('base_year_method') or 'last_year', monthly=monthly)
+            listing = statement_reader.listing_name(file.filename)
+            source = request.form
+        else:
+            body = request.get_json(silent=True)
+            if not isinstance(body, dict):
+                return jsonify(error="Upload a statement or send a JSON body"), 400
+            listing = body.get('listing', '')
+            if 'yearly' in body:
+                yearly = pd.Series({int(y): float(v) for y, v in body['yearly'].items()}).sort_index()
+                inputs = statement_reader.yearly_inputs(yearly)
+            elif 'base_year' in body:
+                yearly = pd.Series(dtype='float64')
+                inputs = {k: float(body.get(k, 0)) for k in
+                          ('year_minus_3', 'year_minus_2', 'year_minus_1', 'ytd', 'base_year')}
+            else:
+                return jsonify(error="JSON body needs 'yearly' or 'base_year'"), 400
+            source = body.get('assumptions', body)
+
+        assumptions = _read_assumptions(source)
+        sensitivity = _read_sensitivity(source) or valuation_workbook.SensitivityConfig()
+        summary = engine.summarize_listing(inputs['base_year'], **assumptions,
+                                           growth_rates=sensitivity.growth_rates,
+                                           discount_rates=sensitivity.discount_rates,
+                                           terminal_rates=sensitivity.terminal_rates)
+
+        monte_carlo = _read_monte_carlo(source)
+        if monte_carlo is not None:
+            means = {k: assumptions[k] for k in ASSUMPTION_FIELDS}
+            summary['monte_carlo'] = engine.monte_carlo(inputs['base_year'], **means, **monte_carlo)
+    except (zipfile.BadZipFile, KeyError):
+        # Not an .xlsx package, or one missing a part its workbook refers to
+        return jsonify(error="Could not read the spreadsheet"), 400
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify(error=str(e)), 400
+
+    return jsonify(
+        listing=listing,
+        yearly={str(int(y)): float(v) for y, v in yearly.items()},
+        total=float(yearly.sum()),
+        inputs=_json_inputs(inputs),
+        **summary,
+    )
+
+
+# ============================================================================
+# BULK UPLOADS: many statements (or a zip of them) in, one zip of workbooks
+# (or one portfolio workbook) out
+# ============================================================================
+STATEMENT_EXTENSIONS = statement_reader.STATEMENT_EXTENSIONS
+
+# Most entries and uncompressed MB a zip upload may expand to on the spool disk
+MAX_ZIP_MEMBERS = int(os.environ.get('MAX_ZIP_MEMBERS', 10000))
+MAX_ZIP_MB = int(os.environ.get('MAX_ZIP_MB', 4096))
+
+_bulk_pool = None
+_bulk_pool_lock = threading.Lock()
+
+
+def _get_bulk_pool():
+    """Process pool for bulk uploads, started on first use."""
+    global _bulk_pool
+    with _bulk_pool_lock:
+        if _bulk_pool is None:
+            _bulk_pool = ProcessPoolExecutor(max_workers=int(os.environ.get('BULK_WORKERS', 0)) or None)
+        return _bulk_pool
+
+
+def _spool_statements(uploads, spool_dir):
+    """Save uploaded statements (expanding zips) to disk; returns [(path, filename)].
+
+    Raises ValueError for a zip with more than MAX_ZIP_MEMBERS entries or
+    more than MAX_ZIP_MB of statements once uncompressed.
+    """
+    statements = []
+    unzipped = 0
+
+    def spool(stream, filename):
+        path = os.path.join(spool_dir, str(len(statements)))
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(stream, f)
+        statements.append((path, filename))
+
+    for upload in uploads:
+        if not upload.filename:
+            continue
+        if upload.filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(upload.stream) as archive:
+                members = archive.infolist()
+                if len(members) > MAX_ZIP_MEMBERS:
+                    raise ValueError(f"{upload.filename} has more than {MAX_ZIP_MEMBERS} files")
+                for member in members:
+                    # Only the statements themselves; skip folders and macOS resource forks
+                    name = os.path.basename(member.filename)
+                    if member.is_dir() or name.startswith('.') or '__MACOSX' in member.filename:
+                        continue
+                    if name.lower().endswith(STATEMENT_EXTENSIONS):
+                        # zipfile never reads past the declared size, so checking it bounds the disk used
+                        unzipped += member.file_size
+                        if unzipped > MAX_ZIP_MB * 1024 * 1024:
+                            raise ValueError(f"{upload.filename} expands to more than {MAX_ZIP_MB} MB")
+                        with archive.open(member) as stream:
+                            spool(stream, name)
+        else:
+            spool(upload.stream, os.path.basename(upload.filename))
+    return statements
+
+
+def _stream_bulk_zip(statements, spool_dir):
+    """Process statements concurrently, yielding zip bytes as each workbook finishes."""
+    sink = valuation_workbook.ChunkSink()
+    errors = []
+    used_names = set()
+    try:
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+            pool = _get_bulk_pool()
+            futures = {pool.submit(_process_path, path, filename): filename
+                       for path, filename in statements}
+            for future in as_completed(futures):
+                try:
+                    excel_bytes, output_filename = future.result()
+                except Exception as e:
+                    errors.append(f"{futures[future]}: {e}")
+                    continue
+
+                # Two statements can map to the same listing name
+                name, n = output_filename, 2
+                while name in used_names:
+                    stem, ext = os.path.splitext(output_filename)
+                    name, n = f"{stem} ({n}){ext}", n + 1
+                used_names.add(name)
+
+                # Workbooks are already zip-compressed, so store them as-is
+                archive.writestr(name, excel_bytes, compress_type=zipfile.ZIP_STORED)
+                yield sink.take()
+
+            if errors:
+                archive.writestr('errors.txt', "\n".join(errors) + "\n")
+        yield sink.take()
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+def _value_path(input_path, filename, base_year_method='last_year'):
+    """(listing name, valuation inputs) for a statement spooled to disk (runs in a pool worker)."""
+    with open(input_path, 'rb') as f:
+        royalty_name, inputs, _, _ = value_upload(FileStorage(f, filename=filename),
+                                                  base_year_method=base_year_method)
+    return royalty_name, inputs
+
+
+def _stream_portfolio(statements, spool_dir, base_year_method='last_year', sensitivity=None):
+    """Value statements concurrently, yielding the portfolio workbook as its sheets are written.
+
+    Sheets follow the upload order; statements that can't be valued are
+    listed on the summary sheet.
+    """
+    errors = []
+
+    def listings():
+        pool = _get_bulk_pool()
+        futures = [(pool.submit(_value_path, path, filename, base_year_method), filename)
+                   for path, filename in statements]
+        for future, filename in futures:
+            try:
+                yield future.result()
+            except Exception as e:
+                errors.append(f"{filename}: {e}")
+
+    try:
+        yield from valuation_workbook.iter_portfolio_workbook(listings(), sensitivity, errors)
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+def _spool_request_statements():
+    """Spool the request's uploaded statements; returns (spool_dir, statements) or (None, error response)."""
+    uploads = request.files.getlist('files') + request.files.getlist('file')
+    if not uploads:
+        return None, ('No files uploaded', 400)
+
+    spool_dir = tempfile.mkdtemp(prefix='royalty-bulk-')
+    try:
+        statements = _spool_statements(uploads, spool_dir)
+    except zipfile.BadZipFile:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        return None, ('Could not read the zip file', 400)
+    except ValueError as e:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        return None, (str(e), 400)
+    if not statements:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        return None, ('No CSV, Excel, Parquet or Arrow statements found in the upload', 400)
+    return spool_dir, statements
+
+
+@app.route('/process/bulk', methods=['POST'])
+def process_bulk():
+    spool_dir, statements = _spool_request_statements()
+    if spool_dir is None:
+        return statements
+
+    output_filename = f"Valuations {datetime.now().strftime('%Y-%m-%d')}.zip"
+    response = Response(stream_with_context(_stream_bulk_zip(statements, spool_dir)),
+                        mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{output_filename}"'
+    response.headers['X-Filename'] = output_filename
+    return response
+
+
+@app.route('/process/portfolio', methods=['POST'])
+def process_portfolio():
+    """Many statements in, one workbook out: a summary sheet plus a sheet per listing."""
+    try:
+        sensitivity = _read_sensitivity(request.form)
+    except (ValueError, TypeError) as e:
+        return str(e), 400
+    base_year_method = request.form.get('base_year_method') or 'last_year'
+    spool_dir, statements = _spool_request_statements()
+    if spool_dir is None:
+        return statements
+
+    output_filename = f"Portfolio Valuation {datetime.now().strftime('%Y-%m-%d')}.xlsx"
+    response = Response(stream_with_context(_stream_portfolio(statements, spool_dir, base_year_method,
+                                                              sensitivity)),
+                        mimetype=XLSX_MIMETYPE)
+    _set_attachment(response, output_filename)
+    return response
+
+
+# ============================================================================
+# MARKETPLACE EXPORTS: one statement covering many listings in, a results
+# table (or one portfolio workbook) out
+# ============================================================================
+@app.route('/process/marketplace', methods=['POST'])
+def process_marketplace():
+    """Value every listing of a marketplace export (a statement with a listing_id column) in one pass.
+
+    Returns the results table as CSV, or with output=portfolio a workbook with
+    a summary sheet and a sheet per listing.
+    """
+    with stage_timing.stage('upload'):
+        file = request.files.get('file')
+    if file is None or file.filename == '':
+        return 'No file uploaded', 400
+    base_year_method = request.form.get('base_year_method') or 'last_year'
+    output = request.form.get('output') or 'csv'
+    if output not in ('csv', 'portfolio'):
+        return f"Unknown output '{output}' (choose from csv, portfolio)", 400
+
+    try:
+        sensitivity = _read_sensitivity(request.form)
+        results, yearly = marketplace.value_statement(_spooled_path(file) or file, file.filename,
+                                                      base_year_method, csv_engine=CSV_ENGINE)
     except Exception as e:
         return str(e), 400
 
+    try:
+        with stage_timing.stage('index'):
+            VALUATION_INDEX.record_many(marketplace.index_entries(results, yearly), source=file.filename,
+                                        base_year_method=base_year_method)
+    except sqlite3.Error:
+        app.logger.exception("Could not record %s in the valuation index", file.filename)
+
+    stem = os.path.splitext(os.path.basename(file.filename))[0] or 'Marketplace'
+    if output == 'portfolio':
+        chunks = valuation_workbook.iter_portfolio_workbook(marketplace.listings_for_workbooks(results), sensitivity)
+        response = Response(stream_with_context(chunks), mimetype=XLSX_MIMETYPE)
+        _set_attachment(response, f"{stem} Valuation.xlsx")
+        return response
+
+    buffer = io.StringIO()
+    marketplace.write_results_csv(results, buffer)
+    response = Response(buffer.getvalue(), mimetype='text/csv')
+    _set_attachment(response, f"{stem} Results.csv")
+    return response
+
+
+def _job_json(job):
+    result = {k: job[k] for k in ('id', 'status', 'filename', 'lane', 'created_at',
+                                  'started_at', 'finished_at', 'error')}
+    result['status_url'] = url_for('job_status', job_id=job['id'])
+    if job['status'] == job_queue.DONE:
+        result['download_url'] = url_for('job_download', job_id=job['id'])
+    return result
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    if 'file' not in request.files:
+        return 'No file uploaded', 400
+
+    file = request.files['file']
+    if file.filename == '':
+        return 'No file selected', 400
+
+    try:
+        options = _job_options(request.form)
+    except (ValueError, TypeError) as e:
+        return str(e), 400
+    try:
+        job = JOBS.submit(file, options)
+    except job_queue.QueueFull as e:
+        return str(e), 503
+    return jsonify(_job_json(job)), 202
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return 'Unknown job', 404
+    return jsonify(_job_json(job))
+
+
+@app.route('/jobs/<job_id>/download')
+def job_download(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return 'Unknown job', 404
+    if job['status'] == job_queue.ERROR:
+        return job['error'], 400
+    if job['status'] != job_queue.DONE:
+        return f"Job is {job['status']}", 409
+
+    response = send_file(
+        job['output_path'],
+        mimetype=XLSX_MIMETYPE,
+        as_attachment=True,
+        download_name=job['output_filename']
+    )
+    response.headers['X-Filename'] = job['output_filename']
+    return response
+
+
+# ============================================================================
+# TIMING, METRICS AND PROFILING
+# ============================================================================
+@app.before_request
+def start_timing():
+    g.timings = stage_timing.begin()
+    g.profiler = None
+    if PROFILE_SLOW_MS > 0:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            g.profiler = profiler
+        except ValueError:
+            # Python 3.12+ allows one profiler at a time; concurrent requests go unprofiled
+            pass
+
+
+@app.after_request
+def add_server_timing(response):
+    """Stages finished before the headers go out (streamed bodies are timed in /metrics only)."""
+    timings = g.get('timings')
+    if timings is not None:
+        response.headers['Server-Timing'] = timings.server_timing()
+    g.status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_timing(error=None):
+    # With stream_with_context this runs once the body has been sent
+    timings = g.pop('timings', None)
+    stage_timing.end()
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+    if timings is None:
+        return
+
+    elapsed = timings.elapsed()
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    for name, seconds in timings.stages.items():
+        STAGE_SECONDS.observe(seconds, endpoint=endpoint, stage=name)
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, status=g.get('status', 500))
+
+    if profiler is not None and elapsed * 1000 >= PROFILE_SLOW_MS:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = re.sub(r'\W+', '_', endpoint).strip('_') or 'index'
+        path = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{name}-{elapsed * 1000:.0f}ms.prof")
+        profiler.dump_stats(path)
+        app.logger.warning("Slow request %s %s (%.0f ms) profiled to %s",
+                           request.method, request.path, elapsed * 1000, path)
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for this process."""
+    stats = RESULT_CACHE.stats()
+    events = {event: stats[event] for event in ('memory_hits', 'disk_hits', 'coalesced', 'misses', 'errors',
+                                                'memory_evictions', 'disk_evictions')}
+    text = ''.join([
+        STAGE_SECONDS.render(),
+        REQUEST_SECONDS.render(),
+        stage_timing.render_values('royalty_result_cache_events_total', 'Result cache lookups and evictions.',
+                                   'counter', events, label='event'),
+        stage_timing.render_values('royalty_result_cache_bytes', 'Bytes held by each result cache tier.',
+                                   'gauge', {'memory': stats['memory_bytes'], 'disk': stats['disk_bytes'] or 0},
+                                   label='tier'),
+    ])
+    return Response(text, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
 if __name__ == '__main__':
     import socket
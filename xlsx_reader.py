@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Streaming, read-only reader for .xlsx statements.
+The sheet's XML is decompressed block by block and scanned with regular
+expressions for just the cells of the amount and year columns, summing
+amounts per distinct year/date as it goes. No DataFrame or cell objects are
+built, and shared strings are only looked up for the header and the distinct
+year/date keys, so memory stays small and reading is several times faster
+than pd.read_excel.
+
+Sheets whose cells carry no references (r="C5"), which a few writers omit,
+raise Unsupported so the caller can fall back to a full reader.
+"""
+
+import html
+import posixpath
+import re
+import zipfile
+from xml.etree import ElementTree
+
+# Decompressed bytes scanned at a time
+BLOCK_BYTES = 4 * 1024 * 1024
+
+# The header is the first of this many rows that names an amount and a year column
+HEADER_ROWS = 20
+
+_NS = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+}
+
+_CELL = re.compile(rb'<(\w+:)?c\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?c>)', re.S)
+_REF = re.compile(rb'\br="([A-Z]{1,3})(\d+)"')
+_TYPE = re.compile(rb'\bt="(\w+)"')
+_VALUE = re.compile(rb'<(?:\w+:)?v>(.*?)</(?:\w+:)?v>', re.S)
+_TEXT = re.compile(rb'<(?:\w+:)?t\b[^>]*>(.*?)</(?:\w+:)?t>', re.S)
+_ROW_END = re.compile(rb'</(?:\w+:)?row>')
+_SHEET_DATA = re.compile(rb'<(?:\w+:)?sheetData\b')
+
+
+class Unsupported(ValueError):
+    """The sheet can't be streamed (e.g. its cells have no references)."""
+
+
+def _text(raw):
+    return html.unescape(raw.decode('utf-8'))
+
+
+def _cell_value(kind, inner):
+    """A cell's value from its t attribute and contents: float, str, ('s', index) for a shared string, or None."""
+    if not inner:
+        return None
+    if not kind or kind == b'n':
+        # Plain numbers are by far the most common cell
+        if inner[:3] == b'<v>' and inner[-4:] == b'</v>':
+            return float(inner[3:-4])
+        kind = b'n'
+    if kind == b'inlineStr':
+        return _text(b''.join(_TEXT.findall(inner)))
+    value = _VALUE.search(inner)
+    if value is None:
+        return None
+    value = value.group(1)
+    if kind == b's':
+        return ('s', int(value))
+    if kind in (b'str', b'd'):
+        return _text(value)
+    if kind in (b'e', b'b'):
+        return None
+    return float(value)
+
+
+def _open(source):
+    return zipfile.ZipFile(getattr(source, 'stream', source))
+
+
+def _sheets(archive):
+    """[(name, part path)] for every worksheet, in workbook order, and the date1904 flag."""
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    rels = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels.findall('rel:Relationship', _NS)}
+
+    sheets = []
+    for sheet in workbook.findall('main:sheets/main:sheet', _NS):
+        target = targets.get(sheet.get(f"{{{_NS['r']}}}id"), '')
+        path = target.lstrip('/') if target.startswith('/') else posixpath.normpath(f'xl/{target}')
+        if path in archive.NameToInfo and 'worksheets/' in path:
+            sheets.append((sheet.get('name'), path))
+
+    properties = workbook.find('main:workbookPr', _NS)
+    date1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+    return sheets, date1904
+
+
+def sheet_names(source):
+    """Names of the worksheets in a workbook, in order."""
+    with _open(source) as archive:
+        return [name for name, _ in _sheets(archive)[0]]
+
+
+def _shared_strings(archive, indices=None):
+    """{index: text} for the given shared-string indices (all of them when None)."""
+    if 'xl/sharedStrings.xml' not in archive.NameToInfo or indices == set():
+        return {}
+    strings, last = {}, max(indices) if indices else None
+    tag = f"{{{_NS['main']}}}si"
+    with archive.open('xl/sharedStrings.xml') as f:
+        index = 0
+        for _, element in ElementTree.iterparse(f):
+            if element.tag != tag:
+                continue
+            if indices is None or index in indices:
+                # Rich text splits a string into runs (phonetic hints in <rPh> aren't part of it)
+                runs = element.findall('main:t', _NS) or element.findall('main:r/main:t', _NS)
+                strings[index] = ''.join(t.text or '' for t in runs)
+            element.clear()
+            index += 1
+            if last is not None and index > last:
+                break
+    return strings
+
+
+def _row_blocks(stream):
+    """Decompressed sheet XML from <sheetData> on, in blocks that end on a row boundary."""
+    pending = b''
+    started = False
+    while True:
+        data = stream.read(BLOCK_BYTES)
+        pending += data
+        if not started:
+            match = _SHEET_DATA.search(pending)
+            if match is None:
+                if not data:
+                    return
+                continue
+            pending = pending[match.start():]
+            started = True
+        if not data:
+            if pending:
+                yield pending
+            return
+        # Look for the last row end near the end first; rows are rarely long
+        last = None
+        for start in (max(0, len(pending) - 65536), max(0, len(pending) - len(data) - 16)):
+            for last in _ROW_END.finditer(pending, start):
+                pass
+            if last is not None:
+                break
+        if last is not None:
+            yield pending[:last.end()]
+            pending = pending[last.end():]
+
+
+def _find_header(blocks, archive, detect):
+    """Scan the first rows for the header.
+
+    Returns (header row number, {column letter: name}, detected columns, the
+    cells' namespace prefix) and the blocks read so far, which still need
+    scanning for data rows.
+    """
+    rows, seen, prefix = {}, [], b''
+    for block in blocks:
+        seen.append(block)
+        for match in _CELL.finditer(block):
+            prefix, attrs, inner = match.groups()
+            ref = _REF.search(attrs)
+            if ref is None:
+                raise Unsupported("The sheet's cells have no references")
+            column, row = ref.group(1).decode(), int(ref.group(2))
+            if row not in rows and len(rows) == HEADER_ROWS:
+                break
+            kind = _TYPE.search(attrs)
+            rows.setdefault(row, {})[column] = _cell_value(kind and kind.group(1), inner)
+        else:
+            continue
+        break
+
+    shared = _shared_strings(archive, {v[1] for cells in rows.values() for v in cells.values()
+                                       if isinstance(v, tuple)})
+    error = ValueError("The sheet is empty")
+    for row, cells in sorted(rows.items()):
+        names = {column: str(shared.get(v[1], '') if isinstance(v, tuple) else v)
+                 for column, v in cells.items() if v is not None}
+        try:
+            detected = detect(list(names.values()))
+        except ValueError as e:
+            error = e
+            continue
+        return (row, names, detected, prefix or b''), seen
+    raise error
+
+
+def sum_by_column(source, detect, sheet=None):
+    """Sum a statement sheet's amounts per distinct year/date value.
+
+    detect maps header names to (amount_col, year_col), raising ValueError
+    when they aren't there (statement_reader.detect_columns). sheet is a
+    name, a 0-based index, or None for the first sheet with such a header.
+
+    Returns (amount_col, year_col, {key: total}, date1904), where keys are
+    floats (years, or Excel date serials) or strings, as stored in the sheet.
+    """
+    with _open(source) as archive:
+        sheets, date1904 = _sheets(archive)
+        if not sheets:
+            raise ValueError("The workbook has no worksheets")
+        if sheet is None:
+            candidates = sheets
+        elif isinstance(sheet, int):
+            if not -len(sheets) <= sheet < len(sheets):
+                raise ValueError(f"Sheet index {sheet} is out of range ({len(sheets)} sheets)")
+            candidates = [sheets[sheet]]
+        else:
+            candidates = [s for s in sheets if s[0] == sheet]
+            if not candidates and str(sheet).isdigit() and int(sheet) < len(sheets):
+                candidates = [sheets[int(sheet)]]
+            if not candidates:
+                raise ValueError(f"No sheet named '{sheet}' (sheets: {', '.join(n for n, _ in sheets)})")
+
+        error = None
+        for name, path in candidates:
+            with archive.open(path) as stream:
+                blocks = _row_blocks(stream)
+                try:
+                    header, seen = _find_header(blocks, archive, detect)
+                except Unsupported:
+                    raise
+                except ValueError as e:
+                    error = error or ValueError(f"Sheet '{name}': {e}")
+                    continue
+                return _sum_rows(archive, header, seen, blocks) + (date1904,)
+        raise error
+
+
+def _sum_rows(archive, header, seen, blocks):
+    header_row, names, (amount_col, year_col), prefix = header
+    letters = {name: column for column, name in names.items()}
+    amount_letter, year_letter = letters[amount_col].encode(), letters[year_col].encode()
+
+    # Only cells in the two columns are matched, with their column, row, type and
+    # contents captured in one go; everything else is skipped by the regex engine.
+    # Writers almost always put r first, which the first branch matches cheaply.
+    columns = re.escape(amount_letter) + b'|' + re.escape(year_letter)
+    tag = re.escape(prefix) + b'c'
+    cells = re.compile(
+        b'<' + tag + rb'\s(?:r="(' + columns + rb')(\d+)"|(?!r=)(?=[^>]*?\br="(' + columns + rb')(\d+)"))'
+        rb'(?:(?=[^>]*?\bt="(\w+)"))?[^>]*?(?:/>|>(.*?)</' + tag + b'>)', re.S)
+
+    sums = {}
+    text_amounts = []
+    current, key, amount = None, None, None
+    past_header = False
+    for block in _chain(seen, blocks):
+        for match in cells.finditer(block):
+            column, row, column_later, row_later, kind, inner = match.groups()
+            if column is None:
+                column, row = column_later, row_later
+            if not past_header:
+                if int(row) <= header_row:
+                    continue
+                past_header = True
+            if row != current:
+                _add(sums, text_amounts, key, amount)
+                current, key, amount = row, None, None
+            if column == year_letter:
+                key = _cell_value(kind, inner)
+            else:
+                amount = _cell_value(kind, inner)
+    _add(sums, text_amounts, key, amount)
+
+    # Amounts stored as text (rare) need the whole shared-string table
+    if text_amounts:
+        shared = _shared_strings(archive) if any(isinstance(a, tuple) for _, a in text_amounts) else {}
+        for k, amount in text_amounts:
+            text = shared.get(amount[1], '') if isinstance(amount, tuple) else amount
+            if not text.strip():
+                continue
+            try:
+                value = float(text.replace(',', '').strip())
+            except ValueError:
+                raise ValueError(f"Non-numeric amount '{text}' in column '{amount_col}'") from None
+            sums[k] = sums.get(k, 0.0) + value
+
+    # Shared-string keys (text dates or years) are resolved once per distinct value
+    shared_keys = {k[1] for k in sums if isinstance(k, tuple)}
+    if shared_keys:
+        shared = _shared_strings(archive, shared_keys)
+        resolved = {}
+        for k, total in sums.items():
+            k = shared.get(k[1], '') if isinstance(k, tuple) else k
+            resolved[k] = resolved.get(k, 0.0) + total
+        sums = resolved
+    return amount_col, year_col, sums
+
+
+def _add(sums, text_amounts, key, amount):
+    """Fold one row's amount into the sums (text amounts are set aside for later)."""
+    if key is None or amount is None:
+        return
+    if isinstance(amount, float):
+        sums[key] = sums.get(key, 0.0) + amount
+    else:
+        text_amounts.append((key, amount))
+
+
+def _chain(seen, blocks):
+    yield from seen
+    yield from blocks